@@ -7,6 +7,7 @@ Created on Fri May 24 17:42:08 2019
 
 from pure_photonics_utils import ITLA
 from laser import Laser
+from jump_plan import JumpPlan
 import time
 
 laser = Laser('COM2', 115200)
@@ -17,14 +18,15 @@ laser_err = laser.laser_on(freq)
 
 if laser_err == ITLA.NOERROR:
 
-    for i in range(9):
-        freq = 193 + i * 0.35
-        laser.clean_jump(freq)
-        time.sleep(1)
+    # Register values for all 9 jumps are calculated once, before the first jump
+    plan = JumpPlan.from_range(laser.get_calibration(), 193, 193 + 8 * 0.35, 0.35)
+
+    for timing in plan.run(laser, dwell=1):
+        print('%f THz -> %f THz in %.3f s' % (timing.frequency, timing.claimed_frequency, timing.total))
 
     time.sleep(1)
-    laser.ITLACommunicate(ITLA.REG_Cjumpon, 0, ITLA.WRITE)
+    laser.itla_communicate(ITLA.REG_Cjumpon, 0, ITLA.WRITE)
 
     laser.laser_off()
 
-laser.ITLADisconnect()
+laser.itla_disconnect()
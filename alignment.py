@@ -0,0 +1,109 @@
+"""
+Streaming alignment of laser telemetry with power meter samples.
+
+The laser's frequency and output power are read at a few tens of Hz, while the power meter is sampled as fast as it
+answers. ``StreamingAligner`` interpolates the laser readings onto the power meter timestamps as both arrive. Only
+the new samples are interpolated on each call, using a short tail of earlier laser readings for continuity, so the
+cost of an update does not grow with the length of the scan.
+"""
+
+import numpy as np
+
+from sample_buffer import SampleBuffer
+
+
+class StreamingAligner:
+    """Interpolates (time, frequency, power) laser readings onto power meter timestamps incrementally"""
+    LINEAR = 'linear'
+    CUBIC = 'cubic'
+    TAIL = 4  # Laser readings kept from earlier updates, enough for the four-point cubic
+
+    def __init__(self, mode=LINEAR):
+        """
+        :param mode: ``LINEAR`` to interpolate between the two readings around each sample, or ``CUBIC`` to use the
+            four readings around it. Cubic output lags by one laser reading, which is needed after each sample.
+        """
+        if mode not in (StreamingAligner.LINEAR, StreamingAligner.CUBIC):
+            raise ValueError('Unknown interpolation mode %r' % mode)
+        self.mode = mode
+        self.laser = SampleBuffer(('t', 'f', 'p'), capacity=2 * StreamingAligner.TAIL)
+        self.meter = SampleBuffer(('t', 'p'))
+
+    def add_laser(self, t, frequency, power):
+        """Adds one laser reading
+
+        :param t: time.perf_counter() of the reading
+        :param frequency: frequency in THz
+        :param power: input (laser output) power in any unit; it is interpolated as given
+        """
+        self.add_laser_block([t], [frequency], [power])
+
+    def add_laser_block(self, times, frequencies, powers):
+        self.laser.append_block(times, frequencies, powers)
+
+    def add_meter_block(self, times, powers):
+        """Adds power meter samples
+
+        :param times: time.perf_counter() of each sample
+        :param powers: measured power of each sample
+        """
+        self.meter.append_block(times, powers)
+
+    def align(self):
+        """Interpolates every power meter sample that the laser readings now cover
+
+        Samples from before the first laser reading are dropped; samples after the last usable reading are kept for
+        the next call.
+
+        :return: (times, frequencies, input powers, meter powers) arrays of the aligned samples
+        """
+        laser_t = self.laser['t']
+        meter_t = self.meter['t']
+        needed = 2 if self.mode == StreamingAligner.LINEAR else 4
+        if len(laser_t) < needed or len(meter_t) == 0:
+            return tuple(np.empty(0) for _ in range(4))
+
+        # Cubic needs one reading after the interval a sample falls in
+        covered_until = laser_t[-1] if self.mode == StreamingAligner.LINEAR else laser_t[-2]
+        ready = np.searchsorted(meter_t, covered_until, side='right')
+        skip = np.searchsorted(meter_t[:ready], laser_t[0], side='left')
+
+        times = np.array(meter_t[skip:ready])
+        meter_powers = np.array(self.meter['p'][skip:ready])
+        if self.mode == StreamingAligner.LINEAR:
+            frequencies = np.interp(times, laser_t, self.laser['f'])
+            input_powers = np.interp(times, laser_t, self.laser['p'])
+        else:
+            frequencies, input_powers = StreamingAligner._cubic(times, laser_t, self.laser['f'], self.laser['p'])
+
+        self._trim(ready)
+        return times, frequencies, input_powers, meter_powers
+
+    @staticmethod
+    def _cubic(times, laser_t, *columns):
+        """Four-point Lagrange interpolation of each column at ``times``"""
+        interval = np.clip(np.searchsorted(laser_t, times, side='right') - 1, 1, len(laser_t) - 3)
+        points = interval[:, np.newaxis] + np.arange(-1, 3)
+        t_points = laser_t[points]
+
+        # weights[:, j] is the Lagrange basis polynomial of point j evaluated at each time
+        weights = np.ones_like(t_points)
+        for j in range(4):
+            for k in range(4):
+                if j != k:
+                    weights[:, j] *= (times - t_points[:, k]) / (t_points[:, j] - t_points[:, k])
+
+        return tuple(np.sum(weights * column[points], axis=1) for column in columns)
+
+    def _trim(self, consumed):
+        """Drops consumed meter samples and all but the last ``TAIL`` laser readings"""
+        meter = self.meter.views()
+        remaining_meter = (meter['t'][consumed:].copy(), meter['p'][consumed:].copy())
+        self.meter.clear()
+        self.meter.append_block(*remaining_meter)
+
+        if len(self.laser) > StreamingAligner.TAIL:
+            laser = self.laser.views()
+            tail = tuple(laser[column][-StreamingAligner.TAIL:].copy() for column in self.laser.columns)
+            self.laser.clear()
+            self.laser.append_block(*tail)
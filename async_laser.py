@@ -0,0 +1,546 @@
+"""
+Asyncio interface to the PPCL550.
+
+``AsyncITLATransport`` exchanges ITLA frames over the serial port's file descriptor with the event loop's reader
+callbacks, so waiting for a response does not hold a thread. ``AsyncLaser`` mirrors the methods of ``Laser`` as
+coroutines. All waits are ``asyncio.sleep`` calls, so a single event loop can drive the laser alongside other
+instruments and the UI, and any operation can be cancelled by cancelling its task.
+
+Example::
+
+    async def main():
+        laser = await AsyncLaser.open('/dev/ttyUSB0', 115200)
+        await laser.laser_on(195)
+        await laser.clean_jump(194.5)
+        async for telemetry in laser.telemetry(interval=0.1):
+            print(telemetry)
+
+Blocking instruments (e.g. the PM100D through VISA) can share the loop with ``loop.run_in_executor``.
+"""
+
+import asyncio
+import collections
+import io
+import logging
+import math
+import os
+import threading
+import time
+
+import serial
+
+from pure_photonics_utils import ITLA
+from laser import Laser
+from calibration import Calibration
+from settle import JumpTiming, SettleDetector
+
+
+class AsyncITLATransport:
+    """Sends ITLA commands and awaits their responses without blocking the event loop.
+
+    If the serial object has a file descriptor, responses are read by an event loop reader callback. Serial
+    objects without one (e.g. ``itla_simulator.SimulatedSerial``) fall back to running each exchange in the default
+    executor.
+    """
+
+    def __init__(self, sercon, timeout=ITLA.RESPONSE_TIMEOUT):
+        self.sercon = sercon
+        self.timeout = timeout
+        self.round_trip_times = collections.deque(maxlen=ITLA.TIMING_HISTORY)
+
+        self._lock = asyncio.Lock()
+        self._io_lock = threading.Lock()  # Guards the port for executor jobs that outlive a cancelled coroutine
+        self._loop = None
+        self._fd = None
+        self._reader = None
+        self._resync = False
+        self._error = ITLA.NOERROR
+
+    @classmethod
+    async def open(cls, port, baud, serial_class=None):
+        """Opens the port and attaches it to the running event loop"""
+        if serial_class is None:
+            serial_class = serial.Serial
+        loop = asyncio.get_running_loop()
+        sercon = await loop.run_in_executor(None, lambda: serial_class(port, baud, timeout=ITLA.RESPONSE_TIMEOUT))
+        transport = cls(sercon)
+        transport.attach()
+        return transport
+
+    def attach(self):
+        """Registers the port's file descriptor with the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        try:
+            self._fd = self.sercon.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            self._fd = None
+        if self._fd is not None:
+            self._reader = asyncio.StreamReader()
+            os.set_blocking(self._fd, False)
+            self._loop.add_reader(self._fd, self._on_readable)
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._loop.remove_reader(self._fd)
+            self._reader.set_exception(e)
+            return
+        if data:
+            self._reader.feed_data(data)
+
+    def last_error(self):
+        """The error code of the most recent response"""
+        return self._error
+
+    def frame_timing(self):
+        """Statistics of the recent command/response round trips, in seconds"""
+        times = list(self.round_trip_times)
+        if not times:
+            return {'count': 0, 'last': None, 'mean': None, 'min': None, 'max': None}
+        return {'count': len(times), 'last': times[-1], 'mean': sum(times) / len(times), 'min': min(times),
+                'max': max(times)}
+
+    def _check(self, frame):
+        """Sets the error code from a response frame's status bits and checksum"""
+        if ITLA.checksum(frame[0], frame[1], frame[2], frame[3]) == frame[0] >> 4:
+            self._error = frame[0] & 0x03
+        else:
+            self._error = ITLA.CSERROR
+
+    def _no_response(self):
+        self._error = ITLA.NRERROR
+        self._resync = True
+        logging.warning('No response')
+        return b'\xff\xff\xff\xff'
+
+    async def _write(self, frames):
+        if self._resync:
+            # Drop anything left over from a timed out or cancelled exchange
+            self.sercon.reset_input_buffer()
+            self._reader = asyncio.StreamReader()
+            self._resync = False
+        view = memoryview(frames)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+            except BlockingIOError:
+                written = 0
+            view = view[written:]
+            if view:
+                await asyncio.sleep(0)
+
+    async def _read_frame(self):
+        """Awaits one response frame. Returns the four bytes."""
+        try:
+            frame = await asyncio.wait_for(self._reader.readexactly(4), self.timeout)
+        except asyncio.TimeoutError:
+            return self._no_response()
+        self._check(frame)
+        return frame
+
+    def _blocking_exchange(self, frames, count):
+        """Writes the frames and reads ``count`` responses on a blocking port. Runs in the executor."""
+        with self._io_lock:
+            if self._resync:
+                self.sercon.reset_input_buffer()
+                self._resync = False
+            start = time.perf_counter()
+            self.sercon.write(frames)
+            responses = []
+            for _ in range(count):
+                frame = self.sercon.read(4)
+                if len(frame) < 4:
+                    frame = self._no_response()
+                else:
+                    self._check(frame)
+                    self.round_trip_times.append(time.perf_counter() - start)
+                responses.append((frame, self._error))
+            return responses
+
+    @staticmethod
+    def _frame(register, data, rw):
+        byte2 = int(data / 256)
+        byte3 = int(data - byte2 * 256)
+        return bytes((ITLA.checksum(rw, register, byte2, byte3) * 16 + rw, register, byte2, byte3))
+
+    async def _exchange(self, frames, count):
+        """Writes the frames and awaits ``count`` responses. Must be called with the lock held."""
+        if self._fd is None:
+            # The executor job always runs to completion, so cancelling here cannot desynchronize the port
+            return await self._loop.run_in_executor(None, self._blocking_exchange, frames, count)
+        try:
+            start = time.perf_counter()
+            await self._write(frames)
+            responses = []
+            for _ in range(count):
+                responses.append((await self._read_frame(), self._error))
+                if self._error != ITLA.NRERROR:
+                    self.round_trip_times.append(time.perf_counter() - start)
+            return responses
+        except asyncio.CancelledError:
+            self._resync = True
+            raise
+
+    async def communicate(self, register, data, rw):
+        """Sends one command and returns the device's response, resolving AEA strings"""
+        async with self._lock:
+            (frame, error), = await self._exchange(AsyncITLATransport._frame(register, data, rw), 1)
+            value = frame[2] * 256 + frame[3]
+            if rw == ITLA.READ and (frame[0] & 0x03) == ITLA.AEERROR and error != ITLA.CSERROR:
+                outp = ''
+                while value > 0:
+                    (frame, _), = await self._exchange(AsyncITLATransport._frame(ITLA.REG_AeaEar, 0, ITLA.READ), 1)
+                    outp = outp + chr(frame[2]) + chr(frame[3])
+                    value = value - 2
+                return outp
+            return value
+
+    async def read_many(self, registers):
+        """Reads several registers with their request frames pipelined on the line
+
+        :return: a list of (response, error code) tuples in the order of ``registers``
+        """
+        registers = list(registers)
+        return await self._pipelined(registers, [0] * len(registers), ITLA.READ)
+
+    async def write_many(self, registers, values):
+        """Writes several registers with their request frames pipelined on the line
+
+        Only use this for registers whose writes do not depend on each other's completion.
+
+        :return: a list of (response, error code) tuples in the order of ``registers``
+        """
+        return await self._pipelined(list(registers), list(values), ITLA.WRITE)
+
+    async def _pipelined(self, registers, values, rw):
+        for register in registers:
+            if register in ITLA.AEA_REGISTERS:
+                raise ValueError('Register 0x%02X returns an AEA string; use communicate' % register)
+        frames = b''.join(AsyncITLATransport._frame(register, value, rw) for register, value in zip(registers, values))
+        async with self._lock:
+            responses = await self._exchange(frames, len(registers))
+            results = []
+            for register, (frame, error) in zip(registers, responses):
+                if error != ITLA.NRERROR and frame[1] != register:
+                    error = ITLA.CSERROR
+                    self._resync = True
+                results.append((frame[2] * 256 + frame[3], error))
+            self._error = next((error for _, error in results if error != ITLA.NOERROR), ITLA.NOERROR)
+            return results
+
+    async def close(self):
+        """Detaches from the event loop and closes the port"""
+        async with self._lock:
+            if self._fd is not None:
+                self._loop.remove_reader(self._fd)
+                self._fd = None
+            self.sercon.close()
+
+
+class AsyncLaser:
+    """Coroutine versions of the ``Laser`` methods, driven by an ``AsyncITLATransport``"""
+    NOP_POLL_INTERVAL = 0.25  # Seconds between NOP reads while waiting for the laser
+
+    def __init__(self, transport, sled_file_name=Laser.SLED_FILE_NAME, map_file_name=Laser.MAP_FILE_NAME):
+        self.transport = transport
+        self.sled_file_name = sled_file_name
+        self.map_file_name = map_file_name
+        # Loaded by set_jump_vals, on the first clean jump unless it is called earlier
+        self.jump_values = None
+        self.calibration = None
+
+    @classmethod
+    async def open(cls, port=None, baud=None, serial_class=None, sled_file_name=Laser.SLED_FILE_NAME,
+                   map_file_name=Laser.MAP_FILE_NAME):
+        """Connects to the laser at a known baud rate. The jump calibration is loaded on the first clean jump."""
+        if not port:
+            port = Laser.DEFAULT_PORT
+        if not baud:
+            baud = Laser.DEFAULT_BAUD
+        return cls(await AsyncITLATransport.open(port, baud, serial_class), sled_file_name, map_file_name)
+
+    async def close(self):
+        await self.transport.close()
+
+    def last_error(self):
+        return self.transport.last_error()
+
+    def frame_timing(self):
+        return self.transport.frame_timing()
+
+    async def read_error(self):
+        """Get information about any errors raised by the laser"""
+        laser_error = self.last_error()
+        if laser_error == ITLA.EXERROR:
+            logging.error('Execution error (1). NOP reads %d' % await self.read(ITLA.REG_Nop))
+        elif laser_error == ITLA.CPERROR:
+            logging.error('Command pending error (1). NOP reads %d' % await self.read(ITLA.REG_Nop))
+
+    async def send(self, register, data, signed_response=False):
+        """Sends a two-byte max integer to the device and returns the response"""
+        response = await self.transport.communicate(register, int(data), ITLA.WRITE)
+        return ITLA.to_signed(response) if signed_response else response
+
+    async def read(self, register, signed_response=False):
+        """Reads the value in the designated register"""
+        response = await self.transport.communicate(register, 0, ITLA.READ)
+        return ITLA.to_signed(response) if signed_response and isinstance(response, int) else response
+
+    async def read_many(self, registers, signed_response=False):
+        """Reads several registers in one pipelined batch and returns their values in order"""
+        registers = list(registers)
+        if isinstance(signed_response, bool):
+            signed_response = [signed_response] * len(registers)
+        results = await self.transport.read_many(registers)
+        return [ITLA.to_signed(response) if signed else response
+                for (response, _), signed in zip(results, signed_response)]
+
+    async def write_many(self, registers, values):
+        """Writes several registers in one pipelined batch and returns the (response, error code) of each"""
+        return await self.transport.write_many(registers, values)
+
+    async def check_nop(self):
+        """Reads the NOP register to get the laser's status"""
+        return await self.read(ITLA.REG_Nop)
+
+    async def check_power(self):
+        """Returns the current optical power"""
+        return max(await self.read(ITLA.REG_Oop, signed_response=True) * 0.01, 0)
+
+    async def offset(self):
+        return await self.read(ITLA.REG_Csweepoffset, signed_response=True) / 10.0
+
+    async def snapshot(self):
+        """Reads power, frequency, offset and status in one pipelined batch"""
+        return Laser.make_telemetry(await self.read_many(Laser.SNAPSHOT_REGISTERS), time.perf_counter())
+
+    async def telemetry(self, interval=0.01):
+        """Yields a ``Telemetry`` snapshot every ``interval`` seconds until the consumer stops iterating"""
+        while True:
+            yield await self.snapshot()
+            await asyncio.sleep(interval)
+
+    async def wait_nop(self):
+        """Wait until the NOP register reads an acceptable value"""
+        status = await self.check_nop()
+        while status > 16 or status == 0:
+            await asyncio.sleep(AsyncLaser.NOP_POLL_INTERVAL)
+            status = await self.check_nop()
+        logging.info('NOP status: %d' % status)
+        await self.read_error()
+
+    async def set_jump_vals(self, sled_file_name=None, map_file_name=None):
+        if not sled_file_name:
+            sled_file_name = self.sled_file_name
+        if not map_file_name:
+            map_file_name = self.map_file_name
+
+        sled_slope = 0.0001 * await self.read(ITLA.REG_SledSlope)
+        loop = asyncio.get_running_loop()
+        map_vals, sled_clusters = await loop.run_in_executor(None, Laser.read_calibration_files, sled_file_name,
+                                                             map_file_name)
+        sled_spacing = sled_clusters.spacing
+
+        self.jump_values = [sled_slope, sled_spacing, map_vals]
+        self.calibration = Calibration.from_map_vals(map_vals, sled_slope, sled_spacing, sled_clusters)
+
+    async def get_calibration(self):
+        """Returns the jump calibration, loading it on first use"""
+        if self.calibration is None:
+            await self.set_jump_vals()
+        return self.calibration
+
+    async def startup_begin(self, freq):
+        """Begins the process of turning on the laser by setting a frequency and powering on"""
+        test_response = await self.read(ITLA.REG_Nop)
+        await self.read_error()
+        if self.last_error() == ITLA.NRERROR:
+            logging.warning('Baud rate error')
+            return ITLA.ERROR_SERBAUD
+
+        freq_thz = math.trunc(freq)
+        freq_ghz = round((freq - freq_thz) * 10000)
+        logging.info('%d THz' % await self.send(ITLA.REG_FreqTHz, freq_thz))
+        logging.info('%d * 0.1 GHz' % await self.send(ITLA.REG_FreqGHz, freq_ghz))
+        logging.debug('Channel: %d' % await self.send(ITLA.REG_Channel, 1))
+        await asyncio.sleep(1)
+        logging.info('Enable: %d' % await self.send(ITLA.REG_ResetEnable, ITLA.SET_ON))
+        logging.debug('NOP before enable: %d' % test_response)
+        return 0
+
+    async def startup_finish(self):
+        """Finishes startup sequence by turning on clean mode"""
+        logging.info('Clean mode on: %d' % await self.send(ITLA.REG_Mode, 1))
+
+    async def laser_on(self, freq):
+        """Turns on the laser to the desired frequency, and returns the error code or 0"""
+        startup_response = await self.startup_begin(freq)
+
+        if startup_response == 0:
+            await self.wait_nop()
+
+            # Wait for the laser to be outputting the correct power (10 dBm in this case) or 5 seconds
+            wait_time = time.perf_counter() + 5
+            optical_power = await self.check_power()
+            while abs(optical_power - 10) > 1 and time.perf_counter() < wait_time:
+                await asyncio.sleep(0.2)
+                optical_power = await self.check_power()
+                logging.info('Optical power: %5.2f' % optical_power)
+            await self.read_error()
+            await asyncio.sleep(1)
+
+            await self.startup_finish()
+        else:
+            logging.warning('Another error occurred: %d' % startup_response)
+
+        return startup_response
+
+    async def laser_off(self):
+        """Turns off the laser"""
+        logging.info('Clean mode off: %d' % await self.send(ITLA.REG_Mode, 0))
+        logging.info('Laser off: %d' % await self.send(ITLA.REG_ResetEnable, ITLA.SET_OFF))
+
+    async def clean_jump_start(self, freq):
+        """Starts clean jump. User must wait for stable frequency."""
+        calibration = await self.get_calibration()
+
+        if not calibration.in_range(freq):
+            logging.error('Frequency %f THz is outside the calibrated range %f-%f THz' %
+                          (freq, calibration.min_frequency, calibration.max_frequency))
+            return
+
+        words = tuple(calibration.jump_registers(freq))
+        await self.write_many((ITLA.REG_Mode,) + Laser.CLEAN_JUMP_REGISTERS, (1,) + words)
+
+        await asyncio.sleep(Laser.CLEAN_JUMP_WRITE_DELAY)
+
+        logging.info('Moving to frequency %f' % freq)
+
+        # Memory, filter 1, filter 2, then execute the jump
+        for _ in range(4):
+            await self.send(ITLA.REG_Cjumpon, 1)
+
+    async def clean_jump_finish(self):
+        """Turns off clean jump mode."""
+        await self.send(ITLA.REG_Cjumpon, 0)
+
+    async def clean_jump(self, freq, detector=None):
+        """Performs a clean jump to the given frequency
+
+        :param detector: ``SettleDetector`` deciding when the jump is over, or None for the default tolerances
+        :return: the laser's claimed frequency in THz after the jump, or None if the frequency is not calibrated
+        """
+        calibration = await self.get_calibration()
+
+        if not calibration.in_range(freq):
+            logging.error('Frequency %f THz is outside the calibrated range %f-%f THz' %
+                          (freq, calibration.min_frequency, calibration.max_frequency))
+            return None
+
+        timing = await self.clean_jump_timed(freq, detector)
+        logging.info('Laser\'s claimed frequency: %f' % timing.claimed_frequency)
+        return timing.claimed_frequency
+
+    async def clean_jump_timed(self, freq, detector=None):
+        """Performs a clean jump to the given frequency and returns a ``JumpTiming`` of its phases
+
+        :raises ValueError: if the frequency is outside the calibrated range
+        """
+        logging.info('Moving to frequency %f' % freq)
+
+        return await self.clean_jump_words_timed((await self.get_calibration()).jump_registers(freq), detector, freq)
+
+    async def clean_jump_words_timed(self, words, detector=None, freq=math.nan):
+        """Performs a clean jump with precomputed register values and returns a ``JumpTiming`` of its phases
+
+        The phases end when the ``SettleDetector`` sees the laser ready, as in ``Laser.clean_jump_words_timed``.
+
+        :param words: (REG_CjumpTHz, REG_CjumpGHz, REG_CjumpSled, REG_CjumpCurrent) values
+        :param detector: ``SettleDetector`` deciding when each phase is over, or None for the default tolerances
+        :param freq: the target frequency in THz, only used in the returned timing
+        """
+        if detector is None:
+            detector = SettleDetector()
+
+        # Don't start while another operation is pending; the power now is the reference for the recovery
+        _, _, sample = await detector.wait_ready_async(self)
+        power_reference = sample.power
+
+        start = time.perf_counter()
+        try:
+            # Turn on clean mode and set the next frequency, sled temp and current
+            await self.write_many((ITLA.REG_Mode,) + Laser.CLEAN_JUMP_REGISTERS, (1,) + tuple(words))
+            _, command_ready, _ = await detector.wait_ready_async(self)
+            command_time = time.perf_counter() - start
+
+            # Memory, filter 1 and filter 2 calculations
+            filter_start = time.perf_counter()
+            for stage in ('memory', 'filter 1', 'filter 2'):
+                logging.debug('Jump: %s (%d)' % (stage, await self.send(ITLA.REG_Cjumpon, 1)))
+            _, filter_ready, _ = await detector.wait_ready_async(self)
+            filter_time = time.perf_counter() - filter_start
+
+            # Execute the jump
+            logging.debug('Jump! (%d)' % await self.send(ITLA.REG_Cjumpon, 1))
+            tuning_time, tuned, sample = await detector.wait_tuned_async(self)
+            logging.info('Frequency error: %5.1f GHz' % sample.offset)
+
+            recovery_time, recovered, _ = await detector.wait_power_async(self, power_reference)
+
+            claim_thz, claim_ghz = await self.read_many([ITLA.REG_GetFreqTHz, ITLA.REG_GETFreqGHz], [False, True])
+            claim_freq = claim_thz + claim_ghz / 10000.0
+        finally:
+            # Leave clean jump mode even if the jump was cancelled
+            await asyncio.shield(self.clean_jump_finish())
+
+        settled = command_ready and filter_ready and tuned and recovered
+        timing = JumpTiming(frequency=freq, command=command_time, filter_calc=filter_time, tuning=tuning_time,
+                            power_recovery=recovery_time, total=time.perf_counter() - start, settled=settled,
+                            claimed_frequency=claim_freq)
+        logging.info('Jump timing: %s' % (timing,))
+        return timing
+
+    async def clean_sweep_prep(self, sweep_ghz, sweep_speed):
+        """Sets up clean sweep for the laser at the given range (GHz) and speed (MHz/s)"""
+        logging.debug('Sweep amp: %d GHz' % await self.send(ITLA.REG_Csweepamp, sweep_ghz))
+        logging.debug('Sweep speed: %d MHz/s' % await self.send(ITLA.REG_Csweepspeed, sweep_speed))
+
+    async def clean_sweep_start(self):
+        """Begins clean sweep with previously set parameters"""
+        await self.send(ITLA.REG_Mode, 1)
+        await asyncio.sleep(0.5)
+        logging.info('Clean sweep on: %d' % await self.send(ITLA.REG_Csweepon, 1))
+
+    async def clean_sweep_pause(self, offset=None):
+        """Pauses the clean sweep at the given offset in GHz, or just ahead of the current offset if None"""
+        if offset is None:
+            offset_1 = await self.offset()
+            offset_2 = await self.offset()
+            while offset_2 == offset_1:
+                await asyncio.sleep(0)
+                offset_2 = await self.offset()
+            moving_positive = offset_2 > offset_1
+
+            offset_stop = max(-24, min(24, offset_2 + 2 * (offset_2 - offset_1)))
+            offset = math.ceil(offset_stop) if moving_positive else math.floor(offset_stop)
+        else:
+            offset = round(offset)
+
+        if offset < 0:
+            offset = 2 ** 16 + offset
+
+        stop = await self.send(ITLA.REG_Csweepstop, offset, signed_response=True)
+        logging.info('Stopping at %d GHz' % stop)
+        return stop
+
+    async def clean_sweep_to_offset(self, offset):
+        await self.clean_sweep_start()
+        await self.clean_sweep_pause(offset)
+
+    async def clean_sweep_stop(self):
+        """Stops execution of clean sweep and exits low-noise mode"""
+        logging.info('Clean sweep stop: %d' % await self.send(ITLA.REG_Csweepon, 0))
+        await self.wait_nop()
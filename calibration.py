@@ -0,0 +1,279 @@
+"""
+Vectorized clean jump calibration lookups.
+
+``Calibration`` holds the frequency, sled temperature and current columns of a ``.map`` file as NumPy arrays,
+together with the sled slope and spacing, and computes the clean jump register values for one frequency or for a
+whole frequency plan in a single call.
+
+Parsing the text calibration files is slow compared to everything else done when a laser is opened, so the parsed
+values are cached as ``.npz`` files in ``Calibration.CACHE_DIR``. A cache entry is keyed by the paths of the ``.sled``
+and ``.map`` files and is discarded when the size or modification time of either file changes.
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+
+from typing import NamedTuple
+
+import numpy as np
+
+
+class SledClusters(NamedTuple):
+    """Sled temperatures from a ``.sled`` file grouped into modes, and the spacing between modes"""
+    means: np.ndarray  # Mean temperature of each cluster in C, ascending
+    stds: np.ndarray  # Standard deviation of the temperatures in each cluster in C
+    counts: np.ndarray  # Number of lines in each cluster
+    inliers: np.ndarray  # False for clusters that do not sit on the mode grid and were left out of the spacing
+    spacing: float  # Spacing between equivalent sled modes in C
+    spacing_error: float  # Standard error of the spacing in C, or NaN when there are only two clusters
+
+
+class Calibration:
+    """Calibration data for clean jumps, looked up with ``np.searchsorted``"""
+    SLED_CENTER_TEMP = 30  # Want sled temperatures to be close to 30 C
+    SLED_CLUSTER_GAP = 1  # Sorted temps more than this many C apart start a new cluster
+    SLED_MIN_CLUSTER_FRACTION = 0.1  # Smaller clusters, relative to the median cluster, don't set the initial spacing
+    SLED_OUTLIER_TOLERANCE = 0.25  # Clusters further than this fraction of a spacing from the mode grid are outliers
+    CACHE_DIR = os.path.join(os.path.expanduser('~'), '.itla_calibration')  # None disables the cache
+
+    def __init__(self, freq, sled, current, sled_slope, sled_spacing, sled_clusters=None):
+        """
+        :param freq: map file frequencies in THz
+        :param sled: map file sled temperatures in C, one per frequency
+        :param current: map file currents in mA, one per frequency
+        :param sled_slope: sled temperature slope in C per GHz
+        :param sled_spacing: temperature spacing between equivalent sled modes in C
+        :param sled_clusters: optional ``SledClusters`` the spacing was calculated from
+        """
+        freq = np.asarray(freq, dtype=float)
+        order = np.argsort(freq, kind='stable')
+
+        self.freq = freq[order]
+        self.sled = np.asarray(sled, dtype=float)[order]
+        self.current_mA = np.asarray(current, dtype=float)[order]
+        self.sled_slope = sled_slope
+        self.sled_spacing = sled_spacing
+        self.sled_clusters = sled_clusters
+
+        if self.freq.size < 2:
+            raise ValueError('Calibration needs at least two map file points')
+
+    @classmethod
+    def from_map_vals(cls, map_vals, sled_slope, sled_spacing, sled_clusters=None):
+        """Builds a calibration from the lists returned by ``Laser.read_mapfile``"""
+        return cls(map_vals[0], map_vals[1], map_vals[6], sled_slope, sled_spacing, sled_clusters)
+
+    @property
+    def min_frequency(self):
+        return self.freq[0]
+
+    @property
+    def max_frequency(self):
+        return self.freq[-1]
+
+    def in_range(self, freq):
+        """True (per element) where the frequency is covered by the map file"""
+        freq = np.asarray(freq, dtype=float)
+        return (freq >= self.freq[0]) & (freq <= self.freq[-1])
+
+    def _bracket(self, freq):
+        """Returns the frequencies as an array and the indices of the map points just below and above each one"""
+        freq = np.asarray(freq, dtype=float)
+        if not np.all(self.in_range(freq)):
+            bad = freq[~self.in_range(freq)]
+            raise ValueError('Frequency %s THz is outside the calibrated range %s-%s THz'
+                             % (bad.flat[0], self.freq[0], self.freq[-1]))
+
+        i_upper = np.clip(np.searchsorted(self.freq, freq, side='left'), 1, self.freq.size - 1)
+        return freq, i_upper - 1, i_upper
+
+    @staticmethod
+    def _result(values, like):
+        """Returns a Python scalar for scalar input, otherwise the array"""
+        if np.ndim(like) == 0:
+            return values.item()
+        return values
+
+    def sled_temperature(self, freq):
+        """Calculates the sled temperature in C for a jump to each frequency"""
+        freq_arr, i_lower, i_upper = self._bracket(freq)
+
+        # Pick the closer of the two frequency gridpoints, the lower one on a tie
+        upper_closer = np.abs(freq_arr - self.freq[i_upper]) < np.abs(freq_arr - self.freq[i_lower])
+        gridpoint = np.where(upper_closer, i_upper, i_lower)
+
+        # Using the sled's temperature-frequency slope, calculate the temp difference from the closest gridpoint
+        freq_diff = (freq_arr - self.freq[gridpoint]) * 1000
+        sled_base_temp = self.sled[gridpoint] + self.sled_slope * freq_diff
+
+        # Shift by whole sled spacings to get as close to the center temperature as possible
+        sled_mode_adjust = np.round((Calibration.SLED_CENTER_TEMP - sled_base_temp) / self.sled_spacing)
+
+        return Calibration._result(sled_base_temp + sled_mode_adjust * self.sled_spacing, freq)
+
+    def current(self, freq):
+        """Linearly interpolates the current in mA for each frequency"""
+        freq_arr, i_lower, i_upper = self._bracket(freq)
+
+        freq_lower = self.freq[i_lower]
+        upper_frac = (freq_arr - freq_lower) / (self.freq[i_upper] - freq_lower)
+        current = (1 - upper_frac) * self.current_mA[i_lower] + upper_frac * self.current_mA[i_upper]
+
+        return Calibration._result(current, freq)
+
+    def jump_registers(self, freq):
+        """Calculates the clean jump register values for each frequency
+
+        :return: (REG_CjumpTHz, REG_CjumpGHz, REG_CjumpSled, REG_CjumpCurrent) values. Each is an int for scalar
+            input, or an int64 array with the shape of ``freq``.
+        """
+        freq_arr = np.asarray(freq, dtype=float)
+
+        # Split the frequency into THz and 0.1 GHz parts
+        freq_thz = np.trunc(freq_arr)
+        freq_ghz = np.round((freq_arr - freq_thz) * 10000)
+
+        # Sled temperature in units of 0.01 C and current in units of 0.1 mA
+        sled_temp_reg = np.round(np.asarray(self.sled_temperature(freq_arr)) * 100)
+        current_reg = np.round(np.asarray(self.current(freq_arr)) * 10)
+
+        registers = tuple(values.astype(np.int64) for values in (freq_thz, freq_ghz, sled_temp_reg, current_reg))
+        if np.ndim(freq) == 0:
+            return tuple(int(values) for values in registers)
+        return registers
+
+    @staticmethod
+    def read_sled_temperatures(sledfile_name):
+        """Returns the sled temperatures in C from a .sled calibration file"""
+        with open(sledfile_name) as logfile:
+            return np.array([line.split(' ')[5] for line in logfile if line.strip()], dtype=float) * 0.01
+
+    @staticmethod
+    def cluster_sled_temperatures(temps, gap=None, outlier_tolerance=None):
+        """Groups sled temperatures into modes and fits the spacing between the modes
+
+        The temperatures are sorted and split wherever two neighbours are more than ``gap`` apart. Each cluster is
+        then numbered by its distance from the largest cluster in units of the median gap between well populated
+        clusters, and the spacing is the least squares slope of the cluster means against those numbers. Clusters
+        that are not within ``outlier_tolerance`` spacings of a whole number, like a lone noisy line between two modes,
+        are left out of the fit, and missing modes do not shrink the spacing.
+
+        :param temps: sled temperatures in C
+        :param gap: clustering threshold in C, ``SLED_CLUSTER_GAP`` by default
+        :param outlier_tolerance: ``SLED_OUTLIER_TOLERANCE`` by default
+        """
+        if gap is None:
+            gap = Calibration.SLED_CLUSTER_GAP
+        if outlier_tolerance is None:
+            outlier_tolerance = Calibration.SLED_OUTLIER_TOLERANCE
+
+        temps = np.sort(np.asarray(temps, dtype=float))
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(temps) > gap) + 1))
+        if starts.size < 2:
+            raise ValueError('Need at least two sled temperature clusters to find their spacing')
+
+        counts = np.diff(np.append(starts, temps.size))
+        means = np.add.reduceat(temps, starts) / counts
+        stds = np.sqrt(np.add.reduceat((temps - np.repeat(means, counts)) ** 2, starts) / counts)
+
+        # Number the clusters on the mode grid and refit until the set of inliers stops changing
+        reference = means[np.argmax(counts)]
+        populated = counts >= Calibration.SLED_MIN_CLUSTER_FRACTION * np.median(counts)
+        spacing = np.median(np.diff(means[populated])) if np.count_nonzero(populated) > 1 else np.median(np.diff(means))
+        spacing_error = np.nan
+        inliers = np.ones(means.size, dtype=bool)
+        for iteration in range(means.size):
+            steps = (means - reference) / spacing
+            mode_numbers = np.round(steps)
+            new_inliers = np.abs(steps - mode_numbers) <= outlier_tolerance
+            if np.unique(mode_numbers[new_inliers]).size < 2:
+                break
+
+            converged = iteration > 0 and np.array_equal(new_inliers, inliers)
+            inliers = new_inliers
+            spacing, spacing_error = Calibration._fit_spacing(mode_numbers[inliers], means[inliers])
+            if converged:
+                break
+
+        if not np.all(inliers):
+            logging.info('Sled clusters at %s C are off the mode grid' % means[~inliers])
+
+        return SledClusters(means=means, stds=stds, counts=counts, inliers=inliers, spacing=float(spacing),
+                            spacing_error=float(spacing_error))
+
+    @staticmethod
+    def _fit_spacing(mode_numbers, means):
+        """Least squares slope of cluster mean against mode number, and its standard error"""
+        mode_offsets = mode_numbers - mode_numbers.mean()
+        spread = np.sum(mode_offsets ** 2)
+        spacing = np.sum(mode_offsets * (means - means.mean())) / spread
+
+        if means.size < 3:
+            return spacing, np.nan
+        residuals = means - means.mean() - spacing * mode_offsets
+        return spacing, np.sqrt(np.sum(residuals ** 2) / (means.size - 2) / spread)
+
+    @staticmethod
+    def read_sled_clusters(sledfile_name, gap=None):
+        """Reads a .sled calibration file and clusters its temperatures with ``cluster_sled_temperatures``"""
+        return Calibration.cluster_sled_temperatures(Calibration.read_sled_temperatures(sledfile_name), gap)
+
+    @staticmethod
+    def file_signature(*file_names):
+        """Returns the size and modification time of each file, used to detect changed calibration files"""
+        signature = []
+        for file_name in file_names:
+            stat = os.stat(file_name)
+            signature.extend((stat.st_size, stat.st_mtime_ns))
+        return np.array(signature, dtype=np.int64)
+
+    @staticmethod
+    def cache_path(sled_file_name, map_file_name):
+        """Returns the cache file used for this pair of calibration files, or None if caching is disabled"""
+        if not Calibration.CACHE_DIR:
+            return None
+        key = '\0'.join(os.path.abspath(name) for name in (sled_file_name, map_file_name))
+        return os.path.join(Calibration.CACHE_DIR, hashlib.sha1(key.encode()).hexdigest()[:16] + '.npz')
+
+    @staticmethod
+    def load_cache(sled_file_name, map_file_name):
+        """Returns the cached (map_vals, sled_clusters) for these files, or None if there is no valid cache entry
+
+        ``map_vals`` is a 2D array with the same rows as the list returned by ``Laser.read_mapfile``.
+        """
+        path = Calibration.cache_path(sled_file_name, map_file_name)
+        if path is None or not os.path.exists(path):
+            return None
+
+        try:
+            with np.load(path) as cache:
+                if not np.array_equal(cache['signature'], Calibration.file_signature(sled_file_name, map_file_name)):
+                    logging.info('Calibration files changed since they were cached')
+                    return None
+                sled_clusters = SledClusters(*(cache['sled_' + field] for field in SledClusters._fields))
+                return cache['map_vals'], sled_clusters._replace(spacing=float(sled_clusters.spacing),
+                                                                 spacing_error=float(sled_clusters.spacing_error))
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning('Ignoring unreadable calibration cache %s: %s' % (path, e))
+            return None
+
+    @staticmethod
+    def save_cache(sled_file_name, map_file_name, map_vals, sled_clusters):
+        """Saves parsed calibration values for ``load_cache``"""
+        path = Calibration.cache_path(sled_file_name, map_file_name)
+        if path is None:
+            return
+
+        try:
+            os.makedirs(Calibration.CACHE_DIR, exist_ok=True)
+            # Write to a temporary file first so a reader never sees a partially written cache
+            fd, temp_path = tempfile.mkstemp(suffix='.npz', dir=Calibration.CACHE_DIR)
+            with os.fdopen(fd, 'wb') as cache_file:
+                np.savez(cache_file, map_vals=np.asarray(map_vals, dtype=float),
+                         signature=Calibration.file_signature(sled_file_name, map_file_name),
+                         **{'sled_' + field: value for field, value in sled_clusters._asdict().items()})
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning('Could not save calibration cache %s: %s' % (path, e))
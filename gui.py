@@ -1,35 +1,51 @@
 import datetime
+import logging
 import tkinter as tk
 from queue import Queue
 from tkinter import ttk
 from threading import Thread, Lock, Event
 from laser import Laser
+from settle import SettleDetector
+from mode_finder import ModeFinderScan, SegmentPipeline
+from scan_planner import ScanPlanner
+from mode_detector import ModeDetector
+from scan_recorder import ScanRecorder, export_csv
+from stitching import SpectrumStitcher
+from sample_buffer import SampleBuffer
+from alignment import StreamingAligner
+from plot_decimation import MinMaxDecimator, decimate
+from power_history import PowerHistory
+import os
 import time
 from enum import Enum, auto
 import math
 import visa
 from ThorlabsPM100 import ThorlabsPM100
 from matplotlib import pyplot as plt
-import matplotlib.animation as animation
 from matplotlib import style
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
-import scipy.interpolate
 
 
 class Observable:
     def __init__(self, initial_value=None):
         self.data = initial_value
         self.callbacks = {}
+        # Callbacks are added and removed from other threads while the observable is set
+        self.callbacks_lock = Lock()
 
     def addCallback(self, func):
-        self.callbacks[func] = 1
+        with self.callbacks_lock:
+            self.callbacks[func] = 1
 
     def delCallback(self, func):
-        del self.callbacks[func]
+        with self.callbacks_lock:
+            del self.callbacks[func]
 
     def _docallbacks(self):
-        for func in self.callbacks:
+        with self.callbacks_lock:
+            callbacks = list(self.callbacks)
+        for func in callbacks:
             func(self.data)
 
     def set(self, data):
@@ -43,7 +59,70 @@ class Observable:
         self.data = None
 
 
+class Dispatcher:
+    """Runs Observable callbacks on the Tk thread, coalescing rapid updates
+
+    Callbacks bound through ``bind`` are queued when the observable is set, from any thread, and run by a single
+    ``after()`` loop on the Tk thread at ``frame_rate``. A coalesced callback runs once per frame with the latest value;
+    the others run once for every value, in order, unless more than ``MAX_PENDING`` are waiting.
+    """
+    FRAME_RATE = 30  # Drains per second
+    MAX_PENDING = 10000  # Queued updates beyond this are dropped
+
+    def __init__(self, root, frame_rate=FRAME_RATE):
+        self.root = root
+        self.interval = max(int(1000 / frame_rate), 1)
+        self.lock = Lock()
+        self.pending = []  # [callback, value] in the order they were first queued
+        self.coalescing = {}  # callback -> its entry in pending, for coalesced callbacks
+        self.posted = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.delivered = 0
+        self.root.after(self.interval, self.drain)
+
+    def bind(self, observable, callback, coalesce=True):
+        """Runs callback on the Tk thread whenever observable is set
+
+        :param coalesce: only run it with the latest value if it is set several times in one frame
+        """
+        observable.addCallback(lambda data: self.post(callback, data, coalesce))
+
+    def post(self, callback, data, coalesce=True):
+        with self.lock:
+            self.posted += 1
+            if coalesce and callback in self.coalescing:
+                self.coalescing[callback][1] = data
+                self.coalesced += 1
+            elif len(self.pending) >= Dispatcher.MAX_PENDING:
+                self.dropped += 1
+            else:
+                entry = [callback, data]
+                self.pending.append(entry)
+                if coalesce:
+                    self.coalescing[callback] = entry
+
+    def drain(self):
+        self.root.after(self.interval, self.drain)
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+            self.coalescing = {}
+        for callback, data in pending:
+            callback(data)
+        self.delivered += len(pending)
+
+    def stats(self):
+        """Returns a dict of the number of updates posted, coalesced into a later one, dropped and delivered"""
+        with self.lock:
+            return {'posted': self.posted, 'coalesced': self.coalesced, 'dropped': self.dropped,
+                    'delivered': self.delivered}
+
+
 class Controller:
+    PLOT_INTERVAL = 200  # Milliseconds between plot updates
+    POWER_PLOT_WINDOW = 30  # Seconds of power history shown
+
     def __init__(self):
         self.model = Model()
         self.root = tk.Tk()
@@ -60,9 +139,21 @@ class Controller:
         self.stop_clean_scan = Event()
         self.take_scan_data = Event()
         self.scan_data = {'x': np.array([]), 'y': np.array([])}
-        self.power_data = {'t': [], 'p': []}
+        self.scan_aligner = StreamingAligner(StreamingAligner.CUBIC)
+        self.scan_aligned = SampleBuffer(('f', 't'))
+        self.scan_aligned_counts = (0, 0)  # Laser and power meter samples already given to scan_aligner
+        self.power_history = PowerHistory()
         self.sweep_data = {'x': np.array([]), 'y': np.array([])}
         self.sweep_to = 0
+        self.scan_throughput = 0
+        self.scan_modes = 0
+
+        # Decimated copies of the plotted data, updated as samples arrive (from the model threads) and drawn by animate
+        self.plot_lock = Lock()
+        self.scan_plot = MinMaxDecimator(GraphContext.PLOT_BINS)
+        self.scan_plot_source = None  # Sample buffer of the scan in scan_plot
+        self.scan_plotted = 0  # Samples of scan_plot_source already in scan_plot
+        self.power_plot = MinMaxDecimator(GraphContext.PLOT_BINS, window=Controller.POWER_PLOT_WINDOW)
 
         self.view.navigation.button_close.add_callback(self.close)
         self.view.main_and_commands.commands.button_on.add_callback(self.laser_on)
@@ -87,18 +178,26 @@ class Controller:
         self.view.navigation.button_mode_finder.add_callback(self.go_to_scan_monitor)
         self.view.navigation.button_sweep.add_callback(self.sweep_monitor)
 
-        self.model.frequency.addCallback(self.frequency_changed)
-        self.model.offset.addCallback(self.offset_changed)
-        self.model.clean_jump_active.addCallback(self.clean_jump_active)
-        self.model.power.addCallback(self.power_changed)
-        self.model.on.addCallback(self.state)
-        self.model.connected.addCallback(self.connected)
-        self.model.clean_sweep_state.addCallback(self.clean_sweep_state)
-        self.model.clean_scan_progress.addCallback(self.clean_scan_progress)
-        self.model.clean_scan_active.addCallback(self.clean_scan_state)
-        self.model.scan_data.addCallback(self.set_scan_data)
-        self.model.scan_data_old.addCallback(self.set_scan_data_old)
-        self.model.scan_time_remaining.addCallback(self.scan_time_remaining)
+        # The model sets its observables from worker threads; the widgets are updated on the Tk thread. Values are
+        # coalesced, except state changes, which must all be seen. The power history is recorded at the full rate.
+        self.dispatcher = Dispatcher(self.root)
+        self.dispatcher.bind(self.model.frequency, self.frequency_changed)
+        self.dispatcher.bind(self.model.offset, self.offset_changed)
+        self.dispatcher.bind(self.model.clean_jump_active, self.clean_jump_active, coalesce=False)
+        self.model.power.addCallback(self.record_power)
+        self.dispatcher.bind(self.model.power, self.power_changed)
+        self.dispatcher.bind(self.model.on, self.state, coalesce=False)
+        self.dispatcher.bind(self.model.connected, self.connected, coalesce=False)
+        self.dispatcher.bind(self.model.clean_sweep_state, self.clean_sweep_state)
+        self.dispatcher.bind(self.model.clean_scan_progress, self.clean_scan_progress)
+        self.dispatcher.bind(self.model.clean_scan_active, self.clean_scan_state, coalesce=False)
+        # Both only read the samples added since their previous call, so running them with the latest data is enough
+        self.dispatcher.bind(self.model.scan_data, self.set_scan_data)
+        self.dispatcher.bind(self.model.scan_data_old, self.set_scan_data_old)
+        self.dispatcher.bind(self.model.scan_throughput, self.set_scan_throughput)
+        self.dispatcher.bind(self.model.scan_modes, self.set_scan_modes)
+        self.dispatcher.bind(self.model.scan_time_remaining, self.scan_time_remaining)
+        # Only sets an Event, so it runs immediately
         self.model.scan_update_active.addCallback(lambda x: self.stop_standard_update.set() if x
                                                   else self.stop_standard_update.clear())
 
@@ -112,43 +211,60 @@ class Controller:
 
         self.view.bind_all("<1>", lambda event: event.widget.focus_set())
 
-        self.scan_plot_animation = animation.FuncAnimation(self.view.main_and_commands.main.mode_finder.fig,
-                                                           self.animate_power_plot, interval=200)
-        self.power_plot_animation = animation.FuncAnimation(self.view.main_and_commands.main.power.fig,
-                                                            self.animate_scan_plot, interval=200)
-        self.sweep_plot_animation = animation.FuncAnimation(self.view.main_and_commands.main.sweep.fig,
-                                                            self.animate_sweep_plot, interval=200)
+        self.root.after(Controller.PLOT_INTERVAL, self.animate)
         self.go_to_power_monitor()
 
         self.root.mainloop()
 
-    def animate_scan_plot(self, i):
+    def animate(self):
+        # Driven by the Tk event loop rather than FuncAnimation, which redraws the whole figure on every frame
+        self.animate_scan_plot()
+        self.animate_power_plot()
+        self.animate_sweep_plot()
+        self.root.after(Controller.PLOT_INTERVAL, self.animate)
+
+    def animate_scan_plot(self):
         if self.progress == Controller.ProgressType.CLEAN_SCAN:
-            if self.scan_data['x'].size > 1:
-                x = self.scan_data['x']
-                y = self.scan_data['y']
-                if x.size == y.size:
-                    self.view.main_and_commands.main.mode_finder.plot(x, y)
-
-    def animate_power_plot(self, i):
-        if len(self.power_data['t']) > 1 and self.progress != Controller.ProgressType.CLEAN_SWEEP_MONITOR:
-            self.view.main_and_commands.main.power.plot(np.array(self.power_data['t']), np.array(self.power_data['p']),
-                                                        max_x_width=30)
-
-    def animate_sweep_plot(self, i):
+            with self.plot_lock:
+                x, y = self.scan_plot.points()
+            self.view.main_and_commands.main.mode_finder.plot(x, y)
+
+    def animate_power_plot(self):
+        if self.progress != Controller.ProgressType.CLEAN_SWEEP_MONITOR:
+            with self.plot_lock:
+                x, y = self.power_plot.points()
+            self.view.main_and_commands.main.power.plot(x, y, max_x_width=Controller.POWER_PLOT_WINDOW)
+
+    def animate_sweep_plot(self):
         if self.sweep_data['x'].size > 1 and self.progress == Controller.ProgressType.CLEAN_SWEEP_MONITOR:
             x = self.sweep_data['x']
             y = self.sweep_data['y']
             if x.size == y.size:
-                self.view.main_and_commands.main.sweep.plot(x, y)
+                self.view.main_and_commands.main.sweep.plot(*decimate(x, y, GraphContext.PLOT_BINS))
+
+    def add_scan_plot_samples(self, source, x, y):
+        """Adds new samples to the scan plot, starting it over when they come from a different scan
+
+        :param source: the sample buffer of the scan the samples belong to
+        """
+        with self.plot_lock:
+            if source is not self.scan_plot_source:
+                self.scan_plot.clear()
+                self.scan_plot_source = source
+                self.scan_plotted = 0
+            self.scan_plot.add(x, y)
+            self.scan_plotted += len(x)
 
     def power_changed(self, power):
         self.view.main_and_commands.status.set_power(round(power, 2))
         if self.progress == Controller.ProgressType.POWER:
             self.progress_bar(power / 10)
 
-        self.power_data['t'].append(time.perf_counter())
-        self.power_data['p'].append(power)
+    def record_power(self, power):
+        t = time.perf_counter()
+        self.power_history.append(t, power)
+        with self.plot_lock:
+            self.power_plot.add([t], [power])
 
     def frequency_changed(self, frequency):
         self.view.main_and_commands.status.set_frequency(frequency)
@@ -166,6 +282,7 @@ class Controller:
         self.model.disconnect()
 
     def close(self):
+        logging.info('GUI updates: %s', self.dispatcher.stats())
         self.stop_standard_update.set()
         self.disconnect_laser()
         quit()
@@ -339,7 +456,8 @@ class Controller:
             self.stop_clean_scan.clear()
             clean_scan_thread = Thread(target=self.model.clean_scan,
                                        args=(start, stop, self.clean_scan_speed,
-                                             self.stop_clean_scan, self.take_scan_data))
+                                             self.stop_clean_scan, self.take_scan_data,
+                                             self.view.main_and_commands.commands.refine.get()))
             scan_update_thread = Thread(target=self.model.scan_update,
                                         args=(self.stop_clean_scan, self.take_scan_data))
             clean_scan_thread.start()
@@ -373,35 +491,59 @@ class Controller:
                                          args=(self.gui_lock, self.stop_standard_update))
             laser_update_thread.start()
 
-            current_date_time = datetime.datetime.now()
-
-            dt = current_date_time.strftime("%Y-%m-%d_%H-%M-%S")
-
-            with open("scan_transmission_{}.csv".format(dt), "w") as fp:
-                for freq, transmission in zip(self.scan_data['x'], self.scan_data['y']):
-                    fp.write(str(freq) + ',' + str(transmission) + '\n')
+            # The samples were streamed to disk during the scan; also write the usual CSV of the stitched spectrum
+            recorder = self.model.scan_recorder
+            if recorder is not None:
+                csv_name = "scan_transmission_{}.csv".format(os.path.basename(recorder.directory))
+                export_csv(self.model.stitched_recorder.directory, csv_name)
 
     def clean_scan_progress(self, progress):
         if self.progress == Controller.ProgressType.CLEAN_SCAN:
             self.progress_bar(progress)
 
     def set_scan_data(self, data):
-        # print(data)
-        if len(data['f']) > 5 and len(data['p_out']) > 5:
-            f = scipy.interpolate.interp1d(data['t_laser'], data['f'], kind='cubic', fill_value="extrapolate")(
-                np.array(data['t_pm']))
-            p_in = scipy.interpolate.interp1d(data['t_laser'], data['p_in'], kind='cubic', fill_value="extrapolate")(
-                np.array(data['t_pm']))
-            p_out = np.array(data['p_out'])
-            p_rel = p_out / p_in
-
-            self.scan_data['x'] = f
-            self.scan_data['y'] = p_rel
+        # The model keeps appending to the lists from its threads, so the new samples are copied under its lock
+        with self.model.data_lock:
+            laser_total, pm_total = len(data['t_laser']), len(data['t_pm'])
+            laser_count, pm_count = self.scan_aligned_counts
+            new_scan = laser_total < laser_count or pm_total < pm_count
+            if new_scan:
+                laser_count, pm_count = 0, 0
+            laser = [data[key][laser_count:laser_total] for key in ('t_laser', 'f', 'p_in')]
+            meter = [data[key][pm_count:pm_total] for key in ('t_pm', 'p_out')]
+
+        if new_scan:
+            self.scan_aligner = StreamingAligner(StreamingAligner.CUBIC)
+            self.scan_aligned = SampleBuffer(('f', 't'))
+
+        # Only the samples added since the last update are interpolated
+        self.scan_aligner.add_laser_block(*laser)
+        self.scan_aligner.add_meter_block(*meter)
+        self.scan_aligned_counts = (laser_total, pm_total)
+
+        _, f, p_in, p_out = self.scan_aligner.align()
+        self.scan_aligned.append_block(f, p_out / p_in)
+        if f.size:
+            self.add_scan_plot_samples(self.scan_aligned, f, p_out / p_in)
+
+        if len(self.scan_aligned) > 5:
+            self.scan_data['x'] = self.scan_aligned['f']
+            self.scan_data['y'] = self.scan_aligned['t']
 
     def set_scan_data_old(self, data):
-        if len(data['f']) > 5:
-            self.scan_data['x'] = np.array(data['f'])
-            self.scan_data['y'] = np.array(data['t'])
+        # The model keeps appending to the buffer from its threads. Views taken together under its lock have the same
+        # length, and later appends only write past their end.
+        with self.model.data_lock:
+            frequencies, transmissions = data['f'], data['t']
+
+        plotted = self.scan_plotted if data is self.scan_plot_source else 0
+        if frequencies.size > plotted:
+            self.add_scan_plot_samples(data, frequencies[plotted:], transmissions[plotted:])
+
+        if frequencies.size > 5:
+            # Views of the buffer, not copies; they are replaced on every update
+            self.scan_data['x'] = frequencies
+            self.scan_data['y'] = transmissions
 
             if self.progress == Controller.ProgressType.CLEAN_SWEEP_MONITOR:
                 min_freq = self.clean_jump_frequency - self.clean_sweep_frequency / 2000
@@ -418,9 +560,17 @@ class Controller:
                 self.sweep_data['x'] = self.scan_data['x'][-keep_data:]
                 self.sweep_data['y'] = self.scan_data['y'][-keep_data:]
 
+    def set_scan_throughput(self, thz_per_hour):
+        self.scan_throughput = thz_per_hour
+
+    def set_scan_modes(self, count):
+        self.scan_modes = count
+
     def scan_time_remaining(self, time_remaining):
         if self.progress == Controller.ProgressType.CLEAN_SCAN and isinstance(time_remaining, int):
-            self.view.change_status("Performing frequency scan ({} minutes remaining)...".format(time_remaining))
+            self.view.change_status("Performing frequency scan at {:.2f} THz/h, {} modes found "
+                                    "({} minutes remaining)...".format(self.scan_throughput, self.scan_modes,
+                                                                       time_remaining))
 
     def sweep_monitor(self):
         self.sweep_data = {'x': np.array([]), 'y': np.array([])}
@@ -454,6 +604,11 @@ class Controller:
 
 
 class Model:
+    SCAN_DIRECTORY = 'scans'  # Scan recordings are streamed to a new directory in here
+    STITCHED_DIRECTORY = 'stitched'  # Subdirectory of a scan recording with the stitched spectrum of its first pass
+    SCAN_WINDOW = 20  # GHz from the center recorded by a sweep outside of planned scans
+    SCAN_STOP_AFTER_MODES = None  # Stop scans once this many modes have been found, or None to scan the whole range
+
     def __init__(self):
         self.frequency = Observable()
         self.power = Observable(0)
@@ -465,9 +620,16 @@ class Model:
         self.clean_scan_progress = Observable()
         self.clean_sweep_state = Observable()
         self.scan_data = Observable({'t_laser': [], 'f': [], 'p_in': [], 't_pm': [], 'p_out': []})
-        self.scan_data_old = Observable({'f': [], 't': []})
+        self.scan_data_old = Observable(SampleBuffer(('f', 't')))
         self.scan_time_remaining = Observable()
+        self.scan_throughput = Observable()  # THz per hour measured so far in the current scan
+        self.scan_modes = Observable()  # Number of modes found so far in the current scan
         self.scan_update_active = Observable(False)
+        self.scan_recorder = None
+        self.stitched_recorder = None  # Spectrum of the first pass of the current scan, stitched into one
+        self.scan_stitcher = None
+        self.scan_window = Model.SCAN_WINDOW  # Samples are only recorded within this offset from the center, in GHz
+        self.mode_detector = ModeDetector()  # Modes found in the current scan
 
         self.lock = Lock()
         self.data_lock = Lock()
@@ -523,11 +685,10 @@ class Model:
             time.sleep(0.01)
             with self.lock:
                 if not update_stop_event.is_set():
-                    self.power.set(self.laser.check_power())
-                    freq_thz = self.laser.read(Laser.REG_FreqTHz)
-                    freq_ghz = self.laser.read(Laser.REG_FreqGHz)
-                    self.frequency.set(freq_thz + freq_ghz / 10000)
-                    self.offset.set(self.laser.offset())
+                    telemetry = self.laser.snapshot()
+                    self.power.set(telemetry.power)
+                    self.frequency.set(telemetry.frequency)
+                    self.offset.set(telemetry.offset)
 
     def scan_update(self, end_event: Event, take_data: Event):
         self.power_meter_connected.wait()
@@ -535,6 +696,8 @@ class Model:
         t_prev = None
         p_prev = None
         f_prev = None
+        # Interpolates the laser readings onto the power meter timestamps as they arrive
+        aligner = StreamingAligner(StreamingAligner.LINEAR)
 
         stop_pm_event = Event()
         power_queue = Queue()
@@ -575,22 +738,22 @@ class Model:
             self.offset.set(offset)
             f_new = self.frequency.get() + offset / 1000
 
+            aligner.add_laser(t_end, f_new, p_new)
+            aligner.add_meter_block(measured_time, output_powers)
+            _, frequencies, input_powers, output_powers = aligner.align()
+
             if t_prev and f_prev and p_prev:
                 assert isinstance(f_prev, float)
                 assert isinstance(p_prev, float)
 
-                t_duration = t_end - t_prev
-                interpolation = ((measured_time - t_prev) / t_duration)
-                frequencies = list(interpolation * f_new + (1 - interpolation) * f_prev)
-                input_powers = interpolation * p_new + (1 - interpolation) * p_prev
                 input_powers_watts = np.power(10, input_powers / 10) / 1000
-                relative_powers = list(output_powers / input_powers_watts)
+                relative_powers = output_powers / input_powers_watts
 
-                if abs(offset) < 20 and abs(p_new - 10) < 0.03 and abs(f_prev - f_new) < 0.1 and take_data.is_set():
+                if (abs(offset) <= self.scan_window and abs(p_new - 10) < 0.03 and abs(f_prev - f_new) < 0.1 and
+                        take_data.is_set()):
                     with self.data_lock:
                         data = self.scan_data_old.get()
-                        data['f'] += frequencies
-                        data['t'] += relative_powers
+                        data.append_block(frequencies, relative_powers)
                         self.scan_data_old.set(data)
 
             t_prev = t_end
@@ -600,10 +763,9 @@ class Model:
 
     def laser_read(self, queue: Queue):
         with self.lock:
-            input_power = self.laser.check_power()
-            offset = self.laser.offset()
+            input_power, offset = self.laser.read_many([Laser.REG_Oop, Laser.REG_Csweepoffset], signed_response=True)
             t = time.perf_counter()
-        results = input_power, offset, t
+        results = max(input_power * 0.01, 0), offset / 10.0, t
 
         queue.put(results)
 
@@ -627,51 +789,24 @@ class Model:
     def clean_jump(self, frequency):
         self.clean_jump_active.set(True)
         self.clean_sweep_stop()
-        with self.lock:
-            self.laser.wait_nop()
-        power_reference = self.power.get()
-        with self.lock:
-            self.laser.clean_jump_start(frequency)
-
-        # Read the frequency error and wait until it is below a threshold or 2 seconds passes
-        wait_time = time.perf_counter() + 2
-
-        with self.lock:
-            error_read = self.laser.read(Laser.REG_Cjumpoffset)
-        freq_error = error_read / 10.0
-        self.offset.set(freq_error)
-
-        while abs(freq_error) > 0.1 and time.perf_counter() < wait_time:
-            with self.lock:
-                error_read = self.laser.read(Laser.REG_Cjumpoffset)
-            freq_error = error_read / 10.0
-            self.offset.set(freq_error)
-
-        with self.lock:
-            self.laser.wait_nop()
-
-        # Read out the laser's claimed frequency
-        with self.lock:
-            claim_thz = self.laser.read(Laser.REG_GetFreqTHz)
-            claim_ghz = self.laser.read(Laser.REG_GETFreqGHz) / 10
-        claim_freq = claim_thz + claim_ghz / 1000.0
-
-        self.frequency.set(claim_freq)
-
-        print('Laser\'s claimed frequency: %f' % claim_freq)
 
+        # The jump holds the laser lock until the power has recovered, so the settle detector updates the display
+        detector = SettleDetector(callback=self.settle_sample)
         with self.lock:
-            self.laser.clean_jump_finish()
+            timing = self.laser.clean_jump_timed(frequency, detector)
 
-        time_wait = time.perf_counter() + 1
+        self.frequency.set(timing.claimed_frequency)
 
-        while self.power.get() < 0.8 * power_reference and time.perf_counter() < time_wait:
-            time.sleep(.1)
+        print('Laser\'s claimed frequency: %f (%.3f s)' % (timing.claimed_frequency, timing.total))
 
         self.clean_sweep_start(0, 1)
 
         self.clean_jump_active.set(False)
 
+    def settle_sample(self, sample):
+        self.offset.set(sample.offset)
+        self.power.set(sample.power)
+
     def clean_sweep_start(self, frequency, speed):
         self.clean_sweep_state.set("Preparing for clean sweep...")
         with self.lock:
@@ -697,86 +832,112 @@ class Model:
             time.sleep(0.1)
         self.clean_sweep_state.set("Pausing sweep at offset of {} GHz".format(offset))
 
-    def clean_scan(self, start_frequency: float, stop_frequency: float, speed: float, stop: Event, take_data: Event):
+    def clean_scan(self, start_frequency: float, stop_frequency: float, speed: float, stop: Event, take_data: Event,
+                   refine=False):
+        """Runs a mode finder scan
+
+        :param refine: after the scan, re-scan the regions around the modes it found more slowly
+        """
         assert stop_frequency > start_frequency
         if not self.power_meter_connected.is_set():
             self.connect_pm()
-        jump_frequency = start_frequency
+        with self.lock:
+            planner = ScanPlanner(self.laser.get_calibration())
+        plan = planner.tile(start_frequency, stop_frequency, speed)
+        logging.info('Scan plan: %d segments of %d GHz sweeps, about %.0f minutes' %
+                     (len(plan), plan.amplitudes[0], plan.estimate() / 60))
+        scan_name = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        with self.data_lock:
+            self.scan_recorder = ScanRecorder(os.path.join(Model.SCAN_DIRECTORY, scan_name))
+        self.stitched_recorder = ScanRecorder(os.path.join(self.scan_recorder.directory, Model.STITCHED_DIRECTORY))
+        self.scan_stitcher = SpectrumStitcher(self.stitched_recorder.append_block)
+        self.mode_detector = ModeDetector()
+        self.scan_modes.set(0)
         self.clean_scan_active.set(True)
         self.clean_scan_progress.set(0)
+        self.scan_time_remaining.set(round(plan.estimate() / 60))
         self.scan_data.set({'t_laser': [], 'f': [], 'p_in': [], 't_pm': [], 'p_out': []})
-        self.scan_data_old.set({'f': [], 't': []})
+        self.scan_data_old.set(SampleBuffer(('f', 't')))
         take_data.clear()
-        # self.power_meter_thread = Thread(target=self.pm_update, args=(stop, take_data))
-        # self.power_meter_thread.start()
-
-        scan_start_time = time.perf_counter()
-        scan_count = 0
-
-        while jump_frequency < stop_frequency + 0.03 and not stop.is_set():
-            power_reference = self.power.get()
-
-            with self.lock:
-                self.laser.clean_jump(jump_frequency)
-                freq_thz = self.laser.read(Laser.REG_FreqTHz)
-                freq_ghz = self.laser.read(Laser.REG_FreqGHz)
-                frequency = freq_thz + freq_ghz / 10000
-                self.frequency.set(frequency)
-
-            with self.lock:
-                self.laser.wait_nop()
-
-            time_wait = time.perf_counter() + 1
-
-            while self.power.get() < 0.8 * power_reference and time.perf_counter() < time_wait:
-                time.sleep(.1)
-
-            time.sleep(0.5)
-
-            power_reference = self.power.get()
-
-            self.clean_sweep_start(50, speed)
-
-            time.sleep(.1)
-
-            take_data.set()
-
-            while self.offset.get() < 10 and not stop.is_set():
-                time.sleep(.1)
-
-            while self.offset.get() > -10 and not stop.is_set():
-                time.sleep(.1)
 
-            while self.offset.get() < -1 and not stop.is_set():
-                time.sleep(0.1)
-
-            take_data.clear()
-
-            time.sleep(0.5)
-
-            with self.lock:
-                self.laser.clean_sweep_stop()
-
-            with self.lock:
-                self.laser.wait_nop()
-
-            time_wait = time.perf_counter() + 5
-
-            while self.power.get() < 0.95 * power_reference and time.perf_counter() < time_wait:
-                time.sleep(.1)
-
-            jump_frequency += 0.04
-            progress = (jump_frequency - start_frequency) / (stop_frequency - start_frequency)
-            self.clean_scan_progress.set((jump_frequency - start_frequency) / (stop_frequency - start_frequency))
-            time_elapsed = time.perf_counter() - scan_start_time
-            scan_count += 1
-            average_time_elapsed = time_elapsed / scan_count
-            self.scan_time_remaining.set(round(average_time_elapsed / progress / 60))
-
-        time.sleep(1)
-        # self.power_meter_thread.join()
+        self.run_scan_plan(plan, stop, take_data, stitch=True)
+        self.scan_stitcher.close()
+        self.stitched_recorder.close()
+        shifts = np.abs(self.scan_stitcher.shifts)
+        if shifts.size:
+            logging.info('Stitched %d segments, largest frequency correction %.3f GHz' % (shifts.size, shifts.max()))
+
+        modes = self.mode_detector.table
+        refine_plan = planner.refine(modes.frequencies, speed) if refine else None
+        if refine_plan is not None and not stop.is_set():
+            logging.info('Refining %d modes: %d segments, about %.0f minutes' %
+                         (len(modes), len(refine_plan), refine_plan.estimate() / 60))
+            self.clean_scan_progress.set(0)
+            self.run_scan_plan(refine_plan, stop, take_data)
+
+        self.scan_window = Model.SCAN_WINDOW
+        fsr = modes.fsr()
+        fsr_text = 'unknown' if fsr is None else '%.4f +- %.4f GHz' % fsr[:2]
+        logging.info('Found %d modes, FSR %s' % (len(modes), fsr_text))
+        modes.save_csv(os.path.join(self.scan_recorder.directory, 'modes.csv'))
+        with self.data_lock:
+            self.scan_recorder.close()
         self.clean_scan_active.set(False)
 
+    def run_scan_plan(self, plan, stop: Event, take_data: Event, stitch=False):
+        """Runs the segments of a plan
+
+        :param stitch: also add each segment to the stitched spectrum; the segments must be in order of frequency
+        """
+        # Each segment is written to the recording by the pipeline while the laser jumps to the next one
+        scan = ModeFinderScan(self.laser, self.lock, plan, SettleDetector(callback=self.settle_sample))
+        stages = [self.record_segment, lambda segment: self.detect_modes(segment, stop)]
+        if stitch:
+            stages.insert(1, self.stitch_segment)
+        pipeline = SegmentPipeline(stages)
+        self.offset.addCallback(scan.offset_changed)
+        try:
+            scan.run(take_data, stop, self.scan_mark, self.scan_samples, pipeline, started=self.scan_segment_started,
+                     progress=lambda done, throughput: self.scan_segment_done(done / len(plan), throughput))
+        finally:
+            self.offset.delCallback(scan.offset_changed)
+            pipeline.close()
+
+    def scan_segment_started(self, segment, timing):
+        self.scan_window = segment.window
+        self.frequency.set(timing.claimed_frequency)
+
+    def scan_mark(self):
+        """Number of samples in scan_data_old"""
+        with self.data_lock:
+            return len(self.scan_data_old.get())
+
+    def scan_samples(self, start, end):
+        """Copies of the frequencies and transmissions in scan_data_old between two scan_mark() values"""
+        with self.data_lock:
+            data = self.scan_data_old.get()
+            return data['f'][start:end].copy(), data['t'][start:end].copy()
+
+    def record_segment(self, segment):
+        with self.data_lock:
+            self.scan_recorder.append_block(segment.frequencies, segment.transmissions)
+
+    def stitch_segment(self, segment):
+        self.scan_stitcher.add_segment(segment.frequencies, segment.transmissions)
+
+    def detect_modes(self, segment, stop: Event):
+        self.mode_detector.add_segment(segment.frequencies, segment.transmissions, segment.index)
+        found = len(self.mode_detector.table)
+        self.scan_modes.set(found)
+        if Model.SCAN_STOP_AFTER_MODES is not None and found >= Model.SCAN_STOP_AFTER_MODES:
+            logging.info('Found %d modes; stopping the scan' % found)
+            stop.set()
+
+    def scan_segment_done(self, progress, throughput):
+        self.clean_scan_progress.set(progress)
+        self.scan_throughput.set(throughput.thz_per_hour)
+        self.scan_time_remaining.set(round(throughput.elapsed * (1 - progress) / progress / 60))
+
 
 class View(tk.Frame):
     def __init__(self, parent, *args, **kwargs):
@@ -864,14 +1025,20 @@ class BlankContext(tk.Frame):
 
 
 class GraphContext(tk.Frame):
+    PLOT_BINS = 600  # x bins of decimated plots, about the plot width in pixels; each is drawn as its min and max
+    LIMIT_MARGIN = 0.05  # Fraction of the data range added on each side when the axis limits change
+
     def __init__(self, parent, *args, **kwargs):
         tk.Frame.__init__(self, parent, *args, **kwargs)
         self.parent = parent
 
         self.fig = plt.Figure(figsize=(5, 4), dpi=100)
         self.sub_plot = self.fig.add_subplot(111)
-        self.line, = self.sub_plot.plot([], [], 'o', markersize=1)
+        # The line is animated: it is left out of full redraws and blitted over a saved background instead
+        self.line, = self.sub_plot.plot([], [], 'o', markersize=1, animated=True)
+        self.background = None
         self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.canvas.mpl_connect('draw_event', self.on_draw)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(side="top", fill="both", expand=True)
         self.ax = self.canvas.figure.axes[0]
@@ -889,24 +1056,52 @@ class GraphContext(tk.Frame):
         self.ax.set_ylabel(y_label)
 
     def plot(self, x, y, max_x_width=None):
+        """Shows (x, y) points, which should already be decimated to about PLOT_BINS points
+
+        The axes (and so the whole figure) are only redrawn when the data no longer fits the axis limits or fills less
+        than half of them; otherwise only the points are redrawn.
+
+        :param max_x_width: if set, only show the last max_x_width of x
+        """
         if isinstance(x, np.ndarray):
             if x.size > 1:
                 self.line.set_data(x, y)
-                ax = self.canvas.figure.axes[0]
+                x_max = x.max()
                 if max_x_width:
-                    x_min = max(x.max() - max_x_width, x.min())
+                    x_min = max(x_max - max_x_width, x.min())
                 else:
                     x_min = x.min()
 
-                x_width = x.max() - x_min
-
-                ax.set_xlim(x_min - x_width / 20, x.max() + x_width / 20)
-                ax.set_ylim(0.8 * y.min(), max(1.2 * y.max(), 1E-7))
+                x_limits = GraphContext.limits(self.ax.get_xlim(), x_min, x_max)
+                y_limits = GraphContext.limits(self.ax.get_ylim(), 0.8 * y.min(), max(1.2 * y.max(), 1E-7))
             else:
                 self.line.set_data([], [])
-                ax = self.canvas.figure.axes[0]
-                ax.set_xlim(0, 1)
-                ax.set_ylim(0, 1)
+                x_limits, y_limits = (0, 1), (0, 1)
+            self.redraw(x_limits, y_limits)
+
+    @staticmethod
+    def limits(current, low, high):
+        """Returns the current axis limits if they still suit data from low to high, or new ones with a margin"""
+        margin = max(high - low, 1E-9 * abs(high), 1E-12) * GraphContext.LIMIT_MARGIN
+        fits = current[0] <= low and high <= current[1]
+        if fits and current[1] - current[0] <= 2 * (high - low + 2 * margin):
+            return current
+        return low - margin, high + margin
+
+    def redraw(self, x_limits, y_limits):
+        if self.background is None or tuple(x_limits) != self.ax.get_xlim() or tuple(y_limits) != self.ax.get_ylim():
+            self.ax.set_xlim(*x_limits)
+            self.ax.set_ylim(*y_limits)
+            self.canvas.draw_idle()  # on_draw saves the new background and draws the line
+        else:
+            self.canvas.restore_region(self.background)
+            self.ax.draw_artist(self.line)
+            self.canvas.blit(self.fig.bbox)
+
+    def on_draw(self, event):
+        """Saves the background after a full redraw (new limits, resize, ...) and draws the line over it"""
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.line)
 
 
 class Status(tk.Frame):
@@ -1039,6 +1234,9 @@ class CommandBar(tk.Frame):
         self.button_scan = CommandButton(self, "Frequency Scan", None)
         self.button_scan.grid(row=1, column=4, columnspan=3, sticky=full_sticky)
         self.button_scan.disable()
+        self.refine = tk.BooleanVar(value=False)
+        self.refine_check = ttk.Checkbutton(self, text="Re-scan dips slowly", variable=self.refine)
+        self.refine_check.grid(row=2, column=4, columnspan=3)
 
 
 class FrequencyEntryAndLabel(tk.Frame):
@@ -0,0 +1,637 @@
+"""
+Software stand-in for the PurePhotonics PPCL550 ITLA.
+
+The simulator speaks the same checksummed 4-byte frames that ``ITLA.Send_command`` writes and
+``ITLA.Receive_response`` reads, so the whole stack (``ITLA``, ``Laser`` and ``gui.Model``) can be run and
+benchmarked without hardware. Two front ends are provided:
+
+- ``SimulatedSerial``: an in-process replacement for ``serial.Serial``. Pass it as ``serial_class`` to ``ITLA`` or
+  ``Laser``; every port name opened through it is backed by one shared ``SimulatedITLA``.
+- ``PtySimulator``: serves a ``SimulatedITLA`` on a pseudo-terminal so unmodified code can open the slave path with
+  ``serial.Serial`` (Linux/macOS only).
+
+Example::
+
+    from itla_simulator import SimulatedSerial
+    laser = Laser('SIM0', 9600, serial_class=SimulatedSerial)
+"""
+
+import math
+import os
+import threading
+import time
+import logging
+
+from pure_photonics_utils import ITLA
+
+
+def to_signed(value):
+    """Interprets a 16 bit register word as a signed integer"""
+    value &= 0xFFFF
+    if value > 2 ** 15 - 1:
+        value -= 2 ** 16
+    return value
+
+
+def to_unsigned(value):
+    """Encodes an integer as a 16 bit register word"""
+    return int(round(value)) & 0xFFFF
+
+
+class SimulatedITLA:
+    """Register-level model of a PPCL550.
+
+    The model is evaluated lazily from the wall clock: nothing runs in the background, every frame advances the
+    simulated sweep, jump and power states to the time it is received.
+    """
+    BAUD_RATES = (9600, 19200, 38400, 57600, 115200)  # REG_Iocap bits 4-7 index into this tuple
+
+    NOP_READY = 0x10  # MRDY bit, what the NOP register reads when the laser is idle and ready
+    NOP_PENDING = 0x0100  # Pending flag set in the upper byte of NOP while an operation is in progress
+
+    STATUS_OK = 0x00
+    STATUS_XE = 0x01  # Execution error
+    STATUS_AEA = 0x02  # Response is an AEA string; read REG_AeaEar until exhausted
+    STATUS_CP = 0x03  # Command pending
+
+    SERIAL_NUMBER = 'CRTNHBM047'
+    MANUFACTURER = 'PurePhotonics'
+    MODEL = 'PPCL550'
+    RELEASE = 'SIM-1.0.0'
+
+    MIN_FREQUENCY = 191.5  # THz
+    MAX_FREQUENCY = 196.25  # THz
+
+    def __init__(self, baud=9600, latency=0.0005, startup_time=2.0, jump_time=0.5, jump_time_per_thz=0.2,
+                 sled_change_time=0.3, sweep_stop_time=0.5, power_recovery_time=0.3, frequency=195.0):
+        """Creates a simulated laser.
+
+        :param baud: baud rate the device boots with
+        :param latency: processing delay of the device for each frame in seconds, on top of the line time
+        :param startup_time: seconds the NOP register reads pending after the laser is enabled
+        :param jump_time: base settling time of a clean jump in seconds
+        :param jump_time_per_thz: additional clean jump settling time per THz of jump distance
+        :param sled_change_time: additional clean jump settling time when the sled temperature changes mode
+        :param sweep_stop_time: seconds the NOP register reads pending after a clean sweep is stopped
+        :param power_recovery_time: seconds the optical power takes to recover after a jump or power-on
+        :param frequency: frequency in THz the laser starts at
+        """
+        self.baud = baud
+        self.latency = latency
+        self.startup_time = startup_time
+        self.jump_time = jump_time
+        self.jump_time_per_thz = jump_time_per_thz
+        self.sled_change_time = sled_change_time
+        self.sweep_stop_time = sweep_stop_time
+        self.power_recovery_time = power_recovery_time
+
+        self.lock = threading.RLock()
+        self.registers = {}
+        self.frames_received = 0
+        self.checksum_errors = 0
+
+        self._aea_buffer = ''
+        self._pending_until = 0.0
+        self._last_error = ITLA.NOERROR
+
+        self._frequency = frequency  # Frequency the laser is settled at, THz
+        self._enabled = False
+        self._power_ready_time = 0.0
+
+        self._jump_arm_count = 0
+        self._jump_start_time = None
+        self._jump_from = frequency
+        self._jump_to = frequency
+        self._jump_duration = 0.0
+
+        self._jump_sled = None
+
+        self._sweep_start_time = None
+        self._sweep_origin = 0.0  # Offset in GHz at which the current sweep segment started
+        self._sweep_direction = 1
+        self._sweep_stop_offset = None
+        self._sweep_hold_offset = 0.0
+
+        self._next_baud = None
+
+        self._reset_registers()
+
+    def _reset_registers(self):
+        freq_thz = math.trunc(self._frequency)
+        self.registers = {
+            ITLA.REG_Nop: 0,
+            ITLA.REG_Gencfg: 0,
+            ITLA.REG_AeaEar: 0,
+            ITLA.REG_Iocap: SimulatedITLA.BAUD_RATES.index(self.baud) << 4 if self.baud in SimulatedITLA.BAUD_RATES
+            else 0,
+            ITLA.REG_Ear: 0,
+            ITLA.REG_Dlconfig: 0,
+            ITLA.REG_Dlstatus: 1,
+            ITLA.REG_Channel: 1,
+            ITLA.REG_Power: 1000,
+            ITLA.REG_ResetEnable: 0,
+            ITLA.REG_Grid: 500,
+            ITLA.REG_FreqTHz: freq_thz,
+            ITLA.REG_FreqGHz: round((self._frequency - freq_thz) * 10000),
+            ITLA.REG_Opsl: 600,
+            ITLA.REG_Opsh: 1350,
+            ITLA.REG_Lfl1: 191,
+            ITLA.REG_Lfl2: 5000,
+            ITLA.REG_Lfh1: 196,
+            ITLA.REG_Lfh2: 2500,
+            ITLA.REG_Currents: 1500,
+            ITLA.REG_Temps: 3000,
+            ITLA.REG_Ftf: 0,
+            ITLA.REG_Mode: 0,
+            ITLA.REG_PW: 0,
+            ITLA.REG_Csweepamp: 0,
+            ITLA.REG_Csweepon: 0,
+            ITLA.REG_Csweepstop: 0,
+            ITLA.REG_SledSlope: 120,
+            ITLA.REG_CjumpCurrent: 0,
+            ITLA.REG_CjumpTHz: freq_thz,
+            ITLA.REG_CjumpGHz: 0,
+            ITLA.REG_CjumpSled: 3000,
+            ITLA.REG_Cjumpon: 0,
+            ITLA.REG_Csweepspeed: 1000,
+            ITLA.REG_Cscansled: 0,
+            ITLA.REG_Cscanf2: 0,
+        }
+
+    # ------------------------------------------------------------------------------------------------------------
+    # Timing
+    # ------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def frame_time(baud):
+        """Time in seconds it takes to send one 4-byte frame (8N1, 10 bits per byte) at the given baud rate"""
+        return 40.0 / baud
+
+    def response_delay(self):
+        """Delay from the end of a request frame to the end of its response frame"""
+        return self.latency + SimulatedITLA.frame_time(self.baud)
+
+    # ------------------------------------------------------------------------------------------------------------
+    # Physical state
+    # ------------------------------------------------------------------------------------------------------------
+
+    def _update(self, now):
+        """Advances the jump state to the given time"""
+        if self._jump_start_time is not None and now >= self._jump_start_time + self._jump_duration:
+            self._frequency = self._jump_to
+            self._jump_start_time = None
+
+    def frequency(self, now=None):
+        """The laser's actual output frequency in THz, including clean jump and clean sweep offsets"""
+        if now is None:
+            now = time.perf_counter()
+        with self.lock:
+            self._update(now)
+            if self._jump_start_time is not None:
+                return self._jump_to - self._jump_offset(now) / 1000.0
+            return self._frequency + self._sweep_offset(now) / 1000.0
+
+    def _jump_offset(self, now):
+        """Remaining distance to the clean jump target in GHz, decaying exponentially while the jump settles"""
+        if self._jump_start_time is None:
+            return 0.0
+        elapsed = now - self._jump_start_time
+        distance = (self._jump_to - self._jump_from) * 1000
+        return distance * math.exp(-6.0 * elapsed / self._jump_duration)
+
+    def _sweep_position(self, offset, direction):
+        """Position on the unfolded triangle wave (0 to 4 * amp/2) for an offset and a direction of travel"""
+        half_amp = self.registers[ITLA.REG_Csweepamp] / 2.0
+        if direction > 0:
+            return offset + half_amp
+        return 3 * half_amp - offset
+
+    def _sweep_state(self, now):
+        """Returns the clean sweep offset in GHz and the direction it is moving in"""
+        if self._sweep_start_time is None:
+            return self._sweep_hold_offset, self._sweep_direction
+        half_amp = self.registers[ITLA.REG_Csweepamp] / 2.0
+        if half_amp <= 0:
+            return 0.0, 1
+        period = 4 * half_amp
+        speed_ghz = self.registers[ITLA.REG_Csweepspeed] / 1000.0
+        travelled = (now - self._sweep_start_time) * speed_ghz
+        origin = self._sweep_position(self._sweep_origin, self._sweep_direction)
+
+        if self._sweep_stop_offset is not None:
+            # Pause once the sweep passes the requested offset in either direction
+            stop = max(-half_amp, min(half_amp, self._sweep_stop_offset))
+            distance = min((self._sweep_position(stop, 1) - origin) % period,
+                           (self._sweep_position(stop, -1) - origin) % period)
+            if travelled >= distance:
+                return stop, self._sweep_direction
+
+        position = (origin + travelled) % period
+        if position < 2 * half_amp:
+            return position - half_amp, 1
+        return 3 * half_amp - position, -1
+
+    def _sweep_offset(self, now):
+        """Offset of the clean sweep in GHz: a triangle wave between -amp/2 and +amp/2 at REG_Csweepspeed"""
+        return self._sweep_state(now)[0]
+
+    def _restart_sweep(self, now):
+        """Starts a new sweep segment from the current offset and direction"""
+        self._sweep_origin, self._sweep_direction = self._sweep_state(now)
+        self._sweep_start_time = now
+
+    def _end_sweep(self):
+        self._sweep_start_time = None
+        self._sweep_stop_offset = None
+        self._sweep_hold_offset = 0.0
+        self._sweep_origin = 0.0
+        self._sweep_direction = 1
+
+    def power(self, now=None):
+        """Optical output power in dBm"""
+        if now is None:
+            now = time.perf_counter()
+        if not self._enabled:
+            return -10.0
+        setpoint = self.registers[ITLA.REG_Power] / 100.0
+        if now >= self._power_ready_time:
+            return setpoint
+        remaining = (self._power_ready_time - now) / max(self.power_recovery_time, 1e-9)
+        return setpoint - 6.0 * min(remaining, 1.0)
+
+    def pending(self, now=None):
+        """True while the NOP register reports an operation in progress"""
+        if now is None:
+            now = time.perf_counter()
+        return now < self._pending_until
+
+    # ------------------------------------------------------------------------------------------------------------
+    # Frame handling
+    # ------------------------------------------------------------------------------------------------------------
+
+    @staticmethod
+    def build_frame(status, register, value):
+        """Builds a checksummed response frame"""
+        value = to_unsigned(value)
+        byte2 = value >> 8
+        byte3 = value & 0xFF
+        byte0 = status & 0x0F
+        byte0 |= ITLA.checksum(byte0, register, byte2, byte3) << 4
+        return bytes([byte0, register, byte2, byte3])
+
+    def handle_frame(self, frame, now=None):
+        """Decodes one 4-byte request frame and returns the 4-byte response frame"""
+        if now is None:
+            now = time.perf_counter()
+
+        byte0, register, byte2, byte3 = frame
+        with self.lock:
+            self.frames_received += 1
+            if ITLA.checksum(byte0, register, byte2, byte3) != byte0 >> 4:
+                self.checksum_errors += 1
+                # Communication error flag (bit 3) set, no execution
+                return SimulatedITLA.build_frame(0x08 | SimulatedITLA.STATUS_XE, register, 0)
+
+            self._update(now)
+            data = byte2 * 256 + byte3
+            if byte0 & 0x01:
+                status, value = self._write(register, data, now)
+            else:
+                status, value = self._read(register, now)
+            return SimulatedITLA.build_frame(status, register, value)
+
+    def _aea(self, text):
+        """Starts an AEA transfer of the given string, padded to an even number of bytes"""
+        if len(text) % 2:
+            text += '\x00'
+        self._aea_buffer = text
+        return SimulatedITLA.STATUS_AEA, len(text)
+
+    def _read(self, register, now):
+        if register == ITLA.REG_Nop:
+            nop = SimulatedITLA.NOP_READY | self._last_error
+            if self.pending(now):
+                nop |= SimulatedITLA.NOP_PENDING
+            # As on the module, the error field is cleared once it has been read
+            self._last_error = ITLA.NOERROR
+            return SimulatedITLA.STATUS_OK, nop
+        elif register == ITLA.REG_Serial:
+            return self._aea(SimulatedITLA.SERIAL_NUMBER)
+        elif register == ITLA.REG_Mfgr:
+            return self._aea(SimulatedITLA.MANUFACTURER)
+        elif register == ITLA.REG_Model:
+            return self._aea(SimulatedITLA.MODEL)
+        elif register == ITLA.REG_Release:
+            return self._aea(SimulatedITLA.RELEASE)
+        elif register == ITLA.REG_AeaEar:
+            chunk = self._aea_buffer[:2].ljust(2, '\x00')
+            self._aea_buffer = self._aea_buffer[2:]
+            return SimulatedITLA.STATUS_OK, ord(chunk[0]) * 256 + ord(chunk[1])
+        elif register == ITLA.REG_Oop:
+            return SimulatedITLA.STATUS_OK, round(self.power(now) * 100)
+        elif register in (ITLA.REG_GetFreqTHz, ITLA.REG_GETFreqGHz):
+            frequency = self.frequency(now)
+            freq_thz = math.trunc(frequency)
+            if register == ITLA.REG_GetFreqTHz:
+                return SimulatedITLA.STATUS_OK, freq_thz
+            return SimulatedITLA.STATUS_OK, round((frequency - freq_thz) * 10000)
+        elif register == ITLA.REG_Offset:
+            if self._jump_start_time is not None:
+                return SimulatedITLA.STATUS_OK, round(self._jump_offset(now) * 10)
+            return SimulatedITLA.STATUS_OK, round(self._sweep_offset(now) * 10)
+        elif register in self.registers:
+            return SimulatedITLA.STATUS_OK, self.registers[register]
+        else:
+            return SimulatedITLA.STATUS_XE, 0
+
+    def _write(self, register, data, now):
+        if register not in self.registers or register in (ITLA.REG_Offset, ITLA.REG_Oop, ITLA.REG_Dlstatus):
+            self._last_error = 0x03  # Register not implemented
+            return SimulatedITLA.STATUS_XE, data
+
+        if register == ITLA.REG_ResetEnable:
+            self.registers[register] = data
+            if data & ITLA.SET_ON and not self._enabled:
+                self._enabled = True
+                self._frequency = self.registers[ITLA.REG_FreqTHz] + self.registers[ITLA.REG_FreqGHz] / 10000.0
+                self._pending_until = now + self.startup_time
+                self._power_ready_time = now + self.startup_time + self.power_recovery_time
+            elif not data & ITLA.SET_ON:
+                self._enabled = False
+                self._end_sweep()
+                self._jump_start_time = None
+            return SimulatedITLA.STATUS_OK, data
+        elif register == ITLA.REG_Iocap:
+            self.registers[register] = data
+            index = (data >> 4) & 0x0F
+            if index < len(SimulatedITLA.BAUD_RATES):
+                # The response is still sent at the old rate; the new rate applies to the next frame
+                self._next_baud = SimulatedITLA.BAUD_RATES[index]
+            return SimulatedITLA.STATUS_OK, data
+        elif register == ITLA.REG_Csweepon:
+            self.registers[register] = data
+            if data:
+                self._sweep_stop_offset = None
+                self._restart_sweep(now)
+            else:
+                self._end_sweep()
+                self._pending_until = now + self.sweep_stop_time
+            return SimulatedITLA.STATUS_OK, data
+        elif register == ITLA.REG_Csweepstop:
+            self.registers[register] = data
+            if self._sweep_start_time is not None:
+                # Restart the segment from the current position so the stop is measured from here
+                self._restart_sweep(now)
+            self._sweep_stop_offset = to_signed(data)
+            return SimulatedITLA.STATUS_OK, data
+        elif register == ITLA.REG_Cjumpon:
+            self.registers[register] = data
+            if not data:
+                self._jump_arm_count = 0
+                return SimulatedITLA.STATUS_OK, data
+            if self.pending(now):
+                return SimulatedITLA.STATUS_CP, data
+            self._jump_arm_count += 1
+            # Memory, filter 1, filter 2, then execute
+            if self._jump_arm_count >= 4:
+                self._jump_arm_count = 0
+                self._start_jump(now)
+            return SimulatedITLA.STATUS_OK, data
+        else:
+            self.registers[register] = data
+            return SimulatedITLA.STATUS_OK, data
+
+    def _start_jump(self, now):
+        target = self.registers[ITLA.REG_CjumpTHz] + self.registers[ITLA.REG_CjumpGHz] / 10000.0
+        if not SimulatedITLA.MIN_FREQUENCY <= target <= SimulatedITLA.MAX_FREQUENCY:
+            self._last_error = 0x06  # Out of range
+            return
+        sled_before = self._jump_sled if self._jump_sled is not None else self.registers[ITLA.REG_CjumpSled]
+        self._jump_from = self.frequency(now)
+        self._jump_to = target
+        self._jump_duration = self.jump_time + self.jump_time_per_thz * abs(target - self._jump_from)
+        if abs(self.registers[ITLA.REG_CjumpSled] - sled_before) > 100:
+            self._jump_duration += self.sled_change_time
+        self._jump_sled = self.registers[ITLA.REG_CjumpSled]
+        self._jump_start_time = now
+        self._end_sweep()
+        self._pending_until = now + self._jump_duration
+        self._power_ready_time = now + self._jump_duration + self.power_recovery_time
+        self.registers[ITLA.REG_FreqTHz] = self.registers[ITLA.REG_CjumpTHz]
+        self.registers[ITLA.REG_FreqGHz] = self.registers[ITLA.REG_CjumpGHz]
+        self._last_error = ITLA.NOERROR
+
+    def apply_baud_change(self):
+        """Applies a baud rate change requested through REG_Iocap once its response has been sent"""
+        if self._next_baud:
+            logging.debug('Simulated laser switching to %d baud' % self._next_baud)
+            self.baud = self._next_baud
+            self._next_baud = None
+
+
+class SimulatedSerial:
+    """In-process stand-in for ``serial.Serial`` connected to a ``SimulatedITLA``.
+
+    Opening the same port name twice connects to the same simulated device, so code that closes and reopens the
+    port at another baud rate (e.g. ``ITLA.ITLAConnect``) behaves as it would against hardware: frames sent at the
+    wrong baud rate are never answered.
+    """
+    devices = {}
+    device_options = {}
+    PERSIST_PROFILES = False  # ITLA does not save connection profiles for simulated ports
+
+    def __init__(self, port=None, baudrate=9600, timeout=None, **kwargs):
+        self.port = port
+        self.portstr = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.write_timeout = kwargs.get('write_timeout')
+        self.is_open = True
+        self.device = SimulatedSerial.get_device(port)
+
+        self._lock = threading.Condition()
+        self._rx = bytearray()
+        self._rx_ready = []  # (ready time, number of bytes) for each response frame in flight
+        self._tx_partial = bytearray()
+        self._line_free = 0.0  # Time at which the serial line finishes sending the last frame
+
+    @classmethod
+    def get_device(cls, port):
+        """Returns the simulated device for the given port name, creating it on first use"""
+        if port not in cls.devices:
+            cls.devices[port] = SimulatedITLA(**cls.device_options.get(port, {}))
+        return cls.devices[port]
+
+    @classmethod
+    def add_device(cls, port, device=None, **options):
+        """Registers a device for the given port name, replacing any existing one"""
+        if device is None:
+            device = SimulatedITLA(**options)
+        cls.devices[port] = device
+        return device
+
+    @classmethod
+    def reset(cls):
+        """Forgets all simulated devices"""
+        cls.devices = {}
+        cls.device_options = {}
+
+    def __repr__(self):
+        return 'SimulatedSerial<port=%r, baudrate=%r, timeout=%r>' % (self.port, self.baudrate, self.timeout)
+
+    def fileno(self):
+        raise OSError('SimulatedSerial has no file descriptor; use PtySimulator instead')
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError('Attempting to use a port that is not open')
+        now = time.perf_counter()
+        frame_time = SimulatedITLA.frame_time(self.baudrate)
+        with self._lock:
+            self._tx_partial.extend(data)
+            line_start = max(now, self._line_free)
+            while len(self._tx_partial) >= 4:
+                frame = bytes(self._tx_partial[:4])
+                del self._tx_partial[:4]
+                line_start += frame_time
+                if self.baudrate != self.device.baud:
+                    # Garbage on the device side: no response
+                    continue
+                response = self.device.handle_frame(frame, now=line_start)
+                ready = line_start + self.device.response_delay()
+                self.device.apply_baud_change()
+                self._rx_ready.append((ready, response))
+            self._line_free = line_start
+            self._lock.notify_all()
+        return len(data)
+
+    def _collect(self, now):
+        """Moves responses whose transmission has completed into the receive buffer"""
+        while self._rx_ready and self._rx_ready[0][0] <= now:
+            self._rx.extend(self._rx_ready.pop(0)[1])
+
+    @property
+    def in_waiting(self):
+        with self._lock:
+            self._collect(time.perf_counter())
+            return len(self._rx)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        if not self.is_open:
+            raise OSError('Attempting to use a port that is not open')
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        with self._lock:
+            while True:
+                now = time.perf_counter()
+                self._collect(now)
+                if len(self._rx) >= size:
+                    break
+                if deadline is not None and now >= deadline:
+                    break
+                wake = self._rx_ready[0][0] if self._rx_ready else None
+                if deadline is not None:
+                    wake = deadline if wake is None else min(wake, deadline)
+                if wake is None:
+                    self._lock.wait()
+                else:
+                    self._lock.wait(max(wake - now, 0))
+            data = bytes(self._rx[:size])
+            del self._rx[:size]
+            return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        with self._lock:
+            self._rx = bytearray()
+            self._rx_ready = []
+
+    def reset_output_buffer(self):
+        with self._lock:
+            self._tx_partial = bytearray()
+
+    def flushInput(self):
+        self.reset_input_buffer()
+
+    def flushOutput(self):
+        self.reset_output_buffer()
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class PtySimulator:
+    """Serves a ``SimulatedITLA`` on a pseudo-terminal.
+
+    ``PtySimulator().start()`` returns the slave device path, which can be opened with ``serial.Serial`` like a real
+    COM port. The baud rate set by the client is ignored on a pty, so only ``SimulatedITLA.latency`` is applied.
+    """
+
+    def __init__(self, device=None, **options):
+        self.device = device if device is not None else SimulatedITLA(**options)
+        self.master = None
+        self.slave = None
+        self.path = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Opens the pseudo-terminal and starts serving frames. Returns the path of the slave device."""
+        import pty
+        import tty
+
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self.path
+
+    def _serve(self):
+        import select
+
+        buffer = bytearray()
+        while not self._stop.is_set():
+            readable, _, _ = select.select([self.master], [], [], 0.05)
+            if not readable:
+                continue
+            try:
+                buffer.extend(os.read(self.master, 64))
+            except OSError:
+                break
+            while len(buffer) >= 4:
+                frame = bytes(buffer[:4])
+                del buffer[:4]
+                response = self.device.handle_frame(frame)
+                if self.device.latency:
+                    time.sleep(self.device.latency)
+                os.write(self.master, response)
+                self.device.apply_baud_change()
+
+    def stop(self):
+        """Stops serving and closes the pseudo-terminal"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
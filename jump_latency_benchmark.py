@@ -0,0 +1,208 @@
+"""
+Benchmark of clean jump latency as a function of jump distance, direction and sled mode change.
+
+Runs a matrix of jumps around a center frequency, timing each phase with ``Laser.clean_jump_timed``, and prints
+percentiles and a histogram for every group of jumps. Without ``--port`` the jumps run on the simulator.
+
+The report can be saved as JSON (summary and every jump) and CSV (one row per jump). Passing an earlier JSON report
+to ``--compare`` prints the change of each group's median and 90th percentile and exits with status 1 if any of them
+got slower by more than ``--threshold``.
+
+Usage: python jump_latency_benchmark.py [--port COM12] [--baud 115200] [--distances 0.05 0.35 1 2 4] [--repeats 3]
+                                        [--json report.json] [--csv jumps.csv] [--compare baseline.json]
+"""
+
+import sys
+import csv
+import json
+import argparse
+import datetime
+import itertools
+
+import numpy as np
+
+from calibration import Calibration
+from itla_simulator import SimulatedSerial
+from laser import Laser
+from settle import SettleDetector
+
+PHASES = ('command', 'filter_calc', 'tuning', 'power_recovery', 'total')
+PERCENTILES = (50, 90, 99)
+DISTANCES = (0.05, 0.35, 1.0, 2.0, 4.0)  # THz
+GROUP_FIELDS = ('distance', 'direction', 'sled_mode_change')
+SIMULATOR_PORT = 'JUMP_BENCH'
+HISTOGRAM_BINS = 10
+HISTOGRAM_WIDTH = 40
+
+
+def jump_matrix(calibration, distances, repeats, center=None):
+    """Returns (start, target) frequency pairs: an upward and a downward jump of each distance, centered on
+    ``center`` THz (the middle of the calibrated range by default), each repeated ``repeats`` times"""
+    if center is None:
+        center = (calibration.min_frequency + calibration.max_frequency) / 2
+
+    pairs = []
+    for distance in distances:
+        low = round(center - distance / 2, 4)
+        high = round(center + distance / 2, 4)
+        if not (calibration.in_range(low) and calibration.in_range(high)):
+            print('Skipping %g THz jumps, which do not fit in the calibrated range' % distance)
+            continue
+        pairs.extend([(low, high), (high, low)] * repeats)
+    return pairs
+
+
+def run_jumps(laser, pairs, detector=None):
+    """Moves to each start frequency, then times the jump to the target. Returns one dict per timed jump."""
+    calibration = laser.get_calibration()
+    rows = []
+    for start, target in pairs:
+        laser.clean_jump_timed(start, detector)
+        timing = laser.clean_jump_timed(target, detector)
+
+        # A sled temperature change of more than half a sled spacing means the sled changed mode
+        sled_change = abs(calibration.sled_temperature(target) - calibration.sled_temperature(start))
+        row = {'start': start, 'target': target, 'distance': round(abs(target - start), 4),
+               'direction': 'up' if target > start else 'down',
+               'sled_mode_change': bool(sled_change > calibration.sled_spacing / 2),
+               'settled': timing.settled, 'claimed_frequency': timing.claimed_frequency}
+        row.update({phase: getattr(timing, phase) for phase in PHASES})
+        rows.append(row)
+        print('%8.4f -> %8.4f THz: %6.3f s%s' % (start, target, timing.total, '' if timing.settled else ' (timeout)'))
+    return rows
+
+
+def summarize(rows):
+    """Groups the jumps by distance, direction and sled mode change and calculates statistics of each phase"""
+    summary = []
+    key = lambda row: tuple(row[field] for field in GROUP_FIELDS)
+    for group, group_rows in itertools.groupby(sorted(rows, key=key), key=key):
+        group_rows = list(group_rows)
+        entry = dict(zip(GROUP_FIELDS, group))
+        entry['count'] = len(group_rows)
+        entry['settled'] = sum(row['settled'] for row in group_rows) / len(group_rows)
+        for phase in PHASES:
+            times = np.array([row[phase] for row in group_rows])
+            stats = {'mean': times.mean(), 'min': times.min(), 'max': times.max()}
+            stats.update({'p%d' % p: value for p, value in zip(PERCENTILES, np.percentile(times, PERCENTILES))})
+            entry[phase] = {name: float(value) for name, value in stats.items()}
+        summary.append(entry)
+    return summary
+
+
+def group_name(entry):
+    return '%g THz %s%s' % (entry['distance'], entry['direction'], ', sled mode change' if entry['sled_mode_change']
+                            else '')
+
+
+def histogram(values, bins=HISTOGRAM_BINS, width=HISTOGRAM_WIDTH):
+    """Returns text lines of a horizontal histogram of the values"""
+    counts, edges = np.histogram(values, bins=bins)
+    scale = width / max(counts.max(), 1)
+    return ['%7.3f-%7.3f s %4d %s' % (edges[i], edges[i + 1], count, '#' * int(round(count * scale)))
+            for i, count in enumerate(counts)]
+
+
+def print_report(rows, summary):
+    header = '%-36s %5s' % ('group', 'n') + ''.join(' %9s' % ('p%d %s' % (p, phase[:6])) for phase in
+                                                     ('tuning', 'total') for p in PERCENTILES)
+    print(header)
+    for entry in summary:
+        print('%-36s %5d' % (group_name(entry), entry['count']) +
+              ''.join(' %9.3f' % entry[phase]['p%d' % p] for phase in ('tuning', 'total') for p in PERCENTILES))
+
+    print('\nTotal jump time, all jumps:')
+    for line in histogram([row['total'] for row in rows]):
+        print(line)
+
+
+def compare(summary, baseline, threshold):
+    """Prints the change of median and 90th percentile total time of each group against an earlier report
+
+    :return: True if any group got slower by more than ``threshold`` (a fraction)
+    """
+    baseline_groups = {tuple(entry[field] for field in GROUP_FIELDS): entry for entry in baseline['summary']}
+    regression = False
+    print('\nChange from baseline (%s):' % baseline.get('created', 'unknown date'))
+    for entry in summary:
+        old = baseline_groups.get(tuple(entry[field] for field in GROUP_FIELDS))
+        if old is None:
+            print('%-36s not in baseline' % group_name(entry))
+            continue
+        changes = {stat: entry['total'][stat] / old['total'][stat] - 1 for stat in ('p50', 'p90')}
+        slower = any(change > threshold for change in changes.values())
+        regression |= slower
+        print('%-36s %s%s' % (group_name(entry), '  '.join('%s %+6.1f%%' % (stat, change * 100)
+                                                           for stat, change in changes.items()),
+                              '  REGRESSION' if slower else ''))
+    return regression
+
+
+def write_csv(file_name, rows):
+    with open(file_name, 'w', newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--port', help='serial port of a real laser; the simulator is used if omitted')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--distances', type=float, nargs='+', default=DISTANCES, help='jump distances in THz')
+    parser.add_argument('--repeats', type=int, default=3, help='jumps in each direction for each distance')
+    parser.add_argument('--center', type=float, help='center frequency of the jumps in THz')
+    parser.add_argument('--json', help='write the report to this JSON file')
+    parser.add_argument('--csv', help='write every jump to this CSV file')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='slowdown counted as a regression')
+    args = parser.parse_args(argv)
+    if args.repeats < 1:
+        parser.error('--repeats must be at least 1')
+
+    if args.port:
+        laser = Laser(args.port, args.baud)
+    else:
+        # Keep the simulated run out of the user's calibration cache
+        Calibration.CACHE_DIR = None
+        SimulatedSerial.add_device(SIMULATOR_PORT, baud=args.baud)
+        laser = Laser(SIMULATOR_PORT, args.baud, serial_class=SimulatedSerial)
+
+    detector = SettleDetector()
+    try:
+        calibration = laser.get_calibration()
+        pairs = jump_matrix(calibration, args.distances, args.repeats, args.center)
+        if not pairs:
+            print('No jump distance fits in the calibrated range %g-%g THz; nothing to measure' %
+                  (calibration.min_frequency, calibration.max_frequency), file=sys.stderr)
+            return 1
+        laser.laser_on(pairs[0][0])
+        rows = run_jumps(laser, pairs, detector)
+        laser.laser_off()
+    finally:
+        laser.itla_disconnect()
+
+    summary = summarize(rows)
+    print()
+    print_report(rows, summary)
+
+    report = {'created': datetime.datetime.now().isoformat(timespec='seconds'), 'port': args.port or SIMULATOR_PORT,
+              'simulated': not args.port, 'baud': args.baud,
+              'settle': {'offset_tolerance': detector.offset_tolerance, 'power_tolerance': detector.power_tolerance,
+                         'dwell': detector.dwell, 'timeout': detector.timeout},
+              'summary': summary, 'jumps': rows}
+    if args.json:
+        with open(args.json, 'w') as json_file:
+            json.dump(report, json_file, indent=1)
+    if args.csv:
+        write_csv(args.csv, rows)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            if compare(summary, json.load(baseline_file), args.threshold):
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+"""
+Clean jump plans with precomputed register values.
+
+A ``JumpPlan`` holds a list of frequencies and the clean jump register values for each of them, computed in one
+vectorized call when the plan is built. Executing the plan only writes the stored values to the laser, and a plan can
+be saved and loaded again for recipes that jump through the same frequencies every time.
+
+Example::
+
+    laser = Laser()
+    plan = JumpPlan.from_range(laser.get_calibration(), 193, 195.8, 0.35)
+    plan.save('recipe.npz')
+    ...
+    for timing in JumpPlan.load('recipe.npz').run(laser, dwell=1):
+        print(timing.frequency, timing.claimed_frequency, timing.total)
+"""
+
+import time
+
+import numpy as np
+
+from laser import Laser
+
+
+class JumpPlan:
+    """Frequencies to clean jump to, with the register values for each jump"""
+
+    def __init__(self, frequencies, words):
+        """
+        :param frequencies: target frequencies in THz
+        :param words: integer array with one row of ``Laser.CLEAN_JUMP_REGISTERS`` values per frequency
+        """
+        self.frequencies = np.asarray(frequencies, dtype=float)
+        self.words = np.asarray(words, dtype=np.int64).reshape(self.frequencies.size, len(Laser.CLEAN_JUMP_REGISTERS))
+
+    @classmethod
+    def from_frequencies(cls, calibration, frequencies):
+        """Builds a plan for a list of frequencies in THz
+
+        :param calibration: the laser's ``Calibration``, from ``Laser.get_calibration``
+        :raises ValueError: if any frequency is outside the calibrated range
+        """
+        frequencies = np.asarray(frequencies, dtype=float).ravel()
+        return cls(frequencies, np.column_stack(calibration.jump_registers(frequencies)))
+
+    @classmethod
+    def from_range(cls, calibration, start, stop, step):
+        """Builds a plan from ``start`` to ``stop`` THz in steps of ``step`` THz
+
+        ``stop`` is included if it is a whole number of steps from ``start``; the plan never goes past it.
+        """
+        # The tolerance only absorbs rounding errors in the division, so a partial last step is left out
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return cls.from_frequencies(calibration, np.minimum(start + step * np.arange(count), stop))
+
+    @classmethod
+    def load(cls, file_name):
+        """Loads a plan saved with ``save``"""
+        with np.load(file_name) as plan:
+            return cls(plan['frequencies'], plan['words'])
+
+    def save(self, file_name):
+        """Saves the plan as an ``.npz`` file"""
+        np.savez(file_name, frequencies=self.frequencies, words=self.words)
+
+    def __len__(self):
+        return self.frequencies.size
+
+    def __iter__(self):
+        """Yields (frequency, register values) for each jump"""
+        return zip(self.frequencies.tolist(), self.words.tolist())
+
+    def __getitem__(self, index):
+        return self.frequencies[index].item(), self.words[index].tolist()
+
+    def run(self, laser, dwell=0.0, stop_event=None, detector=None):
+        """Jumps through the plan, yielding the ``JumpTiming`` of each jump once it settles
+
+        :param laser: a connected ``Laser``
+        :param dwell: seconds to stay at each frequency before the next jump
+        :param stop_event: optional ``threading.Event`` that ends the plan early when set
+        :param detector: ``SettleDetector`` used for every jump, or None for the default tolerances
+        """
+        for freq, words in self:
+            if stop_event is not None and stop_event.is_set():
+                return
+            yield laser.clean_jump_words_timed(words, detector, freq)
+            if dwell:
+                time.sleep(dwell)
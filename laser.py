@@ -6,10 +6,23 @@ Created on Thu May 23 09:23:55 2019
 """
 
 from pure_photonics_utils import ITLA
+from calibration import Calibration
+from settle import SettleDetector, JumpTiming
 import numpy as np
+import os
 import math
 import time
 import logging
+from typing import NamedTuple
+
+
+class Telemetry(NamedTuple):
+    """One snapshot of the laser's status, read in a single pipelined batch"""
+    time: float  # time.perf_counter() when the batch completed
+    power: float  # Optical power in dBm
+    frequency: float  # Set frequency in THz
+    offset: float  # Clean sweep/jump offset in GHz
+    nop: int  # NOP register
 
 
 class Laser(ITLA):
@@ -17,25 +30,40 @@ class Laser(ITLA):
     Additional methods for the ITLA class to make standard commands easier.
     """
     SLED_CENTER_TEMP = 30  # Want sled temperatures to be close to 30 C
-    SLED_FILE_NAME = 'CalibrationFiles\\CRTNHBM047_21_14_43_4.sled'
-    MAP_FILE_NAME = 'CalibrationFiles\\CRTNHBM047_1000_21_14_39_59.map'
+    SLED_FILE_NAME = os.path.join('CalibrationFiles', 'CRTNHBM047_21_14_43_4.sled')
+    MAP_FILE_NAME = os.path.join('CalibrationFiles', 'CRTNHBM047_1000_21_14_39_59.map')
     DEFAULT_PORT = 'COM12'
     DEFAULT_BAUD = 115200
-
-    def __init__(self, port=None, baud=None, log_level=logging.WARNING):
+    # Registers read by snapshot(), in the order make_telemetry() expects them
+    SNAPSHOT_REGISTERS = (ITLA.REG_Oop, ITLA.REG_FreqTHz, ITLA.REG_FreqGHz, ITLA.REG_Csweepoffset, ITLA.REG_Nop)
+    # Registers set before a clean jump, in the order Calibration.jump_registers() returns their values
+    CLEAN_JUMP_REGISTERS = (ITLA.REG_CjumpTHz, ITLA.REG_CjumpGHz, ITLA.REG_CjumpSled, ITLA.REG_CjumpCurrent)
+    CLEAN_JUMP_WRITE_DELAY = 0.5  # Seconds between setting the clean jump registers and starting the jump
+
+    def __init__(self, port=None, baud=None, log_level=logging.WARNING, serial_class=None, sled_file_name=None,
+                 map_file_name=None, high_speed=False):
         if not port:
             port = Laser.DEFAULT_PORT
         if not baud:
             baud = Laser.DEFAULT_BAUD
 
+        # Each laser has its own calibration files; the class attributes are only defaults
+        self.sled_file_name = sled_file_name if sled_file_name else Laser.SLED_FILE_NAME
+        self.map_file_name = map_file_name if map_file_name else Laser.MAP_FILE_NAME
+
         logging.basicConfig(format='%(levelname)s: %(message)s', level=log_level)
 
-        ITLA.__init__(self, port, baud)
+        ITLA.__init__(self, port, baud, serial_class)
 
         print(self.sercon)
 
+        # Opt in to running the link at the fastest rate; itla_disconnect restores the original rate
+        if high_speed:
+            self.start_high_speed_session()
+
+        # Loaded by set_jump_vals, on the first clean jump unless it is called earlier
         self.jump_values = None
-        self.set_jump_vals()
+        self.calibration = None
 
     def read_error(self):
         """Get information about any errors raised by the laser"""
@@ -127,11 +155,11 @@ class Laser(ITLA):
             self.wait_nop()
 
             # Wait for the laser to be outputting the correct power (10 dBm in this case) or 5 seconds
-            wait_time = time.clock() + 5
+            wait_time = time.perf_counter() + 5
             optical_power = self.check_power()
             logging.info('Optical power: %5.2f' % optical_power)
 
-            while abs(optical_power - 10) > 1 and time.clock() < wait_time:
+            while abs(optical_power - 10) > 1 and time.perf_counter() < wait_time:
                 time.sleep(0.2)
                 optical_power = self.check_power()
                 logging.info('Optical power: %5.2f' % optical_power)
@@ -182,6 +210,34 @@ class Laser(ITLA):
 
         return response
 
+    def read_many(self, registers, signed_response=False):
+        """Reads several registers in one pipelined batch and returns their values in order
+
+        :param registers: sequence of ``REG_*`` values
+        :param signed_response: a bool applied to every register, or a sequence with one bool per register
+        """
+        registers = list(registers)
+        if isinstance(signed_response, bool):
+            signed_response = [signed_response] * len(registers)
+
+        values = []
+        for (response, _), signed in zip(self.itla_read_many(registers), signed_response):
+            values.append(ITLA.to_signed(response) if signed else response)
+
+        return values
+
+    def snapshot(self):
+        """Reads power, frequency, offset and status in one pipelined batch"""
+        return Laser.make_telemetry(self.read_many(Laser.SNAPSHOT_REGISTERS), time.perf_counter())
+
+    @staticmethod
+    def make_telemetry(responses, timestamp):
+        """Builds a Telemetry record from the unsigned responses to a read of SNAPSHOT_REGISTERS"""
+        power, freq_thz, freq_ghz, offset, nop = responses
+
+        return Telemetry(time=timestamp, power=max(ITLA.to_signed(power) * 0.01, 0),
+                         frequency=freq_thz + freq_ghz / 10000, offset=ITLA.to_signed(offset) / 10.0, nop=nop)
+
     def get_sled_slope(self):
         """Returns the slope of the sled temperature from the laser in degrees C per GHz"""
         assert isinstance(self, Laser)
@@ -195,48 +251,15 @@ class Laser(ITLA):
     def get_sled_spacing(self, sledfile_name: str):
         """Calculates the spacing between acceptable sled modes in degrees C"""
         assert isinstance(self, Laser)
-        assert isinstance(sledfile_name, str)
-
-        temps = []  # List of sled temperatures from the logfile
-        clusters = []  # Corresponding list of which cluster the temp belongs to
-
-        # Read .sled calibration file sled temperatures
-        with open(sledfile_name) as logfile:
-            lines = logfile.readlines()
-
-            for line in lines:
-                temps.append(float(line.split(' ')[5]) * 0.01)
 
-        # If two temps are 1 C apart or less, consider them part of the same cluster
-        cluster_num = 0
-        for i in range(len(temps)):  # Not Pythonic, I know
+        return Laser.read_sled_spacing(sledfile_name)
 
-            if i > 0:
-                if abs(temps[i] - temps[i - 1]) > 1:
-                    cluster_num = cluster_num + 1
-
-            clusters.append(cluster_num)
-
-        avg_temps = []
-
-        # Average the temperatures of each cluster
-        for c in range(clusters[-1] + 1):
-            cluster = []
-            for j in range(len(temps)):
-                if clusters[j] == c:
-                    cluster.append(temps[j])
-            avg_temps.append(np.mean(cluster))
-
-        sum_diffs = 0
-
-        # Find the average difference between cluster temperatures
-        for i in range(len(avg_temps)):
-            if i > 0:
-                sum_diffs = sum_diffs + abs(avg_temps[i] - avg_temps[i - 1])
-
-        sled_spacing = sum_diffs / (len(avg_temps) - 1)
+    @staticmethod
+    def read_sled_spacing(sledfile_name: str):
+        """Calculates the spacing between acceptable sled modes in degrees C from a .sled calibration file"""
+        assert isinstance(sledfile_name, str)
 
-        return sled_spacing
+        return Calibration.read_sled_clusters(sledfile_name).spacing
 
     @staticmethod
     def read_mapfile(mapfile_name):
@@ -285,138 +308,78 @@ class Laser(ITLA):
 
         return [freq, sled, f1temp, f2temp, f1power, f2power, current]
 
-    def set_jump_vals(self, sled_file_name=SLED_FILE_NAME, map_file_name=MAP_FILE_NAME):
-        sled_slope = self.get_sled_slope()
-        sled_spacing = self.get_sled_spacing(sled_file_name)
-        map_vals = Laser.read_mapfile(map_file_name)
-
-        self.jump_values = [sled_slope, sled_spacing, map_vals]
-
     @staticmethod
-    def get_sled_temperature(sled_spacing, sled_slope, map_vals, freq):
-        """Calculates the sled temperature for a jump based on .sled and .map file values and the desired frequency."""
-
-        # Get frequency and sled temp map values
-        freq_arr = map_vals[0]
-        sled_arr = map_vals[1]
-
-        # Find the two closest frequencies in freq_arr (frequency gridpoints)
-        i_upper = 0
-        while freq_arr[i_upper] < freq:
-            i_upper = i_upper + 1
-
-        i_lower = i_upper - 1
-
-        # Pick the closer of the two frequency gridpoints
-        upper_dist = abs(freq - freq_arr[i_upper])
-        lower_dist = abs(freq - freq_arr[i_lower])
-
-        gridpoint = i_lower
+    def read_calibration_files(sled_file_name, map_file_name):
+        """Returns (map_vals, sled_clusters) for the calibration files, from the calibration cache when it is current"""
+        cached = Calibration.load_cache(sled_file_name, map_file_name)
+        if cached is not None:
+            return cached
 
-        if upper_dist < lower_dist:
-            gridpoint = i_upper
+        sled_clusters = Calibration.read_sled_clusters(sled_file_name)
+        map_vals = np.array(Laser.read_mapfile(map_file_name))
+        Calibration.save_cache(sled_file_name, map_file_name, map_vals, sled_clusters)
 
-        temp_gridpoint = sled_arr[gridpoint]
-        freq_gridpoint = freq_arr[gridpoint]
+        return map_vals, sled_clusters
 
-        # Calculate the difference between the desired frequency, and the closest gridpoint, in GHz
-        freq_diff = (freq - freq_gridpoint) * 1000
-        logging.debug(
-            'freq: {0} THz, freq_grid: {1} THz, freq_diff: {2} GHz, temp_grid: {3} C'.format(freq, freq_gridpoint,
-                                                                                             freq_diff, temp_gridpoint))
+    def set_jump_vals(self, sled_file_name=None, map_file_name=None):
+        if not sled_file_name:
+            sled_file_name = self.sled_file_name
+        if not map_file_name:
+            map_file_name = self.map_file_name
 
-        # Using the sled's temperature-frequency slope, calculate the temp difference from the closest gridpoint
-        temp_diff = sled_slope * freq_diff
-        logging.debug('temp diff: {0} C'.format(temp_diff))
-
-        # Gridpoint + temperature difference will arrive at the correct frequency
-        sled_base_temp = temp_gridpoint + temp_diff
-        logging.debug('base temp: %f' % sled_base_temp)
-
-        # We want the sled's temperature to be close to 30 C to make jumping faster
-        # Changing the sled's temp by sled_spacing will not change the frequency
-        # So we calculate the number of sled_spacing's to get the sled closest to 30 C
-        # and still have the desired frequency
-        sled_center_diff = Laser.SLED_CENTER_TEMP - sled_base_temp
-        logging.debug('center diff: %f' % sled_center_diff)
+        sled_slope = self.get_sled_slope()
+        map_vals, sled_clusters = Laser.read_calibration_files(sled_file_name, map_file_name)
+        sled_spacing = sled_clusters.spacing
 
-        sled_mode_adjust = round(sled_center_diff / sled_spacing)
-        logging.debug('sled mode adjust %d' % sled_mode_adjust)
+        self.jump_values = [sled_slope, sled_spacing, map_vals]
+        self.calibration = Calibration.from_map_vals(map_vals, sled_slope, sled_spacing, sled_clusters)
 
-        # Add the sled_spacing's to the temp calculated above to get the final temp
-        sled_set_temp = sled_base_temp + sled_mode_adjust * sled_spacing
+    @staticmethod
+    def get_sled_temperature(sled_spacing, sled_slope, map_vals, freq):
+        """Calculates the sled temperature for a jump based on .sled and .map file values and the desired frequency.
 
-        return sled_set_temp
+        ``freq`` may be a single frequency or an array of frequencies. See ``Calibration.sled_temperature``.
+        """
+        return Calibration.from_map_vals(map_vals, sled_slope, sled_spacing).sled_temperature(freq)
 
     @staticmethod
     def get_current(map_vals, freq):
-        """Calculates the current in mA for the given frequency using the .map file values"""
-
-        # Get the frequency and current map values
-        freq_arr = map_vals[0]
-        current_arr = map_vals[6]
-
-        # Find the two closest frequencies in freq_arr (frequency gridpoints)
-        i_upper = 0
-        while freq_arr[i_upper] < freq:
-            i_upper = i_upper + 1
+        """Calculates the current in mA for the given frequency using the .map file values
 
-        i_lower = i_upper - 1
-
-        freq_upper = freq_arr[i_upper]
-        freq_lower = freq_arr[i_lower]
-
-        # The "grid spacing" of the map file is the frequency distance between points
-        freq_grid_diff = freq_upper - freq_lower
-
-        current_upper = current_arr[i_upper]
-        current_lower = current_arr[i_lower]
-
-        # Linear interpolation between the two currents
-        upper_frac = abs((freq - freq_upper) / freq_grid_diff)
-        lower_frac = 1 - upper_frac
-
-        current_interpolation = upper_frac * current_upper + lower_frac * current_lower
+        ``freq`` may be a single frequency or an array of frequencies. See ``Calibration.current``.
+        """
+        return Calibration.from_map_vals(map_vals, 0, 1).current(freq)
 
-        return current_interpolation
+    def get_calibration(self):
+        """Returns the jump calibration, loading it with ``set_jump_vals`` the first time"""
+        if self.calibration is None:
+            self.set_jump_vals()
+        return self.calibration
 
     def clean_jump_start(self, freq):
         """Starts clean jump. User must wait for stable frequency."""
-        if freq > 196.25 or freq < 191.5:
-            return
-
-        sled_slope = self.jump_values[0]
-        sled_spacing = self.jump_values[1]
-        map_vals = self.jump_values[2]
-
-        # Split the frequency into THz and GHz parts
-        freq_thz = math.trunc(freq)
-        freq_ghz = round((freq - freq_thz) * 10000)
+        calibration = self.get_calibration()
 
-        # Turn on clean mode
-        logging.debug('Clean mode: %d' % self.itla_communicate(Laser.REG_Mode, 1, Laser.WRITE))
-
-        # Set the next frequency in THz (register is specific for clean jump)
-        logging.debug(self.itla_communicate(Laser.REG_CjumpTHz, freq_thz, Laser.WRITE))
-
-        # Set the GHz part of the next frequency (register is specific for clean jump)
-        logging.debug(self.itla_communicate(Laser.REG_CjumpGHz, freq_ghz, Laser.WRITE))
+        if not calibration.in_range(freq):
+            logging.error('Frequency %f THz is outside the calibrated range %f-%f THz' %
+                          (freq, calibration.min_frequency, calibration.max_frequency))
+            return
 
-        # Calculate the sled temperature in units of 0.01 C and round to nearest int
-        sled_temp = Laser.get_sled_temperature(sled_spacing, sled_slope, map_vals, freq)
-        sled_temp_reg = round(sled_temp * 100)
+        logging.info('Moving to frequency %f' % freq)
 
-        # Calculate current in units of 0.1 mA and round to nearest int
-        current = Laser.get_current(map_vals, freq)
-        current_reg = round(current * 10)
+        self.clean_jump_start_words(calibration.jump_registers(freq))
 
-        # Write the current and sled temp to appropriate clean jump registers
-        logging.debug(self.itla_communicate(Laser.REG_CjumpSled, sled_temp_reg, Laser.WRITE))
-        logging.debug(self.itla_communicate(Laser.REG_CjumpCurrent, current_reg, Laser.WRITE))
+    def clean_jump_start_words(self, words):
+        """Starts clean jump with precomputed register values. User must wait for stable frequency.
 
-        time.sleep(0.5)
+        :param words: (REG_CjumpTHz, REG_CjumpGHz, REG_CjumpSled, REG_CjumpCurrent) values, as returned by
+            ``Calibration.jump_registers`` or stored in a ``JumpPlan``
+        """
+        # Turn on clean mode and set the next frequency, sled temp and current (registers are specific for clean jump)
+        responses = self.itla_write_many((Laser.REG_Mode,) + Laser.CLEAN_JUMP_REGISTERS, (1,) + tuple(words))
+        logging.debug('Clean mode and jump registers: %s' % [response for response, _ in responses])
 
-        logging.info('Moving to frequency %f' % freq)
+        time.sleep(Laser.CLEAN_JUMP_WRITE_DELAY)
 
         # Tell laser to move frequency, temperature, and current to memory
         logging.debug('Jump: memory (%d)' % self.itla_communicate(Laser.REG_Cjumpon, 1, Laser.WRITE))
@@ -431,39 +394,93 @@ class Laser(ITLA):
         """Turns off clean jump mode."""
         self.itla_communicate(ITLA.REG_Cjumpon, 0, ITLA.WRITE)
 
-    def clean_jump(self, freq):
-        """Performs a clean jump to the given frequency based on the calibration data provided."""
+    def clean_jump(self, freq, detector=None):
+        """Performs a clean jump to the given frequency based on the calibration data provided.
 
-        self.clean_jump_start(freq)
+        :param detector: ``SettleDetector`` deciding when the jump is over, or None for the default tolerances
+        :return: the laser's claimed frequency in THz after the jump, or None if the frequency is not calibrated
+        """
+        calibration = self.get_calibration()
 
-        # Read the frequency error and wait until it is below a threshold or 2 seconds passes
-        wait_time = time.clock() + 2
+        if not calibration.in_range(freq):
+            logging.error('Frequency %f THz is outside the calibrated range %f-%f THz' %
+                          (freq, calibration.min_frequency, calibration.max_frequency))
+            return None
 
-        error_read = self.itla_signed_communicate(Laser.REG_Cjumpoffset, 0, Laser.READ)
-        freq_error = error_read / 10.0
-        logging.debug('Frequency error: %5.1f GHz' % freq_error)
+        timing = self.clean_jump_timed(freq, detector)
 
-        while abs(freq_error) > 0.1 and time.clock() < wait_time:
-            time.sleep(.1)
-            error_read = self.itla_signed_communicate(Laser.REG_Cjumpoffset, 0, Laser.READ)
-            freq_error = error_read / 10.0
-            logging.debug('Frequency error: %5.1f GHz' % freq_error)
-        logging.info('Frequency error: %5.1f GHz' % freq_error)
+        print(('Laser\'s claimed frequency: %f' % timing.claimed_frequency))
 
-        self.wait_nop()
+        return timing.claimed_frequency
 
-        # Read out the laser's claimed frequency
-        claim_thz = self.itla_communicate(Laser.REG_GetFreqTHz, 0, Laser.READ)
-        claim_ghz = self.itla_signed_communicate(Laser.REG_GETFreqGHz, 0, Laser.READ) / 10
+    def clean_jump_words(self, words, detector=None):
+        """Performs a clean jump with precomputed register values (see ``clean_jump_start_words``)
 
-        logging.debug('Claim THz: %d' % claim_thz)
-        logging.debug('Claim GHz %f' % claim_ghz)
+        :return: the laser's claimed frequency in THz after the jump
+        """
+        return self.clean_jump_words_timed(words, detector).claimed_frequency
 
-        claim_freq = claim_thz + claim_ghz / 1000.0
+    def clean_jump_timed(self, freq, detector=None):
+        """Performs a clean jump to the given frequency and returns a ``JumpTiming`` of its phases
 
-        print(('Laser\'s claimed frequency: %f' % claim_freq))
+        :raises ValueError: if the frequency is outside the calibrated range
+        """
+        logging.info('Moving to frequency %f' % freq)
 
-        self.clean_jump_finish()
+        return self.clean_jump_words_timed(self.get_calibration().jump_registers(freq), detector, freq)
+
+    def clean_jump_words_timed(self, words, detector=None, freq=math.nan):
+        """Performs a clean jump with precomputed register values and returns a ``JumpTiming`` of its phases
+
+        Every phase ends as soon as the ``SettleDetector`` sees the laser ready, instead of after a fixed delay.
+
+        :param words: (REG_CjumpTHz, REG_CjumpGHz, REG_CjumpSled, REG_CjumpCurrent) values
+        :param detector: ``SettleDetector`` deciding when each phase is over, or None for the default tolerances
+        :param freq: the target frequency in THz, only used in the returned timing
+        """
+        if detector is None:
+            detector = SettleDetector()
+
+        # Don't start while another operation is pending; the power now is the reference for the recovery
+        _, _, sample = detector.wait_ready(self)
+        power_reference = sample.power
+
+        start = time.perf_counter()
+        try:
+            # Turn on clean mode and set the next frequency, sled temp and current (registers are specific for clean
+            # jump)
+            self.itla_write_many((Laser.REG_Mode,) + Laser.CLEAN_JUMP_REGISTERS, (1,) + tuple(words))
+            _, command_ready, _ = detector.wait_ready(self)
+            command_time = time.perf_counter() - start
+
+            # Tell laser to move frequency, temperature, and current to memory, then calculate both filter temperatures
+            filter_start = time.perf_counter()
+            for stage in ('memory', 'filter 1', 'filter 2'):
+                logging.debug('Jump: %s (%d)' % (stage, self.itla_communicate(Laser.REG_Cjumpon, 1, Laser.WRITE)))
+            _, filter_ready, _ = detector.wait_ready(self)
+            filter_time = time.perf_counter() - filter_start
+
+            # Execute the jump
+            logging.debug('Jump! (%d)' % self.itla_communicate(Laser.REG_Cjumpon, 1, Laser.WRITE))
+            tuning_time, tuned, sample = detector.wait_tuned(self)
+            logging.info('Frequency error: %5.1f GHz' % sample.offset)
+
+            recovery_time, recovered, _ = detector.wait_power(self, power_reference)
+
+            # Read out the laser's claimed frequency
+            claim_thz, claim_ghz = self.read_many([Laser.REG_GetFreqTHz, Laser.REG_GETFreqGHz], [False, True])
+            claim_freq = claim_thz + claim_ghz / 10000.0
+        finally:
+            # Leave clean jump mode even if the jump failed or was interrupted
+            self.clean_jump_finish()
+
+        settled = command_ready and filter_ready and tuned and recovered
+        timing = JumpTiming(frequency=freq, command=command_time, filter_calc=filter_time, tuning=tuning_time,
+                            power_recovery=recovery_time, total=time.perf_counter() - start, settled=settled,
+                            claimed_frequency=claim_freq)
+        logging.info('Jump timing: %s' % (timing,))
+
+        return timing
 
     def clean_sweep_prep(self, sweep_ghz, sweep_speed):
         """Sets up clean sweep for the laser at the given range and speed"""
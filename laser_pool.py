@@ -0,0 +1,147 @@
+"""
+Control several PPCL550 lasers from one process.
+
+Every ``Laser`` already owns its own serial port and command scheduler, so commands to different lasers never wait
+for each other. ``LaserPool`` opens the lasers in parallel, fans commands out to all of them and gathers telemetry
+into one time-aligned stream.
+
+Example::
+
+    pool = LaserPool({'a': 'COM12', 'b': 'COM13'}, baud=115200)
+    pool.run('laser_on', 195)
+    pool.jump_all({'a': 193.1, 'b': 194.2})
+    for record in pool.telemetry_stream(interval=0.1, count=10):
+        print(record.time, record.readings['a'].frequency)
+    pool.close()
+"""
+
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Dict
+
+from laser import Laser, Telemetry
+
+
+class PoolTelemetry(NamedTuple):
+    """Telemetry of every laser in a pool, requested at the same moment"""
+    time: float  # time.perf_counter() when the reads were queued
+    readings: Dict[str, Telemetry]  # Laser name -> snapshot. Each snapshot has its own completion time.
+    errors: Dict[str, Exception]  # Laser name -> exception, for lasers that could not be read
+
+
+class LaserPool:
+    """A set of named lasers that can be commanded in parallel"""
+
+    def __init__(self, ports, baud=None, serial_class=None, log_level=logging.WARNING, calibration=None):
+        """Opens all the lasers in parallel.
+
+        :param ports: dict of laser name -> serial port, or a list of ports (each port is also its name)
+        :param baud: baud rate to try first for every laser
+        :param serial_class: passed on to ``Laser``
+        :param log_level: passed on to ``Laser``
+        :param calibration: optional dict of laser name -> (sled file name, map file name)
+        """
+        if not isinstance(ports, dict):
+            ports = {port: port for port in ports}
+        if calibration is None:
+            calibration = {}
+
+        self.ports = dict(ports)
+        self.lasers = {}
+        # One thread per laser, used for blocking multi-command operations like clean_jump
+        self.executor = ThreadPoolExecutor(max_workers=max(len(ports), 1), thread_name_prefix='laser-pool')
+
+        futures = {}
+        for name, port in self.ports.items():
+            sled_file_name, map_file_name = calibration.get(name, (None, None))
+            futures[name] = self.executor.submit(Laser, port, baud, log_level, serial_class, sled_file_name,
+                                                 map_file_name)
+        for name, future in futures.items():
+            self.lasers[name] = future.result()
+
+    def __getitem__(self, name):
+        return self.lasers[name]
+
+    def __iter__(self):
+        return iter(self.lasers)
+
+    def __len__(self):
+        return len(self.lasers)
+
+    def map(self, func, names=None):
+        """Calls ``func(laser)`` for each laser in parallel and returns a dict of laser name -> result
+
+        :param func: callable taking a ``Laser``
+        :param names: laser names to use, or None for all of them
+        """
+        if names is None:
+            names = list(self.lasers)
+        futures = {name: self.executor.submit(func, self.lasers[name]) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def run(self, method, *args, **kwargs):
+        """Calls the named ``Laser`` method with the same arguments on every laser in parallel"""
+        return self.map(lambda laser: getattr(laser, method)(*args, **kwargs))
+
+    def jump_all(self, frequencies):
+        """Clean jumps each laser to its own frequency in parallel
+
+        :param frequencies: dict of laser name -> frequency in THz
+        """
+        futures = {name: self.executor.submit(self.lasers[name].clean_jump, freq)
+                   for name, freq in frequencies.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def send_all(self, register, data):
+        """Writes the same register value on every laser. The writes are queued on all ports before any response is
+        awaited, so the total time is that of the slowest laser."""
+        futures = {name: laser.itla_submit(register, data, Laser.WRITE) for name, laser in self.lasers.items()}
+        return {name: future.result()[0] for name, future in futures.items()}
+
+    def read_all(self, registers):
+        """Reads the same registers on every laser with one pipelined batch per port
+
+        :return: dict of laser name -> list of unsigned register values
+        """
+        futures = {name: laser.itla_submit_many(registers) for name, laser in self.lasers.items()}
+        return {name: [response for response, _ in future.result()] for name, future in futures.items()}
+
+    def snapshot(self):
+        """Requests a telemetry snapshot from every laser at the same moment"""
+        request_time = time.perf_counter()
+        futures = {name: laser.itla_submit_many(Laser.SNAPSHOT_REGISTERS) for name, laser in self.lasers.items()}
+        readings = {}
+        errors = {}
+        for name, future in futures.items():
+            try:
+                responses = [response for response, _ in future.result()]
+                readings[name] = Laser.make_telemetry(responses, time.perf_counter())
+            except Exception as e:
+                errors[name] = e
+        return PoolTelemetry(time=request_time, readings=readings, errors=errors)
+
+    def telemetry_stream(self, interval=0.01, count=None, stop_event=None):
+        """Yields a ``PoolTelemetry`` record every ``interval`` seconds
+
+        :param interval: time between the starts of consecutive snapshots
+        :param count: number of records to yield, or None for no limit
+        :param stop_event: optional ``threading.Event`` that ends the stream when set
+        """
+        next_time = time.perf_counter()
+        produced = 0
+        while (count is None or produced < count) and not (stop_event and stop_event.is_set()):
+            yield self.snapshot()
+            produced += 1
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.perf_counter()
+
+    def close(self):
+        """Disconnects every laser"""
+        for laser in self.lasers.values():
+            laser.itla_disconnect()
+        self.executor.shutdown()
@@ -0,0 +1,47 @@
+"""
+Benchmark of aggregate command throughput of a ``LaserPool`` as the number of lasers grows.
+
+Each simulated laser has its own port and command scheduler, so the aggregate rate should scale with the number of
+lasers until the process runs out of CPU.
+
+Usage: python laser_pool_benchmark.py [duration per measurement in seconds] [baud]
+"""
+
+import sys
+import time
+
+from itla_simulator import SimulatedSerial
+from laser import Laser
+from laser_pool import LaserPool
+
+POOL_SIZES = (1, 2, 4, 8)
+
+
+def commands_per_second(pool, duration):
+    """Runs pipelined snapshots on every laser for the given duration and returns total register reads per second"""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        record = pool.snapshot()
+        count += len(record.readings) * len(Laser.SNAPSHOT_REGISTERS)
+    return count / (time.perf_counter() - start)
+
+
+def run(duration=1.0, baud=115200):
+    print('%8s %14s %14s %10s' % ('lasers', 'commands/s', 'per laser/s', 'scaling'))
+    single_rate = None
+    for size in POOL_SIZES:
+        ports = ['POOL%d_%d' % (size, i) for i in range(size)]
+        for port in ports:
+            SimulatedSerial.add_device(port, baud=baud)
+        pool = LaserPool(ports, baud, serial_class=SimulatedSerial)
+
+        rate = commands_per_second(pool, duration)
+        if single_rate is None:
+            single_rate = rate
+        print('%8d %14.0f %14.0f %9.2fx' % (size, rate, rate / size, rate / single_rate))
+        pool.close()
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0, int(sys.argv[2]) if len(sys.argv) > 2 else 115200)
@@ -0,0 +1,254 @@
+"""
+Online detection of resonances (transmission dips) during mode-finder scans.
+
+``ModeDetector.add_segment`` takes the samples of one finished sweep segment, so its cost only depends on the size of
+that segment. It does the following:
+
+1. Averages the samples into bins of ``BIN_WIDTH`` GHz.
+2. Tracks the baseline transmission with a rolling median over ``BASELINE_WIDTH`` GHz.
+3. Finds the dips whose prominence, as a fraction of the baseline, is at least ``MIN_PROMINENCE``, and measures their
+   full width at half maximum.
+4. Fits a Lorentzian to the raw samples around each dip.
+
+The modes go into a ``ModeTable`` sorted by frequency. A mode seen again in the overlap of two segments is kept once,
+with the better fit. ``ModeTable.fsr`` estimates the free spectral range from the mode spacing.
+"""
+
+import csv
+import logging
+from typing import NamedTuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+class Mode(NamedTuple):
+    """A transmission dip"""
+    frequency: float  # Center of the Lorentzian fit, or of the lowest bin if the fit failed, in THz
+    prominence: float  # Depth of the dip as a fraction of the baseline
+    width: float  # Full width at half maximum in GHz
+    baseline: float  # Transmission around the dip
+    fit_error: float  # RMS residual of the Lorentzian fit as a fraction of the baseline, or nan if it failed
+    segment: int  # Index of the segment the dip was found in
+
+
+class ModeTable:
+    """Modes sorted by frequency, with range queries and free spectral range estimation"""
+    FSR_TOLERANCE = 0.2  # Fraction of the FSR a mode may be off the fitted grid and still be counted on it
+    FSR_ITERATIONS = 3
+
+    def __init__(self):
+        self.frequencies = np.empty(0)
+        self.modes = []
+
+    def __len__(self):
+        return len(self.modes)
+
+    def __iter__(self):
+        return iter(self.modes)
+
+    def nearest(self, frequency):
+        """Returns the index of the mode closest to ``frequency`` THz, or None if the table is empty"""
+        if not self.modes:
+            return None
+        index = np.searchsorted(self.frequencies, frequency)
+        candidates = [i for i in (index - 1, index) if 0 <= i < len(self.modes)]
+        return min(candidates, key=lambda i: abs(self.frequencies[i] - frequency))
+
+    def between(self, low, high):
+        """Returns the modes from ``low`` to ``high`` THz"""
+        start, end = np.searchsorted(self.frequencies, (low, high), side='left')
+        return self.modes[start:end]
+
+    def add(self, mode, merge_distance):
+        """Adds a mode, or replaces the one within ``merge_distance`` GHz of it if the new fit is better
+
+        :return: True if the mode is new
+        """
+        index = self.nearest(mode.frequency)
+        if index is not None and abs(self.frequencies[index] - mode.frequency) * 1000 <= merge_distance:
+            old = self.modes[index]
+            if ModeTable._quality(mode) < ModeTable._quality(old):
+                self._remove(index)
+                self._insert(mode)
+            return False
+        self._insert(mode)
+        return True
+
+    @staticmethod
+    def _quality(mode):
+        """Lower is better: fitted modes by fit error, then unfitted ones"""
+        return (np.isnan(mode.fit_error), mode.fit_error)
+
+    def _insert(self, mode):
+        index = int(np.searchsorted(self.frequencies, mode.frequency))
+        self.frequencies = np.insert(self.frequencies, index, mode.frequency)
+        self.modes.insert(index, mode)
+
+    def _remove(self, index):
+        self.frequencies = np.delete(self.frequencies, index)
+        del self.modes[index]
+
+    def fsr(self):
+        """Estimates the free spectral range from the modes that lie on a regular grid
+
+        :return: (FSR in GHz, its standard error in GHz, number of modes on the grid), or None with fewer than 3 modes
+        """
+        if len(self.modes) < 3:
+            return None
+        frequencies = self.frequencies * 1000
+        spacing = np.median(np.diff(frequencies))
+        for _ in range(ModeTable.FSR_ITERATIONS):
+            mode_numbers = np.round((frequencies - frequencies[0]) / spacing)
+            residuals = frequencies - frequencies[0] - mode_numbers * spacing
+            on_grid = np.abs(residuals - np.median(residuals)) <= ModeTable.FSR_TOLERANCE * spacing
+            if np.unique(mode_numbers[on_grid]).size < 2:
+                return None
+            coefficients = np.polyfit(mode_numbers[on_grid], frequencies[on_grid], 1)
+            spacing = coefficients[0]
+
+        count = int(np.count_nonzero(on_grid))
+        if count < 3:
+            return spacing, np.nan, count
+        mode_numbers = mode_numbers[on_grid]
+        residuals = frequencies[on_grid] - np.polyval(coefficients, mode_numbers)
+        spread = np.sum((mode_numbers - mode_numbers.mean()) ** 2)
+        return spacing, float(np.sqrt(np.sum(residuals ** 2) / (count - 2) / spread)), count
+
+    def save_csv(self, file_name):
+        """Writes the modes to a CSV file with a header"""
+        with open(file_name, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(Mode._fields)
+            writer.writerows(self.modes)
+
+
+class ModeDetector:
+    """Finds transmission dips in each finished scan segment and collects them in a ``ModeTable``"""
+    BIN_WIDTH = 0.05  # GHz
+    BASELINE_WIDTH = 2  # GHz, width of the rolling median used as the baseline; must be wider than the dips
+    MIN_PROMINENCE = 0.1  # Fraction of the baseline a dip must reach below it
+    FIT_HALF_WIDTHS = 3  # Samples within this many half widths of a dip are used for its fit
+    MERGE_DISTANCE = 0.5  # GHz; dips closer than this in overlapping segments are the same mode
+
+    def __init__(self, min_prominence=MIN_PROMINENCE, bin_width=BIN_WIDTH, baseline_width=BASELINE_WIDTH,
+                 callback=None):
+        """
+        :param min_prominence: fraction of the baseline a dip must reach below it
+        :param bin_width: GHz of samples averaged together before looking for dips
+        :param baseline_width: GHz of the rolling median used as the baseline
+        :param callback: optional function called with each new ``Mode``
+        """
+        self.min_prominence = min_prominence
+        self.bin_width = bin_width
+        self.baseline_width = baseline_width
+        self.callback = callback
+        self.table = ModeTable()
+
+    def add_segment(self, frequencies, transmissions, index=-1):
+        """Finds the dips in one segment's samples and adds them to the table
+
+        :param frequencies: THz
+        :param transmissions: transmission of each sample in any unit
+        :param index: index of the segment, stored with its modes
+        :return: the modes that were not in the table yet
+        """
+        frequencies = np.asarray(frequencies, dtype=float)
+        transmissions = np.asarray(transmissions, dtype=float)
+        order = np.argsort(frequencies)
+        frequencies, transmissions = frequencies[order], transmissions[order]
+
+        centers, binned = self._bin(frequencies, transmissions)
+        window = int(round(self.baseline_width / self.bin_width)) | 1
+        if binned.size < window:
+            return []
+        baseline = self._baseline(binned, window)
+        depth = 1 - binned / baseline
+
+        new_modes = []
+        for low, high in ModeDetector._runs(depth > self.min_prominence / 2):
+            lowest = low + int(np.argmax(depth[low:high]))
+            prominence = depth[lowest]
+            if prominence < self.min_prominence:
+                continue
+            width = self._width(centers, depth, lowest, prominence)
+            mode = self._fit(frequencies, transmissions, centers[lowest], width, baseline[lowest], prominence, index)
+            if self.table.add(mode, max(ModeDetector.MERGE_DISTANCE, mode.width)):
+                new_modes.append(mode)
+                logging.info('Mode at %.5f THz: %.0f%% deep, %.3f GHz wide' %
+                             (mode.frequency, 100 * mode.prominence, mode.width))
+                if self.callback:
+                    self.callback(mode)
+        return new_modes
+
+    def _bin(self, frequencies, transmissions):
+        """Averages sorted samples into bins of ``bin_width`` GHz; returns the bin centers in THz and the means"""
+        if frequencies.size == 0:
+            return np.empty(0), np.empty(0)
+        width = self.bin_width / 1000
+        bins = np.floor((frequencies - frequencies[0]) / width).astype(np.int64)
+        starts = np.flatnonzero(np.diff(bins, prepend=-1))
+        counts = np.diff(np.append(starts, bins.size))
+        means = np.add.reduceat(transmissions, starts) / counts
+        return frequencies[0] + (bins[starts] + 0.5) * width, means
+
+    @staticmethod
+    def _baseline(binned, window):
+        """Rolling median of the bins, with the edge bins using the nearest full window"""
+        medians = np.median(sliding_window_view(binned, window), axis=1)
+        return np.pad(medians, (window // 2, window // 2), mode='edge')
+
+    @staticmethod
+    def _runs(mask):
+        """Returns (start, end) of each run of True values"""
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], mask, [False])).astype(np.int8)))
+        return list(zip(edges[::2], edges[1::2]))
+
+    @staticmethod
+    def _width(centers, depth, lowest, prominence):
+        """Full width at half maximum of a dip in GHz, interpolated between bins"""
+        half = prominence / 2
+
+        def crossing(step):
+            i = lowest
+            while 0 <= i + step < depth.size and depth[i + step] > half:
+                i += step
+            if not 0 <= i + step < depth.size:
+                return centers[i]
+            # Linear interpolation between the last bin above half depth and the first one below
+            fraction = (depth[i] - half) / (depth[i] - depth[i + step])
+            return centers[i] + fraction * (centers[i + step] - centers[i])
+
+        return (crossing(1) - crossing(-1)) * 1000
+
+    def _fit(self, frequencies, transmissions, center, width, baseline, prominence, index):
+        """Fits a Lorentzian dip to the samples around ``center``
+
+        The normalized depth d = A / (1 + ((f - f0) / w)^2) of a Lorentzian has 1 / d = (1 + ((f - f0) / w)^2) / A,
+        a parabola in f, so it is fitted with a weighted linear least squares instead of an iterative fit.
+        """
+        half_width = max(width, self.bin_width) / 2000
+        start, end = np.searchsorted(frequencies, (center - ModeDetector.FIT_HALF_WIDTHS * half_width,
+                                                   center + ModeDetector.FIT_HALF_WIDTHS * half_width))
+        f = frequencies[start:end] - center
+        depth = 1 - transmissions[start:end] / baseline
+        use = depth > 0.2 * prominence
+        fallback = Mode(center, prominence, width, baseline, np.nan, index)
+        if np.count_nonzero(use) < 4:
+            return fallback
+
+        # Weighting by depth^2 undoes the amplification of noise in the tails by taking 1 / d
+        a, b, c = np.polyfit(f[use], 1 / depth[use], 2, w=depth[use] ** 2)
+        if a <= 0:
+            return fallback
+        f0 = -b / (2 * a)
+        inverse_amplitude = c - a * f0 ** 2
+        if inverse_amplitude <= 0 or abs(f0) > ModeDetector.FIT_HALF_WIDTHS * half_width:
+            return fallback
+        amplitude = 1 / inverse_amplitude
+        fit_half_width = np.sqrt(inverse_amplitude / a)
+
+        model = amplitude / (1 + ((f - f0) / fit_half_width) ** 2)
+        error = float(np.sqrt(np.mean((depth - model) ** 2)))
+        return Mode(float(center + f0), float(min(amplitude, 1.0)), float(2 * fit_half_width * 1000), baseline, error,
+                    index)
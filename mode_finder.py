@@ -0,0 +1,252 @@
+"""
+Pipelined mode-finder scans.
+
+A mode-finder scan covers a frequency range with clean sweeps: for each segment of a ``ScanPlan`` the laser clean
+jumps to the segment's center, sweeps up past +``window`` and down past -``window`` GHz around it while the
+transmission is recorded, and stops the sweep. ``ModeFinderScan`` moves on to the next step as soon as the laser is
+ready instead of after fixed sleeps. Jumps end when the ``SettleDetector`` sees the laser tuned and the power back.
+Sweeps end when the offset crosses the thresholds, as reported to ``offset_changed``. Finished segments go to a
+``SegmentPipeline``, whose worker thread reduces and stores them while the laser jumps to the next segment.
+``ScanThroughput`` tracks the THz per hour the scan achieves.
+"""
+
+import time
+import logging
+from queue import Queue
+from threading import Event, Thread
+from typing import NamedTuple
+
+import numpy as np
+
+from settle import JumpTiming
+from scan_planner import ScanPlan
+
+
+class SegmentTiming(NamedTuple):
+    """Time spent on each step of a segment, in seconds"""
+    jump: JumpTiming  # The clean jump to the segment's center
+    sweep_start: float  # Starting the clean sweep
+    sweep: float  # Sweeping until the offset passed both edges of the window
+    sweep_stop: float  # Stopping the sweep until the laser was ready
+    total: float
+    finished: bool  # False if the sweep timed out or the scan was stopped
+
+
+class Segment(NamedTuple):
+    """The samples recorded during one clean sweep"""
+    index: int
+    center: float  # Target frequency of the jump in THz
+    frequencies: np.ndarray  # THz
+    transmissions: np.ndarray
+    timing: SegmentTiming
+
+
+class SweepTracker:
+    """Follows a clean sweep's offset up past +threshold, down past -threshold and optionally back up to -end"""
+    RISING, FALLING, RETURNING, DONE = range(4)
+
+    def __init__(self, threshold, end=None):
+        """
+        :param threshold: GHz the offset must pass on either side of the center
+        :param end: if set, the sweep is only done when the offset comes back up to -end GHz after passing -threshold
+        """
+        self.threshold = threshold
+        self.end = end
+        self.done = Event()
+        self.reset()
+
+    def reset(self):
+        self.phase = SweepTracker.RISING
+        self.last_update = time.perf_counter()
+        self.done.clear()
+
+    def update(self, offset):
+        """Takes a new offset reading in GHz; may be called from any thread"""
+        self.last_update = time.perf_counter()
+        if self.phase == SweepTracker.RISING and offset >= self.threshold:
+            self.phase = SweepTracker.FALLING
+        elif self.phase == SweepTracker.FALLING and offset <= -self.threshold:
+            self.phase = SweepTracker.RETURNING
+            if self.end is None:
+                self.phase = SweepTracker.DONE
+                self.done.set()
+        elif self.phase == SweepTracker.RETURNING and offset >= -self.end:
+            self.phase = SweepTracker.DONE
+            self.done.set()
+
+
+class SegmentPipeline:
+    """Runs the reduction and storage stages on finished segments, in order, in a worker thread"""
+
+    def __init__(self, stages=()):
+        """
+        :param stages: functions called with each ``Segment``; an exception in one is logged and the others still run
+        """
+        self.stages = list(stages)
+        self.queue = Queue()
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, segment):
+        self.queue.put(segment)
+
+    def close(self):
+        """Waits for the submitted segments to be processed and stops the worker thread"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            segment = self.queue.get()
+            if segment is None:
+                return
+            for stage in self.stages:
+                try:
+                    stage(segment)
+                except Exception:
+                    logging.exception('Segment %d: %s failed' % (segment.index, stage))
+
+
+class ScanThroughput:
+    """Frequency range measured so far and the rate it was measured at"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.segments = 0
+        self.min_frequency = np.inf
+        self.max_frequency = -np.inf
+
+    def add(self, segment):
+        self.segments += 1
+        if segment.frequencies.size:
+            self.min_frequency = min(self.min_frequency, segment.frequencies.min())
+            self.max_frequency = max(self.max_frequency, segment.frequencies.max())
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @property
+    def covered(self):
+        """THz between the lowest and highest frequency measured"""
+        return max(self.max_frequency - self.min_frequency, 0.0)
+
+    @property
+    def thz_per_hour(self):
+        return self.covered / self.elapsed * 3600
+
+    def __str__(self):
+        return '%d segments, %.3f THz in %.0f s (%.2f THz/h)' % (self.segments, self.covered, self.elapsed,
+                                                                  self.thz_per_hour)
+
+
+class ModeFinderScan:
+    """Jumps to each segment of a plan and clean sweeps around it, moving on as soon as the laser is ready"""
+    SWEEP_TIMEOUT_MARGIN = 5  # Seconds allowed beyond the expected sweep time
+    STALE_OFFSET = 0.5  # Seconds without an offset update before the scan reads the offset itself
+    WAIT_INTERVAL = 0.05  # Seconds between checks of the stop event while sweeping
+
+    def __init__(self, laser, lock, plan, detector=None):
+        """
+        :param laser: a connected ``Laser``
+        :param lock: lock held for every command to the laser
+        :param plan: ``ScanPlan`` of the segments, from ``ScanPlanner``
+        :param detector: ``SettleDetector`` for the jumps, or None for the default tolerances
+        """
+        self.laser = laser
+        self.lock = lock
+        self.plan = plan
+        self.detector = detector
+        self.tracker = SweepTracker(0)
+
+    def offset_changed(self, offset):
+        """Takes a clean sweep offset reading in GHz, e.g. from the thread that records the transmission"""
+        self.tracker.update(offset)
+
+    @staticmethod
+    def sweep_timeout(segment):
+        """Seconds one segment's sweep should take, with a margin"""
+        sweeping = ScanPlan.sweep_distance(segment.amplitude, segment.window) / segment.speed
+        return 1.5 * sweeping + ModeFinderScan.SWEEP_TIMEOUT_MARGIN
+
+    def run(self, take_data, stop, mark, samples, pipeline, started=None, progress=None):
+        """Runs the scan until the plan is done or ``stop`` is set
+
+        :param take_data: ``Event`` set while the transmission should be recorded
+        :param stop: ``Event`` that ends the scan early
+        :param mark: function returning the number of samples recorded so far
+        :param samples: function (start, end) returning copies of the (frequencies, transmissions) recorded between
+            two marks
+        :param pipeline: ``SegmentPipeline`` each finished segment is submitted to
+        :param started: optional function called with each ``ScanSegment`` and the ``JumpTiming`` of its jump,
+            before its sweep starts
+        :param progress: optional function (segments done, ``ScanThroughput``) called after each segment
+        :return: the ``ScanThroughput`` of the scan
+        """
+        throughput = ScanThroughput()
+        sweep_settings = None
+
+        for index, plan_segment in enumerate(self.plan):
+            if stop.is_set():
+                break
+            start = time.perf_counter()
+            center = plan_segment.center
+
+            with self.lock:
+                jump = self.laser.clean_jump_words_timed(plan_segment.words, self.detector, center)
+            if started:
+                started(plan_segment, jump)
+
+            sweep_start = time.perf_counter()
+            self.tracker = SweepTracker(plan_segment.window)
+            with self.lock:
+                # The sweep registers keep their values, so they are only written when they change
+                if sweep_settings != (plan_segment.amplitude, plan_segment.speed):
+                    sweep_settings = (plan_segment.amplitude, plan_segment.speed)
+                    self.laser.clean_sweep_prep(plan_segment.amplitude, int(plan_segment.speed * 1000))
+                self.laser.clean_sweep_start()
+            first = mark()
+            take_data.set()
+
+            sweep = time.perf_counter()
+            finished = self.wait_sweep(stop, ModeFinderScan.sweep_timeout(plan_segment))
+
+            take_data.clear()
+            last = mark()
+            sweep_stop = time.perf_counter()
+            with self.lock:
+                self.laser.clean_sweep_stop()
+            end = time.perf_counter()
+
+            timing = SegmentTiming(jump=jump, sweep_start=sweep - sweep_start, sweep=sweep_stop - sweep,
+                                   sweep_stop=end - sweep_stop, total=end - start, finished=finished)
+            logging.info('Segment %d at %f THz: %s' % (index, center, timing))
+            segment = Segment(index, center, *samples(first, last), timing)
+            pipeline.submit(segment)
+
+            throughput.add(segment)
+            if progress:
+                progress(index + 1, throughput)
+
+        logging.info('Mode finder scan: %s' % throughput)
+        return throughput
+
+    def wait_sweep(self, stop, timeout):
+        """Waits for the sweep to pass both edges of the window
+
+        The offset normally comes from ``offset_changed``; if it has not been updated recently, it is read here.
+
+        :return: True if the sweep finished, False if it timed out or ``stop`` was set
+        """
+        deadline = time.perf_counter() + timeout
+        while not self.tracker.done.wait(ModeFinderScan.WAIT_INTERVAL):
+            if stop.is_set():
+                return False
+            now = time.perf_counter()
+            if now > deadline:
+                logging.warning('Clean sweep did not finish within %.0f s' % timeout)
+                return False
+            if now - self.tracker.last_update > ModeFinderScan.STALE_OFFSET:
+                with self.lock:
+                    self.tracker.update(self.laser.offset())
+        return True
@@ -0,0 +1,127 @@
+"""
+Level-of-detail series for live plots.
+
+A plot a few hundred pixels wide cannot show more than a minimum and a maximum per pixel column, so plotting millions
+of scan samples only costs time. ``MinMaxDecimator`` keeps the minimum and maximum y value of each of a fixed number
+of x bins, updated incrementally as samples arrive, and returns at most two points per bin to plot. The bins either
+cover all the data (doubling their width when new samples fall outside), or a sliding window of the newest x values.
+"""
+
+import numpy as np
+
+
+def decimate(x, y, bins):
+    """Returns (x, y) with the minimum and maximum y of each of ``bins`` equal x ranges, for one-off plots"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if x.size <= 2 * bins:
+        return x, y
+    decimator = MinMaxDecimator(bins)
+    decimator.add(x, y)
+    return decimator.points()
+
+
+class MinMaxDecimator:
+    """Minimum and maximum y per x bin, updated in O(new samples)"""
+
+    def __init__(self, bins, window=None):
+        """
+        :param bins: number of x bins, about the width of the plot in pixels
+        :param window: if set, only keep the newest ``window`` x units (e.g. seconds); otherwise keep everything
+        """
+        self.bins = bins
+        self.window = window
+        self.clear()
+
+    def clear(self):
+        self._width = None if self.window is None else self.window / self.bins
+        self._first_bin = 0  # Absolute index (x // width) of the first bin
+        self._min = np.full(self.bins, np.inf)
+        self._max = np.full(self.bins, -np.inf)
+
+    def __len__(self):
+        """Number of non-empty bins"""
+        return int(np.count_nonzero(self._min <= self._max))
+
+    def add(self, x, y):
+        """Adds samples to the bins"""
+        x = np.asarray(x, dtype=float).ravel()
+        y = np.asarray(y, dtype=float).ravel()
+        if x.size == 0:
+            return
+
+        if self._width is None:
+            span = x.max() - x.min()
+            self._width = span / self.bins if span > 0 else max(abs(x[0]), 1.0) * 1e-9
+            self._first_bin = int(np.floor(x.min() / self._width))
+
+        if self.window is None:
+            self._fit(x.min(), x.max())
+            slots = np.floor(x / self._width).astype(np.int64) - self._first_bin
+        else:
+            self._slide(int(np.floor(x.max() / self._width)))
+            index = np.floor(x / self._width).astype(np.int64)
+            keep = index >= self._first_bin
+            x, y, index = x[keep], y[keep], index[keep]
+            slots = index % self.bins
+
+        np.minimum.at(self._min, slots, y)
+        np.maximum.at(self._max, slots, y)
+
+    def _fit(self, x_min, x_max):
+        """Doubles the bin width until the bins cover x_min to x_max, merging neighbouring bins"""
+        low = int(np.floor(x_min / self._width))
+        high = int(np.floor(x_max / self._width))
+        low = min(low, self._first_bin + self._occupied(np.argmax))
+        high = max(high, self._first_bin + self._occupied(lambda used: len(used) - 1 - np.argmax(used[::-1])))
+        if low >= self._first_bin and high < self._first_bin + self.bins:
+            return
+
+        used = np.flatnonzero(self._min <= self._max)
+        index = used + self._first_bin
+        mins, maxs = self._min[used], self._max[used]
+        while high - low >= self.bins:
+            self._width *= 2
+            low, high, index = low // 2, high // 2, index // 2
+
+        self._first_bin = low
+        self._min.fill(np.inf)
+        self._max.fill(-np.inf)
+        np.minimum.at(self._min, index - low, mins)
+        np.maximum.at(self._max, index - low, maxs)
+
+    def _occupied(self, pick):
+        """Applies ``pick`` to the mask of non-empty bins, or returns 0 if all bins are empty"""
+        used = self._min <= self._max
+        return int(pick(used)) if used.any() else 0
+
+    def _slide(self, last_bin):
+        """Moves the window so it ends at ``last_bin``, emptying the bins that fall out of it"""
+        first_bin = last_bin - self.bins + 1
+        if first_bin <= self._first_bin:
+            return
+        if first_bin - self._first_bin >= self.bins:
+            self._min.fill(np.inf)
+            self._max.fill(-np.inf)
+        else:
+            expired = np.arange(self._first_bin, first_bin) % self.bins
+            self._min[expired] = np.inf
+            self._max[expired] = -np.inf
+        self._first_bin = first_bin
+
+    def points(self):
+        """Returns (x, y) arrays with the minimum and maximum of each non-empty bin, in x order"""
+        if self._width is None:
+            return np.empty(0), np.empty(0)
+        index = np.arange(self._first_bin, self._first_bin + self.bins)
+        slots = index - self._first_bin if self.window is None else index % self.bins
+        used = self._min[slots] <= self._max[slots]
+        x = (index[used] + 0.5) * self._width
+        return np.repeat(x, 2), np.column_stack((self._min[slots][used], self._max[slots][used])).ravel()
+
+    def y_range(self):
+        """Returns (min, max) of all y values in the bins, or None if they are empty"""
+        used = self._min <= self._max
+        if not used.any():
+            return None
+        return self._min[used].min(), self._max[used].max()
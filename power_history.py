@@ -0,0 +1,135 @@
+"""
+Bounded history of the laser output power.
+
+``PowerHistory`` keeps the raw power readings of the last ``retention`` seconds in a ring buffer, and aggregates
+(mean, minimum, maximum per interval) over longer periods in downsampled tiers, by default every second for a day
+and every minute for a month. Memory use is fixed when the history is created, however long the GUI runs.
+"""
+
+import time
+from typing import NamedTuple
+
+import numpy as np
+
+from sample_buffer import SampleBuffer
+
+
+class Tier(NamedTuple):
+    interval: float  # Seconds aggregated into one row
+    retention: float  # Seconds of rows kept
+
+
+class AggregateTier:
+    """Mean, minimum and maximum of the samples in each fixed interval, in a ring buffer of rows"""
+    COLUMNS = ('t', 'mean', 'min', 'max')
+
+    def __init__(self, interval, retention):
+        """
+        :param interval: seconds aggregated into one row
+        :param retention: seconds of rows kept
+        """
+        self.interval = interval
+        self.retention = retention
+        self.rows = SampleBuffer(AggregateTier.COLUMNS, max_size=max(int(np.ceil(retention / interval)), 1))
+        self._bucket = None  # Index (t // interval) of the interval being accumulated
+        self._sum = 0.0
+        self._count = 0
+        self._min = np.inf
+        self._max = -np.inf
+
+    def append_block(self, times, values):
+        """Adds samples, which must not be older than the ones already added"""
+        times = np.asarray(times, dtype=float)
+        values = np.asarray(values, dtype=float)
+        if times.size == 0:
+            return
+        buckets = np.floor(times / self.interval).astype(np.int64)
+
+        # Split the block into runs of samples in the same interval; every run but the last completes its interval
+        starts = np.flatnonzero(np.diff(buckets)) + 1
+        starts = np.concatenate(([0], starts))
+        sums = np.add.reduceat(values, starts)
+        mins = np.minimum.reduceat(values, starts)
+        maxs = np.maximum.reduceat(values, starts)
+        counts = np.diff(np.append(starts, len(values)))
+
+        for bucket, total, low, high, count in zip(buckets[starts], sums, mins, maxs, counts):
+            if bucket != self._bucket:
+                self._finish()
+                self._bucket = bucket
+            self._sum += total
+            self._count += count
+            self._min = min(self._min, low)
+            self._max = max(self._max, high)
+
+    def _finish(self):
+        """Moves the interval being accumulated into the rows"""
+        if self._count:
+            self.rows.append((self._bucket + 0.5) * self.interval, self._sum / self._count, self._min, self._max)
+        self._sum = 0.0
+        self._count = 0
+        self._min = np.inf
+        self._max = -np.inf
+
+    def views(self):
+        """Returns a dict of column name -> array of the completed rows, oldest first"""
+        return self.rows.views()
+
+
+class PowerHistory:
+    """Raw power readings for a limited time, plus downsampled aggregates over longer periods"""
+    RETENTION = 600  # Seconds of raw readings kept
+    MAX_RATE = 50  # Raw readings per second the buffer is sized for
+    TIERS = (Tier(1, 24 * 3600), Tier(60, 30 * 24 * 3600))
+
+    def __init__(self, retention=RETENTION, max_rate=MAX_RATE, tiers=TIERS):
+        """
+        :param retention: seconds of raw readings kept
+        :param max_rate: highest expected readings per second; at higher rates less than ``retention`` is kept
+        :param tiers: ``Tier`` (interval, retention) of each downsampled tier, in seconds
+        """
+        self.retention = retention
+        self.raw = SampleBuffer(('t', 'p'), max_size=int(retention * max_rate))
+        self.tiers = [AggregateTier(*tier) for tier in tiers]
+        # Timestamps are time.perf_counter() values; this converts them to time.time() for export
+        self.clock_offset = time.time() - time.perf_counter()
+
+    def __len__(self):
+        return len(self.raw)
+
+    def append(self, t, power):
+        """Adds one reading
+
+        :param t: time.perf_counter() of the reading
+        :param power: power in any unit
+        """
+        self.append_block([t], [power])
+
+    def append_block(self, times, powers):
+        self.raw.append_block(times, powers)
+        for tier in self.tiers:
+            tier.append_block(times, powers)
+
+    def samples(self, duration=None):
+        """Returns (times, powers) views of the raw readings within the retention, or the last ``duration`` seconds"""
+        times = self.raw['t']
+        if times.size == 0:
+            return times, self.raw['p']
+        duration = self.retention if duration is None else min(duration, self.retention)
+        start = np.searchsorted(times, times[-1] - duration, side='left')
+        return times[start:], self.raw['p'][start:]
+
+    def export_csv(self, file_name, tier=None):
+        """Writes the history to a CSV file with a header and Unix timestamps
+
+        :param tier: index into ``tiers`` to write that tier's aggregates, or None for the raw readings
+        """
+        if tier is None:
+            times, powers = self.samples()
+            header = 'time,power'
+            data = np.column_stack((times + self.clock_offset, powers))
+        else:
+            rows = self.tiers[tier].views()
+            header = ','.join(('time',) + AggregateTier.COLUMNS[1:])
+            data = np.column_stack([rows['t'] + self.clock_offset] + [rows[c] for c in AggregateTier.COLUMNS[1:]])
+        np.savetxt(file_name, data, delimiter=',', header=header, comments='', fmt='%.6f')
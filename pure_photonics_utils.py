@@ -8,7 +8,98 @@ import serial
 import time
 import struct
 import threading
+import json
+import os
+import heapq
+import itertools
+import collections
 import logging
+from concurrent.futures import Future
+
+
+class CommandScheduler:
+    """Serializes access to one serial port through a single I/O worker thread.
+
+    Jobs are queued by priority (lower runs first) and in FIFO order within a priority. Callers wait on the
+    ``Future`` returned by ``submit`` instead of spinning, so threads contending for the port cost no CPU.
+    """
+    PRIORITY_URGENT = 0  # Sweep stop, jumps, enabling/disabling the laser
+    PRIORITY_NORMAL = 1  # Configuration and everything else
+    PRIORITY_TELEMETRY = 2  # Periodic status polls
+
+    def __init__(self, name='itla-io'):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()  # Reentrant, so submit can start the worker while holding it
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        """Starts the I/O worker if it is not running"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Finishes the queued jobs, then stops the I/O worker"""
+        with self._condition:
+            if not self._running:
+                return
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def in_worker(self):
+        """True if called from the I/O worker thread"""
+        return self._thread is threading.current_thread()
+
+    def pending(self):
+        """Number of jobs waiting for the port"""
+        with self._condition:
+            return len(self._heap)
+
+    def submit(self, func, *args, priority=PRIORITY_NORMAL):
+        """Queues ``func(*args)`` to run on the I/O worker.
+
+        :param func: callable that performs the serial transaction
+        :param priority: one of the ``PRIORITY_*`` values; lower values run first
+        :return: a ``concurrent.futures.Future`` holding the result of ``func``
+        """
+        future = Future()
+        if self.in_worker():
+            # Nested call from inside a job: the port is already ours
+            CommandScheduler._execute(future, func, args)
+            return future
+        with self._condition:
+            if not self._running:
+                self.start()
+            heapq.heappush(self._heap, (priority, next(self._counter), future, func, args))
+            self._condition.notify()
+        return future
+
+    @staticmethod
+    def _execute(future, func, args):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._heap and self._running:
+                    self._condition.wait()
+                if not self._heap:
+                    return
+                _, _, future, func, args = heapq.heappop(self._heap)
+            CommandScheduler._execute(future, func, args)
 
 
 class ITLA:
@@ -84,18 +175,58 @@ class ITLA:
     SET_ON = 8  # When enabling laser with REG_ResetEnable, this turns on laser
     SET_OFF = 0  # When disabling laser with REG_ResetEnable, this turns off laser
 
-    def __init__(self, port, baud):
+    RESPONSE_TIMEOUT = 0.25  # Seconds to wait for a response frame before giving up
+    PROBE_TIMEOUT = 0.05  # Seconds to wait for the NOP response when probing a baud rate
+    BAUD_RATES = (4800, 9600, 19200, 38400, 57600, 115200)  # Baud rates tried when detecting the laser's rate
+    IOCAP_BAUD_CODES = {9600: 0, 19200: 1, 38400: 2, 57600: 3, 115200: 4}  # REG_Iocap bits 4-7 for each rate
+    # Last known-good connection settings for each port. Set to None to always sweep the baud rates.
+    PROFILE_FILE = os.path.join(os.path.expanduser('~'), '.itla_profiles.json')
+    _profile_lock = threading.Lock()
+    TIMING_HISTORY = 1000  # Number of frame round trip times kept for frame_timing()
+
+    # Commands that must not wait behind telemetry polls
+    URGENT_REGISTERS = (REG_Csweepon, REG_Csweepstop, REG_Cjumpon, REG_CjumpTHz, REG_CjumpGHz, REG_CjumpSled,
+                        REG_CjumpCurrent, REG_ResetEnable)
+    # Registers that answer with an AEA string rather than a value
+    AEA_REGISTERS = (REG_Mfgr, REG_Model, REG_Serial, REG_Release)
+    # Registers that are polled for status; reads of these go to the back of the queue
+    TELEMETRY_REGISTERS = (REG_Nop, REG_Oop, REG_Offset, REG_FreqTHz, REG_FreqGHz, REG_GetFreqTHz, REG_GETFreqGHz,
+                           REG_Currents, REG_Temps)
+
+    def __init__(self, port, baud, serial_class=None):
+        """Opens a connection to the laser.
+
+        :param port: name of the serial port, e.g. 'COM12'
+        :param baud: baud rate to try first
+        :param serial_class: class used to open the port, ``serial.Serial`` by default. Pass
+            ``itla_simulator.SimulatedSerial`` to talk to a simulated laser instead.
+        """
+        if serial_class is None:
+            serial_class = serial.Serial
+        self.serial_class = serial_class
+
         self.latestregister = 0
         self.tempport = 0
         self.raybin = 0
-        self.queue = []
-        self.maxrowticket = 0
+        self.scheduler = CommandScheduler('itla-io-%s' % port)
 
         self._error = ITLA.NOERROR
+        self._caller = threading.local()  # Error code of the last command issued by each thread
+
+        self._frame = bytearray(4)  # Receive buffer, reused for every response
+        self._frame_view = memoryview(self._frame)
+        self._send_time = 0.0
+        self._resync = False  # Set after a timeout so a late response is discarded before the next command
+        self.round_trip_times = collections.deque(maxlen=ITLA.TIMING_HISTORY)
         self.seriallock = 0
 
         self.port = port
         self.baudrate = baud
+        self.connect_time = None  # Seconds ITLAConnect took to establish communication
+        self.original_baudrate = None  # Baud rate to restore on disconnect after start_high_speed_session
+        self.high_speed_timing = None
+        self.serial_number = None
+        self.release = None
 
         self.sercon = self.ITLAConnect(self.port, self.baudrate)
 
@@ -110,11 +241,11 @@ class ITLA:
         return (outp)
 
     def ITLALastError(self):
-        """Gives the most recent error that has occurred
+        """Gives the error of the most recent command issued by the calling thread
 
         :return: the error code
         """
-        return (self._error)
+        return getattr(self._caller, 'error', self._error)
 
     def SerialLock(self):
         return self.seriallock
@@ -124,7 +255,6 @@ class ITLA:
 
     def SerialLockUnSet(self):
         self.seriallock = 0
-        self.queue.pop(0)
 
     @staticmethod
     def checksum(byte0, byte1, byte2, byte3):
@@ -140,144 +270,379 @@ class ITLA:
         :param byte2: third byte
         :param byte3: fourth byte
         """
-        self.sercon.write(bytearray([byte0, byte1, byte2, byte3]))
+        self._write_frames(bytearray([byte0, byte1, byte2, byte3]))
 
-    def Receive_response(self):
-        reftime = time.clock()
-        while self.sercon.inWaiting() < 4:
-            if time.clock() > reftime + 0.25:
-                self._error = ITLA.NRERROR
-                print('No response')
-                return (0xFF, 0xFF, 0xFF, 0xFF)
-            time.sleep(0.0001)
+    def _write_frames(self, frames):
+        """Writes one or more 4-byte frames to the device in a single write"""
+        if self._resync:
+            self.sercon.reset_input_buffer()
+            self._resync = False
+        self._send_time = time.perf_counter()
+        self.sercon.write(frames)
+
+    def _read_frame(self):
+        """Blocks until a 4-byte frame arrives or the port times out.
+
+        :return: the number of bytes read into ``self._frame``
+        """
         try:
-            byte0 = ord(self.sercon.read(1))
-            byte1 = ord(self.sercon.read(1))
-            byte2 = ord(self.sercon.read(1))
-            byte3 = ord(self.sercon.read(1))
-        except:
-            print('problem with serial communication. self.queue[0] =', self.queue)
-            byte0 = 0xFF
-            byte1 = 0xFF
-            byte2 = 0xFF
-            byte3 = 0xFF
+            count = self.sercon.readinto(self._frame_view)
+        except (serial.SerialException, OSError) as e:
+            logging.error('Problem with serial communication: %s. Commands waiting: %d'
+                          % (e, self.scheduler.pending()))
+            count = 0
+        if count == 4:
+            self.round_trip_times.append(time.perf_counter() - self._send_time)
+        else:
+            self._frame[:] = b'\xff\xff\xff\xff'
+            self._resync = True
+        return count
+
+    def Receive_response(self):
+        """Reads a response frame and checks its checksum.
+
+        :return: the four bytes of the response. The buffer is reused by the next response.
+        """
+        if self._read_frame() < 4:
+            self._error = ITLA.NRERROR
+            print('No response')
+            return self._frame
+        byte0, byte1, byte2, byte3 = self._frame
         if ITLA.checksum(byte0, byte1, byte2, byte3) == byte0 >> 4:
             self._error = byte0 & 0x03
-            return (byte0, byte1, byte2, byte3)
         else:
             self._error = ITLA.CSERROR
-            return byte0, byte1, byte2, byte3
+        return self._frame
 
     def Receive_simple_response(self):
-        reftime = time.clock()
-        while self.sercon.inWaiting() < 4:
-            if time.clock() > reftime + 0.25:
-                self._error = self.NRERROR
-                return (0xFF, 0xFF, 0xFF, 0xFF)
-            time.sleep(0.0001)
-        byte0 = ord(self.sercon.read(1))
-        byte1 = ord(self.sercon.read(1))
-        byte2 = ord(self.sercon.read(1))
-        byte3 = ord(self.sercon.read(1))
-
-        return (byte0, byte1, byte2, byte3)
+        if self._read_frame() < 4:
+            self._error = self.NRERROR
+        return self._frame
+
+    def frame_timing(self):
+        """Statistics of the recent command/response round trips, in seconds
+
+        :return: a dict with the number of frames timed and the last, mean, min and max round trip times
+        """
+        times = list(self.round_trip_times)
+        if not times:
+            return {'count': 0, 'last': None, 'mean': None, 'min': None, 'max': None}
+        return {'count': len(times), 'last': times[-1], 'mean': sum(times) / len(times), 'min': min(times),
+                'max': max(times)}
+
+    def open_serial(self, port, baudrate):
+        """Opens the serial port with the configured serial class"""
+        return self.serial_class(port, baudrate, timeout=ITLA.RESPONSE_TIMEOUT)
+
+    @staticmethod
+    def load_profile(port):
+        """Returns the saved connection profile for a port, or None"""
+        if not ITLA.PROFILE_FILE:
+            return None
+        with ITLA._profile_lock:
+            try:
+                with open(ITLA.PROFILE_FILE) as profile_file:
+                    return json.load(profile_file).get(port)
+            except (OSError, ValueError):
+                return None
+
+    @staticmethod
+    def save_profile(port, profile):
+        """Saves the connection profile for a port, keeping the profiles of other ports"""
+        if not ITLA.PROFILE_FILE:
+            return
+        with ITLA._profile_lock:
+            try:
+                with open(ITLA.PROFILE_FILE) as profile_file:
+                    profiles = json.load(profile_file)
+            except (OSError, ValueError):
+                profiles = {}
+            profiles[port] = profile
+            temp_name = ITLA.PROFILE_FILE + '.tmp'
+            try:
+                with open(temp_name, 'w') as profile_file:
+                    json.dump(profiles, profile_file, indent=2)
+                os.replace(temp_name, ITLA.PROFILE_FILE)
+            except OSError as e:
+                logging.warning('Could not save connection profile: %s' % e)
+
+    def probe(self, timeout=PROBE_TIMEOUT):
+        """Checks whether the laser answers a NOP read at the port's current baud rate"""
+        self.sercon.timeout = timeout
+        try:
+            self.itla_communicate(ITLA.REG_Nop, 0, ITLA.READ)
+        finally:
+            self.sercon.timeout = ITLA.RESPONSE_TIMEOUT
+        return self.ITLALastError() == ITLA.NOERROR
 
     def ITLAConnect(self, port, baudrate=9600):
+        """Opens the port and finds the laser's baud rate.
+
+        The last known-good baud rate saved for the port is tried first, then the requested one, then the rest of
+        BAUD_RATES, each with a short probe timeout. The result is saved for the next connection.
+
+        :return: the serial connection, or ERROR_SERPORT/ERROR_SERBAUD
+        """
+        start = time.perf_counter()
+        # Simulated ports are not real devices, so they are kept out of the saved profiles
+        persist = getattr(self.serial_class, 'PERSIST_PROFILES', True)
+        profile = ITLA.load_profile(port) if persist else None
+
+        candidates = []
+        for baud in ([profile['baud']] if profile else []) + [baudrate] + list(ITLA.BAUD_RATES):
+            if baud not in candidates:
+                candidates.append(baud)
 
         try:
-            self.sercon = serial.Serial(port, baudrate, timeout=1)
+            self.sercon = self.open_serial(port, candidates[0])
         except serial.SerialException as e:
             logging.error('Serial port error: %s' % e)
             return (ITLA.ERROR_SERPORT)
-        baudrate2 = 4800
-        while baudrate2 <= 115200:
-            self.itla_communicate(ITLA.REG_Nop, 0, 0)
-            if self.ITLALastError() != ITLA.NOERROR:
-                print(('Last error: %s' % self.ITLALastError()))
-                # go to next baudrate
-                if baudrate2 == 4800:
-                    baudrate2 = 9600
-                elif baudrate2 == 9600:
-                    baudrate2 = 19200
-                elif baudrate2 == 19200:
-                    baudrate2 = 38400
-                elif baudrate2 == 38400:
-                    baudrate2 = 57600
-                elif baudrate2 == 57600:
-                    baudrate2 = 115200
-                elif baudrate2 == 115200:
-                    baudrate2 = 10000000
-                self.sercon.close()
-                self.sercon = serial.Serial(port, baudrate2, timeout=1)
-            else:
-                print(('Detected baud rate %d' % baudrate2))
-                print((self.ITLALastError()))
+
+        for baud in candidates:
+            if self.sercon.baudrate != baud:
+                self.sercon.baudrate = baud
+            if self.probe():
+                print(('Detected baud rate %d' % baud))
+                self.baudrate = baud
+                self._update_profile(port, profile, persist)
+                self.connect_time = time.perf_counter() - start
+                logging.info('Connected to %s at %d baud in %.3f s' % (port, baud, self.connect_time))
                 return (self.sercon)
+            logging.debug('No response at %d baud' % baud)
         self.sercon.close()
         logging.error('No response from device')
         return (ITLA.ERROR_SERBAUD)
 
+    def _update_profile(self, port, profile, persist=True):
+        """Identifies the laser and saves the connection profile if anything changed and ``persist`` is set"""
+        self.serial_number = ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, ITLA.READ))
+        if profile and profile.get('serial') == self.serial_number and profile.get('baud') == self.baudrate:
+            self.release = profile.get('release')
+            return
+        if profile and profile.get('serial') not in (None, self.serial_number):
+            logging.warning('Laser on %s changed from %s to %s' % (port, profile.get('serial'), self.serial_number))
+        self.release = str(self.itla_communicate(ITLA.REG_Release, 0, ITLA.READ)).rstrip('\x00')
+        if persist:
+            ITLA.save_profile(port, {'baud': self.baudrate, 'serial': self.serial_number, 'release': self.release})
+
     def itla_disconnect(self):
+        if self.original_baudrate and self.original_baudrate != self.baudrate:
+            if not self.set_baud_rate(self.original_baudrate):
+                logging.warning('Could not restore the original baud rate of %d' % self.original_baudrate)
+        self.original_baudrate = None
+        self.scheduler.stop()
         self.sercon.close()
 
-    def itla_communicate(self, register, data, rw):
-        """Sends data and returns the response from the device
+    def measure_round_trip(self, count=20):
+        """Times ``count`` NOP reads and returns the mean round trip time in seconds"""
+        start = time.perf_counter()
+        for _ in range(count):
+            self.itla_communicate(ITLA.REG_Nop, 0, ITLA.READ)
+        return (time.perf_counter() - start) / count
+
+    def set_baud_rate(self, baud):
+        """Switches the laser and the port to another baud rate through REG_Iocap.
+
+        The new rate is verified by reading the serial number. If that fails, the port goes back to the old rate.
+
+        :param baud: one of the IOCAP_BAUD_CODES rates
+        :return: True if the laser is communicating at the new rate
+        """
+        if baud not in ITLA.IOCAP_BAUD_CODES:
+            raise ValueError('Unsupported baud rate %d' % baud)
+        if baud == self.sercon.baudrate:
+            return True
+
+        old_baud = self.sercon.baudrate
+        reference = ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, ITLA.READ))
+        iocap = self.itla_communicate(ITLA.REG_Iocap, 0, ITLA.READ)
+        iocap = (iocap & ~0xF0) | (ITLA.IOCAP_BAUD_CODES[baud] << 4)
+
+        def switch():
+            # Runs on the I/O worker so no other command can be sent between the write and the rate change
+            self.itla_communicate(ITLA.REG_Iocap, iocap, ITLA.WRITE)
+            if self.ITLALastError() != ITLA.NOERROR:
+                return False
+            self.sercon.baudrate = baud
+            return True
+
+        if not self.scheduler.submit(switch, priority=CommandScheduler.PRIORITY_URGENT).result():
+            logging.warning('Laser refused baud rate change to %d' % baud)
+            return False
+
+        if ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, ITLA.READ)) != reference:
+            logging.warning('After change to %d baud: serial discrepancy found. Going back to %d baud.'
+                            % (baud, old_baud))
+            self.sercon.baudrate = old_baud
+            return False
+
+        self.baudrate = baud
+        return True
+
+    def start_high_speed_session(self, baud=115200):
+        """Switches to the fastest baud rate for this session. The original rate is restored by itla_disconnect.
+
+        :return: dict of the mean round trip times in seconds before and after the switch, and the rates used
+        """
+        before = self.measure_round_trip()
+        original = self.baudrate
+        if not self.set_baud_rate(baud):
+            return None
+        if self.original_baudrate is None:
+            self.original_baudrate = original
+        after = self.measure_round_trip()
+        self.high_speed_timing = {'baud_before': original, 'baud_after': baud, 'round_trip_before': before,
+                                  'round_trip_after': after}
+        logging.info('High-speed session: %d baud %.2f ms -> %d baud %.2f ms per command'
+                     % (original, before * 1000, baud, after * 1000))
+        return self.high_speed_timing
+
+    @staticmethod
+    def command_priority(register, rw):
+        """Default scheduling priority of a command: urgent commands first, telemetry reads last"""
+        if register in ITLA.URGENT_REGISTERS and rw == ITLA.WRITE:
+            return CommandScheduler.PRIORITY_URGENT
+        elif register in ITLA.TELEMETRY_REGISTERS and rw == ITLA.READ:
+            return CommandScheduler.PRIORITY_TELEMETRY
+        return CommandScheduler.PRIORITY_NORMAL
+
+    def itla_submit(self, register, data, rw, priority=None):
+        """Queues a command for the laser without waiting for it
 
-        :param resend: set to True to prompt the device to resend the last packet (if there was a CS error)
         :param register: the ITLA register to send data to
         :param data: an integer to send to the device
         :param rw: 0 = read, 1 = write
-        :return: the device's response
+        :param priority: a ``CommandScheduler.PRIORITY_*`` value, or None to choose by register
+        :return: a ``Future`` whose result is a (response, error code) tuple
         """
-        lock = threading.Lock()
-        lock.acquire()
-        rowticket = self.maxrowticket + 1
-        self.maxrowticket = self.maxrowticket + 1
-        self.queue.append(rowticket)
-        lock.release()
-        while self.queue[0] != rowticket:
-            rowticket = rowticket
-        if rw == 0:
+        if priority is None:
+            priority = ITLA.command_priority(register, rw)
+        return self.scheduler.submit(self._transact, register, data, rw, priority=priority)
+
+    def _transact(self, register, data, rw):
+        """Performs one command/response exchange. Runs on the I/O worker."""
+        self.SerialLockSet()
+        try:
             byte2 = int(data / 256)
             byte3 = int(data - byte2 * 256)
-            self.latestregister = register
-            self.Send_command(int(ITLA.checksum(0, register, byte2, byte3)) * 16, register, byte2, byte3)
-            test = self.Receive_response()
-            b0 = test[0]
-            # b1=test[1] # Value not used
-            b2 = test[2]
-            b3 = test[3]
-            """
-            print(hex(b0))
-            print(hex(b1))
-            print(hex(b2))
-            print(hex(b3))
-            """
-            if (b0 & 0x03) == 0x02:
-                test = self.AEA(b2 * 256 + b3)
-                lock.acquire()
-                self.queue.pop(0)
-                lock.release()
-                return test
-            lock.acquire()
-            self.queue.pop(0)
-            lock.release()
-            return b2 * 256 + b3
+            if rw == 0:
+                self.latestregister = register
+                self.Send_command(int(ITLA.checksum(0, register, byte2, byte3)) * 16, register, byte2, byte3)
+                test = self.Receive_response()
+                b0 = test[0]
+                # b1=test[1] # Value not used
+                b2 = test[2]
+                b3 = test[3]
+                if (b0 & 0x03) == 0x02:
+                    return self.AEA(b2 * 256 + b3), self._error
+                return b2 * 256 + b3, self._error
+            else:
+                self.Send_command(int(ITLA.checksum(1, register, byte2, byte3)) * 16 + 1, register, byte2, byte3)
+                test = self.Receive_response()
+                return test[2] * 256 + test[3], self._error
+        finally:
+            self.SerialLockUnSet()
+
+    def itla_communicate(self, register, data, rw, priority=None):
+        """Sends data and returns the response from the device
+
+        :param register: the ITLA register to send data to
+        :param data: an integer to send to the device
+        :param rw: 0 = read, 1 = write
+        :param priority: a ``CommandScheduler.PRIORITY_*`` value, or None to choose by register
+        :return: the device's response
+        """
+        response, self._caller.error = self.itla_submit(register, data, rw, priority).result()
+        return response
+
+    def _transact_many(self, registers, values=None):
+        """Writes request frames for all registers back-to-back, then collects the responses in order. Runs on the
+        I/O worker.
+
+        :param values: None to read the registers, or one value to write to each register
+        """
+        frames = bytearray()
+        if values is None:
+            for register in registers:
+                frames += bytes((ITLA.checksum(0, register, 0, 0) * 16, register, 0, 0))
         else:
-            byte2 = int(data / 256)
-            byte3 = int(data - byte2 * 256)
-            self.Send_command(int(ITLA.checksum(1, register, byte2, byte3)) * 16 + 1, register, byte2, byte3)
-            test = self.Receive_response()
-            lock.acquire()
-            self.queue.pop(0)
-            lock.release()
-            """
-            print(hex(test[0]))
-            print(hex(test[1]))
-            print(hex(test[2]))
-            print(hex(test[3]))
-            """
-            return (test[2] * 256 + test[3])
+            for register, data in zip(registers, values):
+                byte2 = int(data / 256)
+                byte3 = int(data - byte2 * 256)
+                frames += bytes((ITLA.checksum(ITLA.WRITE, register, byte2, byte3) * 16 + ITLA.WRITE, register,
+                                 byte2, byte3))
+
+        self.SerialLockSet()
+        try:
+            self.latestregister = registers[-1]
+            self._write_frames(frames)
+            results = []
+            for index, register in enumerate(registers):
+                test = self.Receive_response()
+                error = self._error
+                if error != ITLA.NRERROR and test[1] != register:
+                    # Out of step with the device: none of the remaining responses can be trusted, so they are not
+                    # waited for. The input is drained before the next command.
+                    self._error = ITLA.CSERROR
+                    self._resync = True
+                    results.extend((0, ITLA.CSERROR) for _ in registers[index:])
+                    break
+                results.append((test[2] * 256 + test[3], error))
+            return results
+        finally:
+            self.SerialLockUnSet()
+
+    def itla_submit_many(self, registers, priority=None, values=None):
+        """Queues a pipelined read (or write) of several registers without waiting for it
+
+        :param registers: sequence of ITLA registers to read. AEA string registers are not supported.
+        :param priority: a ``CommandScheduler.PRIORITY_*`` value, or None to use the lowest priority of the registers
+        :param values: None to read the registers, or a sequence with one value to write to each register
+        :return: a ``Future`` whose result is a list of (response, error code) tuples in the order of ``registers``
+        """
+        registers = list(registers)
+        rw = ITLA.READ
+        if values is not None:
+            values = list(values)
+            rw = ITLA.WRITE
+            if len(values) != len(registers):
+                raise ValueError('Got %d values for %d registers' % (len(values), len(registers)))
+        for register in registers:
+            if register in ITLA.AEA_REGISTERS:
+                raise ValueError('Register 0x%02X returns an AEA string; read it with itla_communicate' % register)
+        if not registers:
+            future = Future()
+            future.set_result([])
+            return future
+        if priority is None:
+            priority = max(ITLA.command_priority(register, rw) for register in registers)
+        return self.scheduler.submit(self._transact_many, registers, values, priority=priority)
+
+    def itla_read_many(self, registers, priority=None):
+        """Reads several registers with their request frames pipelined on the line
+
+        :param registers: sequence of ITLA registers to read. AEA string registers are not supported.
+        :param priority: a ``CommandScheduler.PRIORITY_*`` value, or None to use the lowest priority of the registers
+        :return: a list of (response, error code) tuples in the order of ``registers``
+        """
+        results = self.itla_submit_many(registers, priority).result()
+        self._caller.error = next((error for _, error in results if error != ITLA.NOERROR), ITLA.NOERROR)
+        return results
+
+    def itla_write_many(self, registers, values, priority=None):
+        """Writes several registers with their request frames pipelined on the line
+
+        Only use this for registers whose writes do not depend on each other's completion.
+
+        :param registers: sequence of ITLA registers to write. AEA string registers are not supported.
+        :param values: sequence with one value to write to each register
+        :param priority: a ``CommandScheduler.PRIORITY_*`` value, or None to use the lowest priority of the registers
+        :return: a list of (response, error code) tuples in the order of ``registers``
+        """
+        results = self.itla_submit_many(registers, priority, values).result()
+        self._caller.error = next((error for _, error in results if error != ITLA.NOERROR), ITLA.NOERROR)
+        return results
 
     def itla_signed_communicate(self, register, data, rw):
         """Treats the response of the communication as a signed 2-bit integer"""
@@ -285,6 +650,12 @@ class ITLA:
         # Get raw response, treated as unsigned int
         resp_unsigned = self.itla_communicate(register, data, rw)
 
+        return ITLA.to_signed(resp_unsigned)
+
+    @staticmethod
+    def to_signed(resp_unsigned):
+        """Converts an unsigned 2-byte response to a signed integer"""
+
         # Max signed int is 2^(N-1) - 1
         max_2byte_int = 2 ** 15 - 1
 
@@ -296,25 +667,24 @@ class ITLA:
 
         return resp
 
-    def ITLA_send_only(self, register, data, rw):
-        rowticket = self.maxrowticket + 1
-        self.maxrowticket = self.maxrowticket + 1
-        self.queue.append(rowticket)
-        while self.queue[0] != rowticket:
-            time.sleep(.1)
+    def _send_only(self, register, data, rw):
         self.SerialLockSet()
-        if rw == 0:
-            self.latestregister = register
-            self.Send_command(int(ITLA.checksum(0, register, 0, 0)) * 16, register, 0, 0)
-            self.Receive_simple_response()
-            self.SerialLockUnSet()
-        else:
-            byte2 = int(data / 256)
-            byte3 = int(data - byte2 * 256)
-            self.Send_command(int(ITLA.checksum(1, register, byte2, byte3)) * 16 + 1, register, byte2, byte3)
-            self.Receive_simple_response()
+        try:
+            if rw == 0:
+                self.latestregister = register
+                self.Send_command(int(ITLA.checksum(0, register, 0, 0)) * 16, register, 0, 0)
+                self.Receive_simple_response()
+            else:
+                byte2 = int(data / 256)
+                byte3 = int(data - byte2 * 256)
+                self.Send_command(int(ITLA.checksum(1, register, byte2, byte3)) * 16 + 1, register, byte2, byte3)
+                self.Receive_simple_response()
+        finally:
             self.SerialLockUnSet()
 
+    def ITLA_send_only(self, register, data, rw):
+        self.scheduler.submit(self._send_only, register, data, rw).result()
+
     def AEA(self, bytes):
         outp = ''
         while bytes > 0:
@@ -337,7 +707,7 @@ class ITLA:
         # validate communication with the laser
         self.tempport = self.sercon.portstr
         self.sercon.close()
-        self.sercon = serial.Serial(self.tempport, 115200, timeout=1)
+        self.sercon = self.open_serial(self.tempport, 115200)
         if ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, 0)) != ref:
             return (self.sercon, 'After change baudrate: serial discrepancy found. Aborting. ' + str(
                 ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, 0))))
@@ -395,7 +765,7 @@ class ITLA:
         self.itla_communicate(ITLA.REG_Iocap, 0, 1)  # bits 4-7 are 0x0 for 9600 baudrate
         self.sercon.close()
         # validate communication with the laser
-        self.sercon = serial.Serial(self.tempport, 9600, timeout=1)
+        self.sercon = self.open_serial(self.tempport, 9600)
         ref = ITLA.stripString(self.itla_communicate(ITLA.REG_Serial, 0, 0))
         if len(ref) < 5:
             return (self.sercon, 'After change back to 9600 baudrate: serial discrepancy found. Aborting. ' + str(
@@ -0,0 +1,49 @@
+"""
+Benchmark of pipelined register reads (``Laser.read_many``) against one-at-a-time reads (``Laser.read``).
+
+Runs against the simulator at every supported baud rate and prints the achieved register reads per second next to
+the serial line limit (one 4-byte frame in each direction per read, 10 bits per byte).
+
+Usage: python read_many_benchmark.py [duration per measurement in seconds] [device latency in ms]
+"""
+
+import sys
+import time
+
+from itla_simulator import SimulatedSerial, SimulatedITLA
+from laser import Laser
+
+SNAPSHOT_REGISTERS = list(Laser.SNAPSHOT_REGISTERS)
+
+
+def reads_per_second(read_batch, batch_size, duration):
+    """Calls read_batch repeatedly for the given duration and returns register reads per second"""
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        read_batch()
+        count += batch_size
+    return count / (time.perf_counter() - start)
+
+
+def run(duration=1.0, latency=0.0005):
+    print('%8s %14s %14s %14s %10s' % ('baud', 'line limit/s', 'serial/s', 'pipelined/s', 'speedup'))
+    for baud in SimulatedITLA.BAUD_RATES:
+        port = 'BENCH%d' % baud
+        SimulatedSerial.add_device(port, baud=baud, latency=latency)
+        laser = Laser(port, baud, serial_class=SimulatedSerial)
+
+        serial_rate = reads_per_second(lambda: [laser.read(register) for register in SNAPSHOT_REGISTERS],
+                                       len(SNAPSHOT_REGISTERS), duration)
+        pipelined_rate = reads_per_second(lambda: laser.read_many(SNAPSHOT_REGISTERS), len(SNAPSHOT_REGISTERS),
+                                          duration)
+        line_limit = 1 / SimulatedITLA.frame_time(baud)
+
+        print('%8d %14.0f %14.0f %14.0f %9.2fx' % (baud, line_limit, serial_rate, pipelined_rate,
+                                                    pipelined_rate / serial_rate))
+        laser.itla_disconnect()
+
+
+if __name__ == '__main__':
+    run(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0005)
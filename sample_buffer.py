@@ -0,0 +1,101 @@
+"""
+Typed column buffers for samples that arrive in blocks.
+
+``SampleBuffer`` stores named float columns in preallocated NumPy arrays. Appending a block copies only the new
+samples, and ``buffer['column']`` is a view of the stored samples, oldest first, without copying anything. With
+``max_size`` the buffer is a ring that keeps only the newest samples; otherwise its capacity doubles as needed.
+
+Views are only valid until the next append; take a copy to keep one for longer.
+"""
+
+import numpy as np
+
+
+class SampleBuffer:
+    """Named columns of samples with amortized O(1) appends and zero-copy views"""
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, columns, max_size=None, capacity=INITIAL_CAPACITY, dtype=float):
+        """
+        :param columns: names of the columns
+        :param max_size: keep only the newest ``max_size`` samples, or None to keep everything
+        :param capacity: initial number of samples to allocate for when ``max_size`` is None
+        :param dtype: NumPy type of the samples
+        """
+        self.columns = tuple(columns)
+        self.max_size = max_size
+        self.dtype = dtype
+
+        if max_size is None:
+            self._capacity = max(int(capacity), 1)
+            self._data = np.empty((len(self.columns), self._capacity), dtype=dtype)
+        else:
+            # A ring stores every sample twice, max_size apart, so the newest samples are always one contiguous slice
+            self._capacity = int(max_size)
+            self._data = np.empty((len(self.columns), 2 * self._capacity), dtype=dtype)
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, column):
+        """Returns a view of one column, oldest sample first"""
+        return self._data[self.columns.index(column), self._start:self._start + self._size]
+
+    def views(self):
+        """Returns a dict of column name -> view, oldest sample first"""
+        return {column: self._data[i, self._start:self._start + self._size] for i, column in enumerate(self.columns)}
+
+    def clear(self):
+        self._start = 0
+        self._size = 0
+
+    def append(self, *values):
+        """Appends one sample, with one value per column"""
+        self.append_block(*(np.array([value], dtype=self.dtype) for value in values))
+
+    def append_block(self, *columns):
+        """Appends a block of samples
+
+        :param columns: one array (or sequence) per column, all the same length
+        """
+        if len(columns) != len(self.columns):
+            raise ValueError('Expected %d columns, got %d' % (len(self.columns), len(columns)))
+        block = np.asarray(columns, dtype=self.dtype)
+        if block.ndim != 2:
+            raise ValueError('Columns must be one-dimensional and the same length')
+
+        if self.max_size is None:
+            self._append_growable(block)
+        else:
+            self._append_ring(block)
+
+    def _append_growable(self, block):
+        count = block.shape[1]
+        if self._size + count > self._capacity:
+            while self._size + count > self._capacity:
+                self._capacity *= 2
+            data = np.empty((len(self.columns), self._capacity), dtype=self.dtype)
+            data[:, :self._size] = self._data[:, :self._size]
+            self._data = data
+        self._data[:, self._size:self._size + count] = block
+        self._size += count
+
+    def _append_ring(self, block):
+        capacity = self._capacity
+        if block.shape[1] > capacity:
+            block = block[:, -capacity:]
+        count = block.shape[1]
+
+        # Write position of the first new sample in the first copy of the ring
+        position = (self._start + self._size) % capacity
+        first = min(count, capacity - position)
+        self._data[:, position:position + first] = block[:, :first]
+        self._data[:, position + capacity:position + capacity + first] = block[:, :first]
+        if first < count:
+            self._data[:, :count - first] = block[:, first:]
+            self._data[:, capacity:capacity + count - first] = block[:, first:]
+
+        self._size = min(self._size + count, capacity)
+        self._start = (position + count - self._size) % capacity
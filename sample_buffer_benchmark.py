@@ -0,0 +1,75 @@
+"""
+Benchmark of the cost of one scan data update as the scan grows.
+
+Each update appends a block of samples (as one laser read interval of power meter samples does during a scan) and
+then gets arrays of the whole scan for the plot. The list path is what the GUI used to do: extend Python lists and
+convert them with ``np.array``, which costs O(total samples) per update. ``SampleBuffer`` appends the block and
+returns views, so its cost per update should stay flat up to millions of samples.
+
+Usage: python sample_buffer_benchmark.py [total samples] [samples per update]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+from sample_buffer import SampleBuffer
+
+LIST_LIMIT = 500000  # The list path gets too slow to measure beyond this
+
+
+def list_append(data, frequencies, transmissions):
+    data['f'] += list(frequencies)
+    data['t'] += list(transmissions)
+
+
+def list_update(data, frequencies, transmissions):
+    list_append(data, frequencies, transmissions)
+    return np.array(data['f']), np.array(data['t'])
+
+
+def buffer_append(data, frequencies, transmissions):
+    data.append_block(frequencies, transmissions)
+
+
+def buffer_update(data, frequencies, transmissions):
+    buffer_append(data, frequencies, transmissions)
+    return data['f'], data['t']
+
+
+def run(total=3000000, block=50):
+    rng = np.random.default_rng(0)
+    frequencies = rng.uniform(192, 196, block)
+    transmissions = rng.random(block)
+    checkpoints = [size for size in (10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 3 * 10 ** 6, 10 ** 7) if size <= total]
+
+    # (name, new empty store, append without reading, full update, largest size to measure)
+    paths = [('lists', lambda: {'f': [], 't': []}, list_append, list_update, LIST_LIMIT),
+             ('growable buffer', lambda: SampleBuffer(('f', 't')), buffer_append, buffer_update, total),
+             ('ring buffer (1e6)', lambda: SampleBuffer(('f', 't'), max_size=10 ** 6), buffer_append, buffer_update,
+              total)]
+
+    print('%-18s' % 'us/update at' + ''.join('%12d' % size for size in checkpoints))
+    for name, make, append, update, limit in paths:
+        data = make()
+        size = 0
+        results = []
+        for checkpoint in checkpoints:
+            if checkpoint > limit:
+                results.append('%12s' % '-')
+                continue
+            # Fill up to just below the checkpoint, then time a few updates there
+            while size < checkpoint - 10 * block:
+                append(data, frequencies, transmissions)
+                size += block
+            start = time.perf_counter()
+            for _ in range(10):
+                update(data, frequencies, transmissions)
+            size += 10 * block
+            results.append('%12.1f' % ((time.perf_counter() - start) / 10 * 1e6))
+        print('%-18s' % name + ''.join(results))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 3000000, int(sys.argv[2]) if len(sys.argv) > 2 else 50)
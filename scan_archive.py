@@ -0,0 +1,192 @@
+"""
+Indexed access to directories of ``scan_transmission_<timestamp>.csv`` files.
+
+``ScanArchive`` keeps a sidecar index, ``scan_index.json``, next to the CSV files with the frequency range, sample
+count, timestamp and transmission range of each scan, so finding the scans that cover a frequency range does not read
+any of them. When a scan is indexed, it is parsed with numpy's C reader and converted to a ``.npy`` file next to it
+with a 64 bit frequency and a 32 bit transmission per sample, about a third of the size of the CSV. Loads memory-map
+that file. ``update`` only re-reads CSV files that are new or have changed since they were indexed.
+
+Usage: python scan_archive.py <directory> [low THz] [high THz]
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+
+class ArchiveEntry(NamedTuple):
+    """Index entry of one scan CSV file"""
+    name: str  # CSV file name, relative to the archive directory
+    size: int  # Bytes and modification time of the CSV file when it was indexed
+    mtime: float
+    timestamp: str  # Time the scan was taken, from the file name, in ISO format
+    rows: int
+    min_frequency: float  # THz
+    max_frequency: float
+    min_transmission: float
+    max_transmission: float
+    monotonic: bool  # True if the frequencies increase, so ranges can be found by bisection
+
+
+def load_csv(file_name):
+    """Parses a ``frequency,transmission`` CSV file without a header
+
+    :return: (rows, 2) array
+    """
+    data = np.loadtxt(file_name, delimiter=',', dtype=np.float64, ndmin=2)
+    if data.size and data.shape[1] != 2:
+        raise ValueError('%s has %d columns, expected 2' % (file_name, data.shape[1]))
+    return data.reshape(-1, 2)
+
+
+class ScanArchive:
+    """A directory of scan CSV files with a persistent index and memory-mapped binary copies"""
+    INDEX_FILE = 'scan_index.json'
+    PATTERN = re.compile(r'scan_transmission_(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.csv$')
+    TIMESTAMP_FORMAT = '%Y-%m-%d_%H-%M-%S'
+    DTYPE = np.dtype([('frequency', '<f8'), ('transmission', '<f4')])
+
+    def __init__(self, directory, update=True):
+        """
+        :param directory: directory containing the CSV files
+        :param update: index new and changed CSV files now; otherwise the index is used as saved
+        """
+        self.directory = directory
+        self.entries = {}
+        index_path = os.path.join(directory, ScanArchive.INDEX_FILE)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                self.entries = {entry['name']: ArchiveEntry(**entry) for entry in json.load(index_file)}
+        self._build_arrays()
+        if update:
+            self.update()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def update(self):
+        """Indexes new and changed CSV files and forgets deleted ones
+
+        :return: number of files indexed
+        """
+        names = [name for name in os.listdir(self.directory) if ScanArchive.PATTERN.match(name)]
+        indexed = 0
+        for name in names:
+            stat = os.stat(os.path.join(self.directory, name))
+            entry = self.entries.get(name)
+            if entry is not None and entry.size == stat.st_size and entry.mtime == stat.st_mtime:
+                continue
+            try:
+                self.entries[name] = self._index(name, stat)
+                indexed += 1
+            except ValueError:
+                logging.exception('Could not index %s' % name)
+        removed = set(self.entries) - set(names)
+        for name in removed:
+            del self.entries[name]
+        if indexed or removed:
+            self._build_arrays()
+            self._write_index()
+        return indexed
+
+    def covering(self, low, high, full=False):
+        """Finds the scans with samples between ``low`` and ``high`` THz
+
+        :param full: only return scans that cover the whole range
+        :return: ``ArchiveEntry`` of each scan, oldest first
+        """
+        if full:
+            match = (self._min_frequency <= low) & (self._max_frequency >= high)
+        else:
+            match = (self._min_frequency <= high) & (self._max_frequency >= low)
+        return [self.entries[self._names[i]] for i in np.flatnonzero(match)]
+
+    def load(self, name):
+        """Returns a scan as a memory-mapped structured array with ``frequency`` and ``transmission`` fields,
+        converting it to the binary format first if needed"""
+        binary_path = self._binary_path(name)
+        csv_path = os.path.join(self.directory, name)
+        if not os.path.exists(binary_path) or os.path.getmtime(binary_path) < os.path.getmtime(csv_path):
+            self.convert(name)
+        return np.load(binary_path, mmap_mode='r')
+
+    def load_range(self, name, low, high):
+        """Returns the samples of a scan between ``low`` and ``high`` THz, reading only those pages if the
+        frequencies are monotonic"""
+        data = self.load(name)
+        if self.entries[name].monotonic:
+            start, end = np.searchsorted(data['frequency'], (low, high))
+            return data[start:end]
+        frequencies = data['frequency']
+        return data[(frequencies >= low) & (frequencies <= high)]
+
+    def convert(self, name, data=None):
+        """Writes the binary copy of a scan
+
+        :param data: the parsed CSV file, if already loaded
+        """
+        if data is None:
+            data = load_csv(os.path.join(self.directory, name))
+        binary = np.empty(len(data), dtype=ScanArchive.DTYPE)
+        binary['frequency'] = data[:, 0]
+        binary['transmission'] = data[:, 1]
+        binary_path = self._binary_path(name)
+        # np.save would add .npy to a name without it, so the temporary file is written through a file object
+        with open(binary_path + '.tmp', 'wb') as binary_file:
+            np.save(binary_file, binary)
+        os.replace(binary_path + '.tmp', binary_path)
+
+    def _binary_path(self, name):
+        return os.path.join(self.directory, os.path.splitext(name)[0] + '.npy')
+
+    def _index(self, name, stat):
+        """Reads a CSV file, writes its binary copy and returns its index entry"""
+        data = load_csv(os.path.join(self.directory, name))
+        self.convert(name, data)
+        timestamp = datetime.datetime.strptime(ScanArchive.PATTERN.match(name).group(1), ScanArchive.TIMESTAMP_FORMAT)
+        if len(data):
+            frequencies, transmissions = data[:, 0], data[:, 1]
+            ranges = (float(frequencies.min()), float(frequencies.max()),
+                      float(transmissions.min()), float(transmissions.max()))
+        else:
+            ranges = (np.nan,) * 4
+        return ArchiveEntry(name, stat.st_size, stat.st_mtime, timestamp.isoformat(), len(data), *ranges,
+                            bool(np.all(np.diff(data[:, 0]) > 0)))
+
+    def _build_arrays(self):
+        """Sorts the entries by timestamp and keeps their frequency ranges as arrays for queries"""
+        self.entries = dict(sorted(self.entries.items(), key=lambda item: (item[1].timestamp, item[0])))
+        self._names = list(self.entries)
+        self._min_frequency = np.array([entry.min_frequency for entry in self.entries.values()])
+        self._max_frequency = np.array([entry.max_frequency for entry in self.entries.values()])
+
+    def _write_index(self):
+        """Writes the index through a temporary file, so readers never see it partially written"""
+        index_path = os.path.join(self.directory, ScanArchive.INDEX_FILE)
+        with open(index_path + '.tmp', 'w') as index_file:
+            json.dump([entry._asdict() for entry in self.entries.values()], index_file, indent=1)
+        os.replace(index_path + '.tmp', index_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    archive = ScanArchive(sys.argv[1])
+    if len(sys.argv) > 3:
+        entries = archive.covering(float(sys.argv[2]), float(sys.argv[3]))
+    else:
+        entries = list(archive)
+    for entry in entries:
+        print('%s  %s  %8d samples  %.5f - %.5f THz' % (entry.name, entry.timestamp, entry.rows, entry.min_frequency,
+                                                         entry.max_frequency))
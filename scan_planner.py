@@ -0,0 +1,140 @@
+"""
+Segment planning for mode-finder scans.
+
+Each segment of a mode-finder scan records the transmission within ``window`` GHz of its center while the clean sweep
+passes over it. ``ScanPlanner.tile`` spaces the centers so that the windows cover the requested range with only
+``OVERLAP`` GHz recorded twice between neighbours, and makes each sweep just wide enough to turn around outside its
+window. ``ScanPlanner.refine`` plans slower, narrower sweeps over the regions around transmission dips found by a
+first pass. ``ScanPlan.estimate`` predicts the duration of a plan before it runs.
+"""
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from jump_plan import JumpPlan
+
+
+class ScanSegment(NamedTuple):
+    """One clean jump and the clean sweep around it"""
+    center: float  # THz
+    words: list  # Clean jump register values, see ``JumpPlan``
+    amplitude: int  # Full range of the clean sweep in GHz
+    window: float  # GHz on each side of the center recorded by this segment
+    speed: float  # Sweep speed in GHz/s
+
+
+class ScanPlan:
+    """Segments to scan, with the clean jump registers of each precomputed"""
+
+    def __init__(self, jumps, amplitudes, windows, speeds):
+        """
+        :param jumps: ``JumpPlan`` of the segment centers
+        :param amplitudes: full clean sweep range of each segment in GHz
+        :param windows: GHz recorded on each side of each center
+        :param speeds: sweep speed of each segment in GHz/s
+        """
+        self.jumps = jumps
+        self.amplitudes = np.broadcast_to(np.asarray(amplitudes, dtype=np.int64), (len(jumps),))
+        self.windows = np.broadcast_to(np.asarray(windows, dtype=float), (len(jumps),))
+        self.speeds = np.broadcast_to(np.asarray(speeds, dtype=float), (len(jumps),))
+
+    @classmethod
+    def concatenate(cls, plans):
+        plans = list(plans)
+        jumps = JumpPlan(np.concatenate([plan.jumps.frequencies for plan in plans]),
+                         np.concatenate([plan.jumps.words for plan in plans]))
+        return cls(jumps, *(np.concatenate([getattr(plan, field) for plan in plans])
+                            for field in ('amplitudes', 'windows', 'speeds')))
+
+    def __len__(self):
+        return len(self.jumps)
+
+    def __iter__(self):
+        for (center, words), amplitude, window, speed in zip(self.jumps, self.amplitudes.tolist(),
+                                                             self.windows.tolist(), self.speeds.tolist()):
+            yield ScanSegment(center, words, amplitude, window, speed)
+
+    @staticmethod
+    def sweep_distance(amplitude, window):
+        """GHz swept by one segment: from the center up to +amplitude / 2, then down past -window"""
+        return amplitude + window
+
+    def estimate(self, jump_time=None, sweep_start_time=None, sweep_stop_time=None):
+        """Estimates the duration of the plan in seconds, with the times of the fixed steps from ``ScanPlanner``"""
+        jump_time = ScanPlanner.JUMP_TIME if jump_time is None else jump_time
+        sweep_start_time = ScanPlanner.SWEEP_START_TIME if sweep_start_time is None else sweep_start_time
+        sweep_stop_time = ScanPlanner.SWEEP_STOP_TIME if sweep_stop_time is None else sweep_stop_time
+        sweeping = ScanPlan.sweep_distance(self.amplitudes, self.windows) / self.speeds
+        return float(np.sum(sweeping) + len(self) * (jump_time + sweep_start_time + sweep_stop_time))
+
+    def covered(self):
+        """Returns the (low, high) frequency ranges in THz recorded by the plan, merged where they overlap"""
+        lows = self.jumps.frequencies - self.windows / 1000
+        highs = self.jumps.frequencies + self.windows / 1000
+        return ScanPlanner.merge(list(zip(lows.tolist(), highs.tolist())))
+
+
+class ScanPlanner:
+    """Plans the segments of mode-finder scans"""
+    MAX_AMPLITUDE = 50  # GHz, widest clean sweep
+    TURN_MARGIN = 2.5  # GHz between the edge of the recorded window and the turning point of the sweep
+    OVERLAP = 2  # GHz recorded by both of two neighbouring segments
+    JUMP_TIME = 1.2  # Seconds for a clean jump to settle (see jump_latency_benchmark.py)
+    SWEEP_START_TIME = 0.55  # Seconds to switch on clean mode and start the sweep
+    SWEEP_STOP_TIME = 0.8  # Seconds to stop the sweep until the laser is ready
+    REFINE_HALF_WIDTH = 3  # GHz re-scanned on each side of a dip
+    REFINE_SPEED_FACTOR = 0.25  # Refinement sweeps run at this fraction of the first pass's speed
+
+    def __init__(self, calibration, max_amplitude=MAX_AMPLITUDE, turn_margin=TURN_MARGIN, overlap=OVERLAP):
+        """
+        :param calibration: the laser's ``Calibration``, from ``Laser.get_calibration``
+        :param max_amplitude: widest clean sweep to plan, in GHz
+        :param turn_margin: GHz the sweep turns around beyond the recorded window
+        :param overlap: GHz recorded by both of two neighbouring segments
+        """
+        self.calibration = calibration
+        self.max_amplitude = max_amplitude
+        self.turn_margin = turn_margin
+        self.overlap = overlap
+
+    def tile(self, start, stop, speed):
+        """Plans segments covering ``start`` to ``stop`` THz with the fewest sweeps
+
+        :param speed: sweep speed in GHz/s
+        """
+        span = (stop - start) * 1000
+        max_window = self.max_amplitude / 2 - self.turn_margin
+        count = max(math.ceil((span - self.overlap) / (2 * max_window - self.overlap)), 1)
+        window = (span + (count - 1) * self.overlap) / count / 2
+        centers = start + (window + np.arange(count) * (2 * window - self.overlap)) / 1000
+        amplitude = min(math.ceil(2 * (window + self.turn_margin)), self.max_amplitude)
+        return ScanPlan(JumpPlan.from_frequencies(self.calibration, centers), amplitude, window, speed)
+
+    def refine(self, dips, speed, half_width=REFINE_HALF_WIDTH):
+        """Plans slower sweeps over the regions around transmission dips
+
+        :param dips: frequencies of the dips in THz
+        :param speed: sweep speed of the first pass in GHz/s; the refinement runs at ``REFINE_SPEED_FACTOR`` of it
+        :param half_width: GHz re-scanned on each side of a dip
+        :return: a ``ScanPlan``, or None if there are no dips
+        """
+        low_limit, high_limit = self.calibration.min_frequency, self.calibration.max_frequency
+        regions = ScanPlanner.merge([(max(dip - half_width / 1000, low_limit), min(dip + half_width / 1000, high_limit))
+                                     for dip in dips])
+        if not regions:
+            return None
+        return ScanPlan.concatenate(self.tile(low, high, speed * ScanPlanner.REFINE_SPEED_FACTOR)
+                                    for low, high in regions)
+
+    @staticmethod
+    def merge(ranges):
+        """Merges overlapping (low, high) ranges and returns them sorted"""
+        merged = []
+        for low, high in sorted(ranges):
+            if merged and low <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+            else:
+                merged.append((low, high))
+        return merged
@@ -0,0 +1,171 @@
+"""
+Streaming storage for scan data.
+
+``ScanRecorder`` appends samples to a directory of fixed-size ``.npy`` chunks while a scan is running, so memory use
+stays flat and a crash loses at most the last ``FLUSH_INTERVAL`` seconds of data. ``index.json`` in the same directory
+lists the columns and the chunks with their row counts and column ranges. ``ScanRecording`` reads a recording back,
+and ``export_csv`` converts one to the ``frequency,transmission`` CSV files written by earlier versions of the GUI.
+
+Usage: python scan_recorder.py <recording directory> [output CSV file]
+"""
+
+import os
+import sys
+import json
+import time
+
+import numpy as np
+
+
+class ScanRecorder:
+    """Append-only recorder of scan samples, written to disk in chunks"""
+    COLUMNS = ('frequency', 'transmission')
+    CHUNK_SIZE = 4096  # Rows per chunk file
+    FLUSH_INTERVAL = 1.0  # Seconds between writes of a partially filled chunk
+    INDEX_FILE = 'index.json'
+    CHUNK_FILE = 'chunk_%06d.npy'
+
+    def __init__(self, directory, columns=COLUMNS, chunk_size=CHUNK_SIZE, flush_interval=FLUSH_INTERVAL):
+        """Starts a new recording. The directory is created and must not already contain one.
+
+        :param directory: directory for the chunk and index files
+        :param columns: names of the columns of each sample
+        :param chunk_size: rows per chunk file
+        :param flush_interval: seconds between writes of a partially filled chunk, or 0 to write on every append
+        """
+        if os.path.exists(os.path.join(directory, ScanRecorder.INDEX_FILE)):
+            raise FileExistsError('%s already contains a scan recording' % directory)
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.columns = tuple(columns)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+
+        self.chunks = []  # Index entries of the completed chunks
+        self._buffer = np.empty((chunk_size, len(self.columns)))
+        self._buffered = 0
+        self._dirty = False
+        self._last_flush = time.perf_counter()
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def rows(self):
+        """Total number of samples recorded"""
+        return sum(chunk['rows'] for chunk in self.chunks) + self._buffered
+
+    def append(self, *values):
+        """Records one sample, with one value per column"""
+        self.append_block(*([value] for value in values))
+
+    def append_block(self, *columns):
+        """Records several samples at once
+
+        :param columns: one sequence per column, all the same length
+        """
+        if len(columns) != len(self.columns):
+            raise ValueError('Expected %d columns, got %d' % (len(self.columns), len(columns)))
+        block = np.column_stack([np.asarray(column, dtype=float) for column in columns])
+
+        start = 0
+        while start < len(block):
+            count = min(len(block) - start, self.chunk_size - self._buffered)
+            self._buffer[self._buffered:self._buffered + count] = block[start:start + count]
+            self._buffered += count
+            self._dirty = True
+            start += count
+            if self._buffered == self.chunk_size:
+                self._write_chunk()
+                self.chunks.append(self._chunk_entry())
+                self._buffered = 0
+                self._dirty = False
+                self._write_index()
+
+        if self._dirty and time.perf_counter() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the partially filled chunk to disk"""
+        if self._dirty:
+            self._write_chunk()
+            self._write_index()
+            self._dirty = False
+        self._last_flush = time.perf_counter()
+
+    def close(self):
+        self.flush()
+
+    def _chunk_entry(self):
+        data = self._buffer[:self._buffered]
+        return {'file': ScanRecorder.CHUNK_FILE % len(self.chunks), 'rows': self._buffered,
+                'min': data.min(axis=0).tolist(), 'max': data.max(axis=0).tolist()}
+
+    def _write_chunk(self):
+        path = os.path.join(self.directory, ScanRecorder.CHUNK_FILE % len(self.chunks))
+        ScanRecorder._replace(path, lambda file: np.save(file, self._buffer[:self._buffered]))
+
+    def _write_index(self):
+        chunks = list(self.chunks)
+        if self._buffered:
+            chunks.append(self._chunk_entry())
+        index = {'columns': self.columns, 'chunk_size': self.chunk_size, 'chunks': chunks}
+        ScanRecorder._replace(os.path.join(self.directory, ScanRecorder.INDEX_FILE),
+                              lambda file: file.write(json.dumps(index).encode()))
+
+    @staticmethod
+    def _replace(path, write):
+        """Writes a file through a temporary file, so readers never see it partially written"""
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as file:
+            write(file)
+        os.replace(temp_path, path)
+
+
+class ScanRecording:
+    """A scan recording written by ``ScanRecorder``, read one chunk at a time"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, ScanRecorder.INDEX_FILE)) as index_file:
+            index = json.load(index_file)
+        self.columns = tuple(index['columns'])
+        self.chunks = index['chunks']
+
+    def __len__(self):
+        return sum(chunk['rows'] for chunk in self.chunks)
+
+    def iter_chunks(self):
+        """Yields each chunk as a memory-mapped (rows, columns) array"""
+        for chunk in self.chunks:
+            data = np.load(os.path.join(self.directory, chunk['file']), mmap_mode='r')
+            # A chunk can be ahead of the index if the recorder stopped between writing the two
+            yield data[:chunk['rows']]
+
+    def read(self):
+        """Returns a dict of column name -> array of the whole recording"""
+        chunks = list(self.iter_chunks())
+        data = np.concatenate(chunks) if chunks else np.empty((0, len(self.columns)))
+        return {column: data[:, i] for i, column in enumerate(self.columns)}
+
+
+def export_csv(directory, csv_file_name):
+    """Writes a recording as a CSV file with one line per sample and no header, one chunk at a time"""
+    with open(csv_file_name, 'w') as csv_file:
+        for chunk in ScanRecording(directory).iter_chunks():
+            csv_file.writelines(','.join(map(repr, row)) + '\n' for row in chunk.tolist())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    recording_directory = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.normpath(recording_directory) + '.csv'
+    export_csv(recording_directory, output)
+    print('Wrote %s' % output)
@@ -0,0 +1,183 @@
+"""
+Settle detection for clean jumps.
+
+``SettleDetector`` polls the clean jump offset, ``NOP`` and optical power in one pipelined batch, at an interval
+derived from the measured round trip time of the link, and decides that a phase of the jump is over as soon as its
+condition has held for a configurable dwell time. ``Laser.clean_jump_timed`` uses it instead of fixed sleeps and
+returns a ``JumpTiming`` with the time spent in each phase. The ``*_async`` waits apply the same criteria with
+``asyncio.sleep`` between polls, for ``AsyncLaser.clean_jump_timed``.
+"""
+
+import time
+import asyncio
+import logging
+from typing import NamedTuple
+
+from pure_photonics_utils import ITLA
+
+
+class SettleSample(NamedTuple):
+    """One poll of the laser while waiting for a jump to settle"""
+    time: float  # time.perf_counter() when the poll completed
+    offset: float  # Clean jump offset from the target frequency in GHz
+    nop: int  # NOP register
+    power: float  # Optical power in dBm
+
+
+class JumpTiming(NamedTuple):
+    """Time spent in each phase of a clean jump, in seconds"""
+    frequency: float  # Target frequency in THz
+    command: float  # Writing clean mode and the jump registers until the laser is ready
+    filter_calc: float  # The memory and filter calculation stages until the laser is ready
+    tuning: float  # Executing the jump until the offset is within tolerance and the laser is ready
+    power_recovery: float  # After tuning, until the power is back within tolerance of its value before the jump
+    total: float  # From the first write until the power recovered, including reading the claimed frequency
+    settled: bool  # False if any phase timed out
+    claimed_frequency: float  # Frequency reported by the laser after the jump in THz
+
+
+class PhaseWait:
+    """Decides from successive samples when a condition has held for a dwell time, or the phase timed out"""
+
+    def __init__(self, condition, dwell, timeout):
+        """
+        :param condition: function of a ``SettleSample`` returning True when the phase's condition holds
+        :param dwell: seconds the condition must keep holding
+        :param timeout: seconds allowed for the phase
+        """
+        self.condition = condition
+        self.dwell = dwell
+        self.timeout = timeout
+        self.start = time.perf_counter()
+        self.held_since = None
+
+    def check(self, sample):
+        """Takes the next sample
+
+        :return: None while waiting, otherwise (seconds waited, True if the condition was met, the sample)
+        """
+        if self.condition(sample):
+            if self.held_since is None:
+                self.held_since = sample.time
+            if sample.time - self.held_since >= self.dwell:
+                return sample.time - self.start, True, sample
+        else:
+            self.held_since = None
+        if sample.time - self.start >= self.timeout:
+            logging.warning('Jump did not settle within %.1f s: %s' % (self.timeout, sample))
+            return sample.time - self.start, False, sample
+        return None
+
+
+class SettleDetector:
+    """Polls the laser until a condition holds for a dwell time"""
+    OFFSET_TOLERANCE = 0.1  # GHz
+    POWER_TOLERANCE = 0.5  # dB below the power before the jump
+    DWELL = 0.02  # Seconds a condition must keep holding before the phase is over
+    TIMEOUT = 5  # Seconds allowed for each phase
+    MIN_POLL_INTERVAL = 0.002  # Seconds
+    LINK_SHARE = 0.5  # Fraction of the link's time to spend polling, leaving the rest for other commands
+    REGISTERS = (ITLA.REG_Cjumpoffset, ITLA.REG_Nop, ITLA.REG_Oop)
+
+    def __init__(self, offset_tolerance=None, power_tolerance=None, dwell=None, timeout=None, poll_interval=None,
+                 callback=None):
+        """
+        :param offset_tolerance: largest acceptable clean jump offset in GHz
+        :param power_tolerance: largest acceptable power drop from before the jump in dB
+        :param dwell: seconds the offset and power conditions must hold
+        :param timeout: seconds allowed for each phase before giving up
+        :param poll_interval: seconds between polls, or None to derive it from the link's round trip time
+        :param callback: optional function called with every ``SettleSample``
+        """
+        self.offset_tolerance = SettleDetector.OFFSET_TOLERANCE if offset_tolerance is None else offset_tolerance
+        self.power_tolerance = SettleDetector.POWER_TOLERANCE if power_tolerance is None else power_tolerance
+        self.dwell = SettleDetector.DWELL if dwell is None else dwell
+        self.timeout = SettleDetector.TIMEOUT if timeout is None else timeout
+        self.poll_interval = poll_interval
+        self.callback = callback
+
+    @staticmethod
+    def nop_ready(nop):
+        """True if the NOP register shows no pending operation"""
+        return 0 < nop <= 16
+
+    def interval(self, laser):
+        """Seconds to sleep between polls. Polling takes at most ``LINK_SHARE`` of the link's time."""
+        if self.poll_interval is not None:
+            return self.poll_interval
+        round_trip = laser.frame_timing()['mean']
+        if round_trip is None:
+            return SettleDetector.MIN_POLL_INTERVAL
+        busy = len(SettleDetector.REGISTERS) * round_trip
+        return max(SettleDetector.MIN_POLL_INTERVAL, busy * (1 - SettleDetector.LINK_SHARE) / SettleDetector.LINK_SHARE)
+
+    def sample(self, values):
+        """Makes a ``SettleSample`` from the values of ``REGISTERS`` and passes it to the callback"""
+        offset, nop, power = values
+        sample = SettleSample(time=time.perf_counter(), offset=offset / 10, nop=nop, power=power / 100)
+        if self.callback:
+            self.callback(sample)
+        return sample
+
+    def poll(self, laser):
+        """Reads the offset, NOP and power in one pipelined batch"""
+        return self.sample(laser.read_many(SettleDetector.REGISTERS, [True, False, True]))
+
+    async def poll_async(self, laser):
+        """Reads the offset, NOP and power of an ``AsyncLaser`` in one pipelined batch"""
+        return self.sample(await laser.read_many(SettleDetector.REGISTERS, [True, False, True]))
+
+    def wait_for(self, laser, condition, dwell=None):
+        """Polls until ``condition(sample)`` has held for ``dwell`` seconds or the timeout passes
+
+        :return: (seconds waited, True if the condition was met, last sample)
+        """
+        interval = self.interval(laser)
+        phase = PhaseWait(condition, self.dwell if dwell is None else dwell, self.timeout)
+        while True:
+            result = phase.check(self.poll(laser))
+            if result is not None:
+                return result
+            time.sleep(interval)
+
+    async def wait_for_async(self, laser, condition, dwell=None):
+        """``wait_for`` for an ``AsyncLaser``, sleeping with ``asyncio.sleep`` between polls"""
+        interval = self.interval(laser)
+        phase = PhaseWait(condition, self.dwell if dwell is None else dwell, self.timeout)
+        while True:
+            result = phase.check(await self.poll_async(laser))
+            if result is not None:
+                return result
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def ready(sample):
+        return SettleDetector.nop_ready(sample.nop)
+
+    def tuned(self, sample):
+        return abs(sample.offset) <= self.offset_tolerance and SettleDetector.nop_ready(sample.nop)
+
+    def power_recovered(self, power_reference):
+        """Returns the condition that the power is within tolerance of ``power_reference`` dBm"""
+        return lambda sample: sample.power >= power_reference - self.power_tolerance
+
+    def wait_ready(self, laser):
+        """Waits for the NOP register to show the laser is ready. A ready NOP needs no dwell."""
+        return self.wait_for(laser, SettleDetector.ready, dwell=0)
+
+    def wait_tuned(self, laser):
+        """Waits for the jump offset to be within tolerance with the laser ready"""
+        return self.wait_for(laser, self.tuned)
+
+    def wait_power(self, laser, power_reference):
+        """Waits for the optical power to be within tolerance of ``power_reference`` dBm"""
+        return self.wait_for(laser, self.power_recovered(power_reference))
+
+    async def wait_ready_async(self, laser):
+        return await self.wait_for_async(laser, SettleDetector.ready, dwell=0)
+
+    async def wait_tuned_async(self, laser):
+        return await self.wait_for_async(laser, self.tuned)
+
+    async def wait_power_async(self, laser, power_reference):
+        return await self.wait_for_async(laser, self.power_recovered(power_reference))
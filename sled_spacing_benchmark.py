@@ -0,0 +1,62 @@
+"""
+Benchmark of the sled temperature clustering used to find the sled mode spacing.
+
+Writes synthetic ``.sled`` files of increasing length, with a few noisy outlier lines and one missing mode, and times
+reading and clustering each one. The time per line should stay flat as the file grows.
+
+Usage: python sled_spacing_benchmark.py [largest file length]
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+import numpy as np
+
+from calibration import Calibration
+
+SLED_SPACING = 3.15  # C, the spacing the clustering should recover
+MODES = (0, 1, 2, 4, 5, 6, 7)  # Mode 3 is missing from the file
+OUTLIER_LINES = 5  # Lines with a temperature halfway between two modes
+
+
+def write_sled_file(file_name, lines, rng):
+    """Writes a .sled file in the laser's format with the given number of lines"""
+    modes = rng.choice(MODES, lines)
+    temps = 20 + modes * SLED_SPACING + rng.normal(0, 0.1, lines)
+    temps[rng.choice(lines, OUTLIER_LINES, replace=False)] += SLED_SPACING / 2
+    freqs = rng.uniform(191.5, 196.25, lines)
+    currents = rng.integers(1400, 1500, lines)
+
+    with open(file_name, 'w') as sled_file:
+        for freq, temp, current in zip(freqs, temps, currents):
+            sled_file.write('freq = %.1f sled = %d current = %d\n' % (freq, round(temp * 100), current))
+
+
+def run(max_lines=100000):
+    rng = np.random.default_rng(0)
+    Calibration.cluster_sled_temperatures([20, 20 + SLED_SPACING])  # Warm up NumPy before timing
+    print('%8s %12s %12s %10s %10s %10s' % ('lines', 'read ms', 'cluster ms', 'us/line', 'spacing', 'error'))
+    with tempfile.TemporaryDirectory() as directory:
+        lines = 1000
+        while lines <= max_lines:
+            file_name = os.path.join(directory, 'synthetic_%d.sled' % lines)
+            write_sled_file(file_name, lines, rng)
+
+            start = time.perf_counter()
+            temps = Calibration.read_sled_temperatures(file_name)
+            read_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            clusters = Calibration.cluster_sled_temperatures(temps)
+            cluster_time = time.perf_counter() - start
+
+            print('%8d %12.2f %12.2f %10.3f %10.4f %10.4f' % (lines, read_time * 1000, cluster_time * 1000,
+                                                              (read_time + cluster_time) / lines * 1e6,
+                                                              clusters.spacing, clusters.spacing_error))
+            lines *= 10
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
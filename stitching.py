@@ -0,0 +1,153 @@
+"""
+Stitching of overlapping scan segments into one spectrum.
+
+Neighbouring segments of a mode-finder scan record the same few GHz, and each segment's frequencies are only as
+accurate as the laser's clean jump, so concatenating them gives duplicated, out of order samples with small jumps in
+frequency. ``SpectrumStitcher`` does the following with each segment, in order of increasing frequency:
+
+1. Averages the segment onto a common grid of ``GRID_STEP`` GHz.
+2. Finds the shift that best aligns it with the spectrum so far by cross-correlating the overlap, and applies it.
+3. Averages the grid points that both segments cover.
+
+Grid points below the start of the newest segment cannot change any more. They are passed to the ``sink`` straight
+away, so memory use stays at about one segment and the output is monotonic in frequency.
+"""
+
+import logging
+
+import numpy as np
+
+
+class SpectrumStitcher:
+    """Merges segments arriving in order of increasing frequency into a monotonic spectrum on a regular grid"""
+    GRID_STEP = 0.02  # GHz
+    MAX_SHIFT = 0.5  # GHz, largest frequency correction looked for between neighbouring segments
+    MIN_CONTRAST = 0.02  # Relative standard deviation of the overlap needed to align on it
+    MIN_CORRELATION = 0.5  # Correlation coefficient of the aligned overlaps needed to apply the shift
+
+    def __init__(self, sink, grid_step=GRID_STEP, max_shift=MAX_SHIFT):
+        """
+        :param sink: function called with (frequencies in THz, transmissions) arrays of each finished part of the
+            spectrum, in order of increasing frequency
+        :param grid_step: GHz between the points of the stitched spectrum
+        :param max_shift: largest frequency correction in GHz looked for between neighbouring segments
+        """
+        self.sink = sink
+        self.grid_step = grid_step
+        self.max_shift = max_shift
+        self.shifts = []  # GHz subtracted from the frequencies of each segment
+        self._start = None  # Grid index of the first pending point
+        self._sum = np.empty(0)
+        self._count = np.empty(0)
+        self._emitted = None  # Grid index up to which the spectrum has been passed to the sink
+
+    def add_segment(self, frequencies, transmissions):
+        """Adds one segment's samples. Segments must start at increasing frequencies.
+
+        :param frequencies: THz
+        :param transmissions: transmission of each sample
+        :return: the frequency correction applied to the segment in GHz
+        """
+        frequencies = np.asarray(frequencies, dtype=float) * 1000
+        transmissions = np.asarray(transmissions, dtype=float)
+        if frequencies.size == 0:
+            self.shifts.append(0.0)
+            return 0.0
+
+        shift = self._align(*self._resample(frequencies, transmissions))
+        first, values = self._resample(frequencies - shift, transmissions)
+        self.shifts.append(shift)
+
+        if self._emitted is not None and first < self._emitted:
+            # Anything below the emitted part of the spectrum can no longer be merged
+            values = values[self._emitted - first:]
+            first = self._emitted
+        if values.size:
+            self._accumulate(first, values)
+            self._emit(first)
+        return shift
+
+    def close(self):
+        """Passes the rest of the spectrum to the sink"""
+        if self._start is not None:
+            self._emit(self._start + self._sum.size)
+
+    def _resample(self, frequencies, transmissions):
+        """Averages samples onto the grid and interpolates grid points without samples
+
+        :param frequencies: GHz
+        :return: (grid index of the first point, values of the consecutive grid points)
+        """
+        index = np.round(frequencies / self.grid_step).astype(np.int64)
+        first = index.min()
+        sums = np.bincount(index - first, weights=transmissions)
+        counts = np.bincount(index - first)
+        filled = np.flatnonzero(counts)
+        values = np.interp(np.arange(sums.size), filled, sums[filled] / counts[filled])
+        return first, values
+
+    def _align(self, first, values):
+        """Returns the shift in GHz that best aligns a resampled segment with the pending spectrum"""
+        if self._start is None:
+            return 0.0
+        pending_end = self._start + self._sum.size
+        overlap = min(pending_end, first + values.size) - first
+        max_lag = int(round(self.max_shift / self.grid_step))
+        # At the largest lag, at least half of the overlap must still be compared
+        if overlap < 2 * max_lag or first < self._start:
+            return 0.0
+
+        offset = first - self._start
+        previous = self._sum[offset:offset + overlap] / self._count[offset:offset + overlap]
+        current = values[:overlap]
+        if min(np.std(previous) / abs(np.mean(previous)), np.std(current) / abs(np.mean(current))) < \
+                SpectrumStitcher.MIN_CONTRAST:
+            return 0.0
+
+        previous = (previous - previous.mean()) / previous.std()
+        current = (current - current.mean()) / current.std()
+        # correlation[lag] compares previous[i] with current[i + lag], averaged over the points both cover
+        full = np.correlate(current, previous, mode='full')
+        lags = np.arange(-max_lag, max_lag + 1)
+        correlation = full[lags + overlap - 1] / (overlap - np.abs(lags))
+        best = int(np.argmax(correlation))
+        if correlation[best] < SpectrumStitcher.MIN_CORRELATION:
+            return 0.0
+
+        # Parabolic interpolation between the lags around the peak
+        lag = float(lags[best])
+        if 0 < best < lags.size - 1:
+            left, peak, right = correlation[best - 1:best + 2]
+            curvature = left - 2 * peak + right
+            if curvature < 0:
+                lag += 0.5 * (left - right) / curvature
+        shift = float(lag * self.grid_step)
+        logging.debug('Segment shifted by %.3f GHz (correlation %.2f)' % (shift, correlation[best]))
+        return shift
+
+    def _accumulate(self, first, values):
+        """Adds resampled values to the pending spectrum, extending it as needed"""
+        if self._start is None:
+            self._start = first
+        end = max(self._start + self._sum.size, first + values.size)
+        if end - self._start > self._sum.size:
+            grow = end - self._start - self._sum.size
+            self._sum = np.concatenate((self._sum, np.zeros(grow)))
+            self._count = np.concatenate((self._count, np.zeros(grow)))
+        offset = first - self._start
+        self._sum[offset:offset + values.size] += values
+        self._count[offset:offset + values.size] += 1
+
+    def _emit(self, until):
+        """Passes the pending grid points below grid index ``until`` to the sink"""
+        count = until - self._start
+        if count <= 0:
+            return
+        sums, counts = self._sum[:count], self._count[:count]
+        covered = counts > 0
+        index = self._start + np.flatnonzero(covered)
+        self.sink(index * self.grid_step / 1000, sums[covered] / counts[covered])
+        self._sum = self._sum[count:]
+        self._count = self._count[count:]
+        self._start = until
+        self._emitted = until